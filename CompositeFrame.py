@@ -0,0 +1,86 @@
+#   CompositeFrame.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from PIL import Image
+
+from ImageLoader import ImageLoader
+from helper import BG_COLOR, MULTI_STIMULUS_GAP
+
+
+class CompositeFrame:
+    """Displays several views side by side as a single Tk image, used by the multi stimulus method.
+
+    The views are copied into a composite PIL image, which is then copied into the Tk image of the panel at once,
+    so that all the views of a frame are always displayed together. Both images are only created again when the
+    number or the size of the views changes.
+    """
+
+    def __init__(self, panel, gap=MULTI_STIMULUS_GAP):
+        """Initializes a composite frame.
+
+        :param panel: The panel on which the frame is displayed.
+        :param gap: The space in pixels between two views.
+        """
+        self.panel = panel
+        self.gap = gap
+        self.canvas = None
+        # x coordinate of each view in the frame, and size of the views
+        self.offsets = []
+        self.view_sizes = []
+
+    def show(self, views):
+        """Displays views, from left to right.
+
+        :param views: The views, as PIL images.
+        """
+        view_sizes = [view.size for view in views]
+
+        if view_sizes != self.view_sizes:
+            self.view_sizes = view_sizes
+            self.offsets = []
+            x = 0
+            for width, _ in view_sizes:
+                self.offsets.append(x)
+                x += width + self.gap
+            self.canvas = Image.new("RGB", (x - self.gap, max(height for _, height in view_sizes)), BG_COLOR)
+
+        for view, x in zip(views, self.offsets):
+            self.canvas.paste(view, (x, 0))
+
+        photo_img = getattr(self.panel, "image", None)
+        if photo_img is not None and (photo_img.width(), photo_img.height()) == self.canvas.size:
+            photo_img.paste(self.canvas)
+        else:
+            photo_img = ImageLoader.to_photo_image(self.canvas)
+            self.panel.configure(image=photo_img)
+            self.panel.image = photo_img
+
+    def locate(self, x, y):
+        """Returns the view at a point of the frame, as a tuple (index of the view, x, y in the view, view size),
+        or None if the point is not on a view (e.g. between two views).
+
+        :param x: The x coordinate of the point in the frame.
+        :param y: The y coordinate of the point in the frame.
+        """
+        for i, (offset, size) in enumerate(zip(self.offsets, self.view_sizes)):
+            if offset <= x < offset + size[0] and 0 <= y < size[1]:
+                return i, x - offset, y, size
+
+        return None
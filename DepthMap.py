@@ -0,0 +1,106 @@
+#   DepthMap.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+
+from LFContainer import open_depth_map
+from helper import clamp
+
+
+class DepthMap:
+    """Gives the focus depth of each pixel of a light-field image.
+
+    The depth map is only read the first time it is queried. Its grey levels are then converted once into
+    indices of depth slices (uint8), and a pyramid of these indices downsampled by 2 at each level is built,
+    so that the median depth over a neighbourhood of any size can be computed in constant time.
+    """
+
+    def __init__(self, img_name, reference_img_name, nb_img_depth):
+        """Initializes a depth map. Nothing is read from disk yet.
+
+        :param img_name: The name of the image, whose container is searched first.
+        :param reference_img_name: The name of the reference image, which gives the name of the depth map file.
+        :param nb_img_depth: The number of depth slices.
+        """
+        self.img_name = img_name
+        self.reference_img_name = reference_img_name
+        self.nb_img_depth = nb_img_depth
+        self.pyramid = None
+
+    def get_pyramid(self):
+        """Returns the list of the arrays of depth indices, from full resolution to the coarsest level."""
+
+        if self.pyramid is None:
+            grey_levels = np.asarray(open_depth_map(self.img_name, self.reference_img_name).convert("L"))
+
+            # Grey level -> depth index, computed once for the 256 possible levels
+            lookup = np.round(np.arange(256) / 255 * (self.nb_img_depth - 1)).astype(np.uint8)
+            self.pyramid = [lookup[grey_levels]]
+
+            while min(self.pyramid[-1].shape) >= 2:
+                level = self.pyramid[-1]
+                height, width = level.shape[0] // 2 * 2, level.shape[1] // 2 * 2
+                blocks = np.stack([level[0:height:2, 0:width:2], level[1:height:2, 0:width:2],
+                                   level[0:height:2, 1:width:2], level[1:height:2, 1:width:2]], axis=-1)
+                # Lower median of the 4 pixels of each block
+                self.pyramid.append(np.sort(blocks, axis=-1)[:, :, 1])
+
+        return self.pyramid
+
+    def nbytes(self):
+        """Returns the number of bytes held by the pyramid, 0 if the depth map was not read."""
+
+        return sum(level.nbytes for level in self.pyramid) if self.pyramid is not None else 0
+
+    def release(self):
+        """Frees the pyramid. The depth map is read again if it is queried."""
+
+        self.pyramid = None
+
+    def get_size(self):
+        """Returns the size (width, height) of the depth map, which is the size of the original views."""
+
+        indices = self.get_pyramid()[0]
+        return indices.shape[1], indices.shape[0]
+
+    def depth_at(self, x, y, radius=0):
+        """Returns the index of the depth slice at the given pixel.
+
+        :param x: The x coordinate of the pixel.
+        :param y: The y coordinate of the pixel.
+        :param radius: If it is not 0, the median depth over a neighbourhood of about this radius (in pixels)
+                       is returned, which avoids refocusing on noise at the edges of objects.
+        """
+        pyramid = self.get_pyramid()
+
+        # Go down the pyramid until the neighbourhood is at most 3x3 pixels
+        level = 0
+        while radius > 1 and level + 1 < len(pyramid):
+            radius //= 2
+            level += 1
+
+        indices = pyramid[level]
+        x = clamp(int(x) >> level, 0, indices.shape[1] - 1)
+        y = clamp(int(y) >> level, 0, indices.shape[0] - 1)
+
+        if radius == 0:
+            return int(indices[y, x])
+
+        return int(np.median(indices[max(0, y - radius):y + radius + 1, max(0, x - radius):x + radius + 1]))
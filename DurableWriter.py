@@ -0,0 +1,259 @@
+#   DurableWriter.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Writing of the output files of a test session from a background thread, so that the GUI never waits for the disk.
+
+The data written by the Tk thread is put in a queue and appended to the files by a writer thread. The files written
+are synced to disk together (group commit) at most DURABLE_COMMIT_INTERVAL seconds after the first write, or when
+a commit is requested, and their committed sizes are then appended to a journal (<session>-journal.txt). After a
+crash, recover() truncates the files to their last committed sizes, which removes any partially written record.
+
+Usage:
+    python DurableWriter.py output/<session>-journal.txt ...   Recovers the files of sessions that did not end properly
+"""
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+from helper import DURABLE_COMMIT_INTERVAL
+
+# Operations sent to the writer thread
+OPEN, APPEND, REPLACE, COMMIT, CLOSE, STOP = range(6)
+
+
+class DurableStream:
+    """File-like object whose data is written by a DurableWriter. Its methods never wait for the disk."""
+
+    def __init__(self, writer, path, binary):
+        self.writer = writer
+        self.path = path
+        self.binary = binary
+
+    def write(self, data):
+        """Appends a string (or bytes for a binary stream) to the file."""
+
+        if not self.binary:
+            data = data.encode("utf-8")
+        self.writer.queue.put((APPEND, self.path, data))
+
+    def flush(self):
+        """Requests the data written so far to be committed to disk as soon as possible.
+
+        :raise OSError: If the writer failed to write or commit data since it started.
+        """
+        self.writer.commit()
+        self.writer.check_error()
+
+    def close(self):
+        """Commits the data written and closes the file.
+
+        :raise OSError: If the writer failed to write or commit data since it started.
+        """
+        self.writer.queue.put((CLOSE, self.path, None))
+        self.writer.check_error()
+
+
+class DurableWriter:
+    """Writes files from a background thread with group commits recorded in a journal."""
+
+    def __init__(self, journal_path, commit_interval=DURABLE_COMMIT_INTERVAL):
+        """Initializes a writer and starts its thread.
+
+        :param journal_path: The path of the journal, in which the committed sizes of the files are appended.
+        :param commit_interval: The maximum time (in seconds) between a write and its commit.
+        """
+        self.journal_path = journal_path
+        self.commit_interval = commit_interval
+        self.queue = queue.SimpleQueue()
+
+        # Only used by the writer thread
+        self.journal = open(journal_path, "a")
+        self.files = {}
+        self.committed_sizes = {}
+        self.dirty_paths = set()
+        self.nb_commits = 0
+        # First exception raised by the writer thread, re-raised in the Tk thread by check_error()
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run, name="DurableWriter", daemon=True)
+        self.thread.start()
+
+    def open_stream(self, path, binary=False):
+        """Opens a file for writing, truncating it if it exists.
+
+        :param path: The path of the file.
+        :param binary: If True, bytes are written to the stream, otherwise strings (encoded in UTF-8).
+        :return: A DurableStream.
+        """
+        self.queue.put((OPEN, path, None))
+        return DurableStream(self, path, binary)
+
+    def replace(self, path, data):
+        """Atomically replaces the content of a file (e.g. metadata rewritten as a whole).
+
+        :param path: The path of the file.
+        :param data: The new content, as bytes.
+        """
+        self.queue.put((REPLACE, path, data))
+
+    def commit(self):
+        """Requests the data written so far to be committed to disk as soon as possible."""
+
+        self.queue.put((COMMIT, None, None))
+
+    def close(self):
+        """Commits all the data written, closes the files and waits for the writer thread to end.
+
+        :raise OSError: If the writer failed to write or commit data since it started.
+        """
+        self.queue.put((STOP, None, None))
+        self.thread.join()
+        self.check_error()
+
+    def check_error(self):
+        """Raises the first exception of the writer thread, if any: the data written since then may not be on disk."""
+
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        """Main loop of the writer thread."""
+
+        deadline = None
+
+        while True:
+            try:
+                op, path, data = self.queue.get(timeout=None if deadline is None
+                                                else max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                op, path, data = COMMIT, None, None
+
+            try:
+                if op == APPEND:
+                    self.files[path].write(data)
+                    self.dirty_paths.add(path)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.commit_interval
+                elif op == OPEN:
+                    self.files[path] = open(path, "wb")
+                    self.committed_sizes[path] = 0
+                    self.dirty_paths.add(path)
+                    self.group_commit()
+                elif op == REPLACE:
+                    tmp_path = path + ".tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, path)
+                elif op == CLOSE:
+                    self.group_commit()
+                    self.files.pop(path).close()
+                elif op == COMMIT:
+                    # Reset first, so that a failed commit is retried at the next interval instead of at once
+                    deadline = None
+                    self.group_commit()
+                elif op == STOP:
+                    try:
+                        self.group_commit()
+                        self.write_journal({"closed": True})
+                    finally:
+                        for f in self.files.values():
+                            f.close()
+                        self.files = {}
+                        self.journal.close()
+            except Exception as e:
+                # The session goes on, the error is reported by the next flush() or close() of a stream
+                if self.error is None:
+                    self.error = e
+                traceback.print_exc()
+
+            if op == STOP:
+                return
+
+    def group_commit(self):
+        """Syncs all the files written since the last commit, then records their sizes in the journal."""
+
+        if not self.dirty_paths:
+            return
+
+        for path in self.dirty_paths:
+            f = self.files[path]
+            f.flush()
+            os.fsync(f.fileno())
+            self.committed_sizes[path] = f.tell()
+        self.dirty_paths = set()
+
+        self.nb_commits += 1
+        self.write_journal({"commit": self.nb_commits, "time_ns": time.time_ns(), "sizes": self.committed_sizes})
+
+    def write_journal(self, entry):
+        self.journal.write(json.dumps(entry) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+
+def recover(journal_path):
+    """Truncates the files of a session to their last committed sizes, removing the data of an incomplete write.
+
+    :param journal_path: The path of the journal of the session.
+    :return: A dictionary {path: (size before, size after)} of the files truncated,
+             or None if the session ended properly.
+    """
+    last_commit = None
+    is_closed = False
+
+    with open(journal_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Last line partially written
+                break
+            if "sizes" in entry:
+                last_commit = entry
+            is_closed = entry.get("closed", False)
+
+    if is_closed:
+        return None
+
+    truncated = {}
+    for path, size in (last_commit["sizes"] if last_commit is not None else {}).items():
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            truncated[path] = (os.path.getsize(path), size)
+            os.truncate(path, size)
+
+    return truncated
+
+
+if __name__ == "__main__":
+    for journal_path in sys.argv[1:]:
+        result = recover(journal_path)
+        if result is None:
+            print("{}: the session ended properly".format(journal_path))
+        else:
+            print("{}: {} file(s) truncated".format(journal_path, len(result)))
+            for path, (old_size, new_size) in result.items():
+                print("  {}: {} -> {} bytes".format(path, old_size, new_size))
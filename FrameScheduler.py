@@ -0,0 +1,122 @@
+#   FrameScheduler.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+
+
+class FrameScheduler:
+    """Plays sequences of frames (e.g. the preview or the refocus animation) from the Tk main loop.
+
+    Each frame is displayed at a deadline computed from the start of the sequence with a monotonic clock,
+    so that delays do not accumulate. When the main loop falls behind, the frames whose display time
+    is already over are dropped.
+    """
+
+    def __init__(self, root):
+        """Initializes a frame scheduler.
+
+        :param root: The Tk root window, used to schedule the frames in the main loop.
+        """
+        self.root = root
+        self.frames = None
+        self.deadlines = None
+        self.on_done = None
+        self.index = 0
+        self.after_id = None
+
+        # Frames actually displayed in the last sequence: (index, scheduled time, actual time),
+        # times being in seconds from the start of the sequence
+        self.frame_times = []
+        self.nb_dropped = 0
+
+    def play(self, frames, on_done=None):
+        """Plays a sequence of frames, cancelling the sequence being played if any.
+
+        :param frames: List of tuples (function displaying the frame, time the frame is displayed in seconds).
+        :param on_done: Function called once the last frame has been displayed for its duration.
+        """
+        self.cancel()
+
+        start = time.perf_counter()
+        self.deadlines = []
+        for _, duration in frames:
+            self.deadlines.append(start)
+            start += duration
+        self.deadlines.append(start)
+
+        self.frames = frames
+        self.on_done = on_done
+        self.index = 0
+        self.frame_times = []
+        self.nb_dropped = 0
+
+        self.tick()
+
+    def is_running(self):
+        return self.frames is not None
+
+    def cancel(self):
+        """Stops the sequence being played. on_done is not called."""
+
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        self.frames = None
+
+    def tick(self):
+        """Displays the frame due, and schedules the next one."""
+
+        self.after_id = None
+        now = time.perf_counter()
+
+        if self.index < len(self.frames):
+            # Drop the frames that should already have been replaced
+            while self.index + 1 < len(self.frames) and self.deadlines[self.index + 1] <= now:
+                self.index += 1
+                self.nb_dropped += 1
+
+            show_frame, _ = self.frames[self.index]
+            show_frame()
+            self.frame_times.append((self.index, self.deadlines[self.index] - self.deadlines[0],
+                                     now - self.deadlines[0]))
+            self.index += 1
+
+        if self.index < len(self.frames) or now < self.deadlines[-1]:
+            delay = max(0, int(round((self.deadlines[self.index] - time.perf_counter()) * 1000)))
+            self.after_id = self.root.after(delay, self.tick)
+        else:
+            on_done = self.on_done
+            self.frames = None
+            if on_done is not None:
+                on_done()
+
+    def report(self):
+        """Returns a string describing the timing achieved for the last sequence played."""
+
+        if not self.frame_times:
+            return "no frame displayed"
+
+        lateness = [actual - scheduled for _, scheduled, actual in self.frame_times]
+        jitter = [abs((b[2] - a[2]) - (b[1] - a[1])) for a, b in zip(self.frame_times, self.frame_times[1:])]
+
+        return "{} frames displayed, {} dropped, lateness mean {:.1f} ms / max {:.1f} ms, jitter mean {:.1f} ms"\
+            .format(len(self.frame_times), self.nb_dropped,
+                    1000 * sum(lateness) / len(lateness), 1000 * max(lateness),
+                    1000 * sum(jitter) / max(1, len(jitter)))
@@ -0,0 +1,329 @@
+#   ImageLoader.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import io
+import os
+import queue
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageTk
+
+from LFContainer import find_packed_image
+
+# Note: this module is imported by the worker processes, it should not import any module
+# with side effects (e.g. opening files or windows).
+
+# Maximum time (in seconds) spent converting images into PhotoImages in one call of the Tk main loop
+BATCH_TIME = 0.008
+# Delay (in milliseconds) between two batches
+BATCH_INTERVAL = 5
+# Maximum number of images of a loader being decoded or waiting for a worker process. The other images are only
+# submitted when these are done, so that a loader started later or with a higher priority does not wait for them.
+MAX_IN_FLIGHT = 2 * (os.cpu_count() or 1)
+
+
+def fit_size(size, max_size):
+    """Returns the size of an image scaled down to fit in max_size, keeping its aspect ratio.
+
+    :param size: The size (width, height) of the image.
+    :param max_size: The maximum size (width, height), or None for no limit. Images are never upscaled.
+    """
+    if max_size is None:
+        return size
+
+    scale = min(1, max_size[0] / size[0], max_size[1] / size[1])
+    return max(1, int(round(size[0] * scale))), max(1, int(round(size[1] * scale)))
+
+
+def resample(img, max_size):
+    """Returns the image downscaled with a Lanczos filter to fit in max_size, or the image itself if it fits."""
+
+    size = fit_size(img.size, max_size)
+    if size == img.size:
+        return img
+    return img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+
+def decode_image(path, max_size=None):
+    """Decodes an image file into a plain pixel buffer. This function runs in a worker process.
+
+    :param path: The path of the image file.
+    :param max_size: If given, the image is downscaled to fit in this size (see resample).
+    :return: A tuple (mode, size, pixels, time spent reading the file, time spent decoding it), times being in ns.
+    """
+    start = time.perf_counter_ns()
+    with open(path, "rb") as f:
+        data = f.read()
+    read_end = time.perf_counter_ns()
+
+    with Image.open(io.BytesIO(data)) as img:
+        if img.mode not in ("L", "RGB", "RGBA"):
+            img = img.convert("RGB")
+        img = resample(img, max_size)
+        pixels = img.tobytes()
+        return img.mode, img.size, pixels, read_end - start, time.perf_counter_ns() - read_end
+
+
+def resample_packed_image(img_path, max_size):
+    """Reads an image from the container of its light-field image and downscales it. This function runs
+    in a worker process.
+
+    :param img_path: The path of the image, relative to IMG_PATH_PREFIX (e.g. "I01R1/003_004.png").
+    :param max_size: The image is downscaled to fit in this size (see resample).
+    :return: A tuple (mode, size, pixels, time spent reading the image, time spent downscaling it), times being in ns.
+    """
+    start = time.perf_counter_ns()
+    img = find_packed_image(img_path)
+    read_end = time.perf_counter_ns()
+
+    img = resample(img, max_size)
+    pixels = img.tobytes()
+    return img.mode, img.size, pixels, read_end - start, time.perf_counter_ns() - read_end
+
+
+class ImageLoader:
+    """Loads a set of images without blocking the GUI.
+
+    Image files are decoded in parallel by a pool of worker processes shared by all loaders.
+    The decoded pixels are then converted into PhotoImages by the Tk main loop, in small
+    batches scheduled with after(), so that the GUI stays responsive.
+
+    A loader can be paused, to leave the worker processes and the disk to other loaders, and cancelled.
+    """
+
+    pool = None
+
+    def __init__(self, root, on_loaded, on_complete=None, on_timing=None, max_size=None, convert=None,
+                 is_available=None, on_error=None):
+        """Initializes a loader.
+
+        :param root: The Tk root window, used to schedule the conversions in the main loop.
+        :param on_loaded: Function called with (key, view) in the Tk thread for each image loaded.
+        :param on_complete: Function called in the Tk thread once all the images are loaded.
+        :param on_timing: If given, function called with (key, phase, duration in ns) in the Tk thread for
+                          the phases "read", "decode" and "photo_image" of each image loaded.
+        :param max_size: If given, the images are downscaled to fit in this size (width, height).
+        :param convert: Function converting the PIL images into the views given to on_loaded, by default
+                        into PhotoImages (see to_photo_image).
+        :param is_available: If given, function called with the key of each image file before it is decoded.
+                             If it returns True (e.g. the image was loaded by another loader in the meantime),
+                             the image is not decoded and on_loaded is called with (key, None).
+        :param on_error: Function called with (key, exception) in the Tk thread for each image that could not be
+                         decoded, instead of on_loaded. By default, the traceback is printed.
+        """
+        self.root = root
+        self.on_loaded = on_loaded
+        self.on_complete = on_complete
+        self.on_timing = on_timing
+        self.max_size = max_size
+        self.convert = convert
+        self.is_available = is_available
+        self.on_error = on_error
+        self.decoded = queue.SimpleQueue()
+        self.nb_pending = 0
+        self.nb_added = 0
+        self.is_draining = False
+        self.is_paused = False
+        self.is_cancelled = False
+        # Decoding tasks (key, function, args) not submitted yet, and futures of the tasks submitted
+        self.waiting = deque()
+        self.futures = set()
+
+    @staticmethod
+    def to_photo_image(img):
+        """Converts a PIL image into a Tk image. This method must be called from the Tk thread."""
+
+        return ImageTk.PhotoImage(img)
+
+    @classmethod
+    def get_pool(cls):
+        if cls.pool is None:
+            cls.pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+        return cls.pool
+
+    @classmethod
+    def shutdown(cls, wait=False):
+        """Stops the worker processes.
+
+        :param wait: If True, waits for the worker processes to end (e.g. to read their resource usage).
+        """
+        if cls.pool is not None:
+            cls.pool.shutdown(wait=wait, cancel_futures=True)
+            cls.pool = None
+
+    def add_file(self, key, path):
+        """Schedules the decoding of an image file.
+
+        :param key: The key given back to on_loaded with the image.
+        :param path: The path of the image file.
+        """
+        self.nb_pending += 1
+        self.nb_added += 1
+        self.waiting.append((key, decode_image, (path, self.max_size)))
+
+    def add_packed_image(self, key, img_path):
+        """Schedules the downscaling of an image read from a container, which is done by the worker processes.
+
+        :param key: The key given back to on_loaded with the image.
+        :param img_path: The path of the image, relative to IMG_PATH_PREFIX (e.g. "I01R1/003_004.png").
+        """
+        self.nb_pending += 1
+        self.nb_added += 1
+        self.waiting.append((key, resample_packed_image, (img_path, self.max_size)))
+
+    def add_image(self, key, img):
+        """Schedules the conversion of an image that does not need to be decoded (e.g. read from a container).
+
+        :param key: The key given back to on_loaded with the image.
+        :param img: The PIL image.
+        """
+        self.nb_pending += 1
+        self.nb_added += 1
+        self.decoded.put((key, img))
+
+    def get_progress(self):
+        """Returns the fraction of the images added that are loaded."""
+
+        return 1 - self.nb_pending / self.nb_added if self.nb_added > 0 else 1
+
+    def submit_waiting(self):
+        """Submits decoding tasks to the worker processes, up to MAX_IN_FLIGHT at the same time."""
+
+        while self.waiting and len(self.futures) < MAX_IN_FLIGHT:
+            key, function, args = self.waiting.popleft()
+            if self.is_available is not None and self.is_available(key):
+                self.decoded.put((key, None))
+                continue
+            future = self.get_pool().submit(function, *args)
+            self.futures.add(future)
+            future.add_done_callback(lambda f, key=key: self.on_decoded(key, f))
+
+    def on_decoded(self, key, future):
+        """Called by the thread of the pool when a decoding task is done."""
+
+        # The pixels decoded after the loader was cancelled are not kept
+        if not self.is_cancelled:
+            self.decoded.put((key, future))
+            if self.is_cancelled:
+                # Cancelled in the meantime, after the queue was cleared
+                self.clear_decoded()
+
+    def start(self):
+        """Starts loading the images and handing them over to the Tk main loop.
+        It should be called once all images are added."""
+
+        if self.is_paused or self.is_cancelled:
+            return
+
+        self.submit_waiting()
+        if not self.is_draining:
+            self.is_draining = True
+            self.root.after(0, self.drain)
+
+    def pause(self):
+        """Stops submitting images to the worker processes and converting them, until resume() is called.
+        The images being decoded are kept."""
+
+        self.is_paused = True
+
+    def resume(self):
+        self.is_paused = False
+        self.start()
+
+    def cancel(self):
+        """Stops loading the images. on_loaded and on_complete are not called anymore."""
+
+        self.is_cancelled = True
+        self.waiting.clear()
+        for future in self.futures:
+            future.cancel()
+        self.futures = set()
+        self.clear_decoded()
+
+    def clear_decoded(self):
+        """Releases the decoded pixels that were not converted, even if the loader is still referenced."""
+
+        while True:
+            try:
+                self.decoded.get_nowait()
+            except queue.Empty:
+                break
+
+    def drain(self):
+        """Converts the decoded images into PhotoImages until the batch time is elapsed."""
+
+        if self.is_paused or self.is_cancelled:
+            self.is_draining = False
+            return
+
+        deadline = time.perf_counter() + BATCH_TIME
+
+        while self.nb_pending > 0 and not self.is_cancelled and time.perf_counter() < deadline:
+            try:
+                key, result = self.decoded.get_nowait()
+            except queue.Empty:
+                break
+
+            self.nb_pending -= 1
+            if result is None:
+                self.on_loaded(key, None)
+                continue
+            elif isinstance(result, Image.Image):
+                img = resample(result, self.max_size)
+            else:
+                self.futures.discard(result)
+                try:
+                    mode, size, pixels, read_ns, decode_ns = result.result()
+                except Exception as e:
+                    if self.on_error is not None:
+                        self.on_error(key, e)
+                    else:
+                        traceback.print_exc()
+                    continue
+                img = Image.frombuffer(mode, size, pixels, "raw", mode, 0, 1)
+                if self.on_timing is not None:
+                    self.on_timing(key, "read", read_ns)
+                    self.on_timing(key, "decode", decode_ns)
+
+            convert = self.convert or ImageLoader.to_photo_image
+            if self.on_timing is not None:
+                start = time.perf_counter_ns()
+                view = convert(img)
+                self.on_timing(key, "photo_image", time.perf_counter_ns() - start)
+            else:
+                view = convert(img)
+
+            self.on_loaded(key, view)
+
+        if self.is_cancelled:
+            self.is_draining = False
+            return
+
+        self.submit_waiting()
+
+        if self.nb_pending > 0:
+            self.root.after(BATCH_INTERVAL, self.drain)
+        else:
+            self.is_draining = False
+            if self.on_complete is not None:
+                self.on_complete()
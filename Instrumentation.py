@@ -0,0 +1,213 @@
+#   Instrumentation.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Timing of the interaction and of the loading of the images during a test session.
+
+The stages between a mouse event and the display of the new view are timestamped with the monotonic clock of the
+tracking log, and their latencies are accumulated in histograms. The duration of each phase of the loading (reading
+the file, decoding it and converting it into a Tk image) is summed per stimulus, and the timing of the frames of each
+preview is kept. Everything is written at the end of the session in <session>-performance.txt.
+
+The callers check instrumentation.enabled before calling any method, so that it costs nothing when it is disabled.
+"""
+
+import time
+from collections import OrderedDict
+
+from helper import ENABLE_INSTRUMENTATION
+
+# Interaction stages, in the order they happen. Their latencies are measured from the mouse event.
+STAGES = ["view_ready", "configured", "displayed"]
+# Loading phases, in the order they happen
+LOADING_PHASES = ["read", "decode", "photo_image"]
+
+# The histograms have one bin per power of 2 microseconds, up to about 16 s
+NB_BINS = 25
+
+
+class LatencyHistogram:
+    """Histogram of durations with logarithmic bins, whose size does not depend on the number of samples."""
+
+    def __init__(self):
+        self.counts = [0] * NB_BINS
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, duration_ns):
+        """Adds a duration in nanoseconds."""
+
+        self.counts[min(NB_BINS - 1, (duration_ns // 1000).bit_length())] += 1
+        self.count += 1
+        self.total_ns += duration_ns
+        self.max_ns = max(self.max_ns, duration_ns)
+
+    def percentile(self, q):
+        """Returns an upper bound of the q-th percentile in nanoseconds (the upper edge of its bin)."""
+
+        rank = q / 100 * self.count
+        total = 0
+        for i, count in enumerate(self.counts):
+            total += count
+            if count > 0 and total >= rank:
+                return min(self.max_ns, 1000 * (1 << i))
+        return self.max_ns
+
+    def summary(self):
+        """Returns a one-line description of the histogram, with times in milliseconds."""
+
+        if self.count == 0:
+            return "no sample"
+
+        return "n={:6}  mean={:8.3f}  p50<={:8.3f}  p90<={:8.3f}  p99<={:8.3f}  max={:8.3f} ms".format(
+            self.count, self.total_ns / self.count / 1e6, self.percentile(50) / 1e6, self.percentile(90) / 1e6,
+            self.percentile(99) / 1e6, self.max_ns / 1e6)
+
+
+class Instrumentation:
+    """Collects the timings of a test session."""
+
+    def __init__(self, enabled=ENABLE_INSTRUMENTATION):
+        """Initializes the instrumentation.
+
+        :param enabled: If False, the callers do not record anything.
+        """
+        self.enabled = enabled
+        self.histograms = OrderedDict()
+        # img_name -> {phase -> LatencyHistogram}
+        self.loading_phases = OrderedDict()
+        # img_name -> {"interactive" or "complete" -> time in ns since the start of the loading}
+        self.loading_times = OrderedDict()
+        # img_name -> timing of the frames of its last preview (see FrameScheduler.report())
+        self.preview_reports = OrderedDict()
+
+        # Time of the mouse event being handled, and True iff an idle callback is waiting for the display
+        self.input_time = None
+        self.input_name = None
+        self.is_display_pending = False
+
+    @staticmethod
+    def now():
+        """Returns the current time of the monotonic clock, in nanoseconds."""
+
+        return time.perf_counter_ns()
+
+    def record(self, name, duration_ns):
+        """Adds a duration to the histogram with the given name."""
+
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.add(duration_ns)
+
+    def start_input(self, name):
+        """Called when a mouse event starts being handled. The following stages are measured from this time.
+
+        :param name: The kind of event (e.g. "move").
+        """
+        self.input_time = self.now()
+        self.input_name = name
+
+    def end_input(self):
+        """Called when a mouse event has been handled, to record the time spent in the event handler."""
+
+        if self.input_time is not None:
+            self.record(self.input_name + ":handler", self.now() - self.input_time)
+
+    def mark(self, stage, root=None):
+        """Records the latency of a stage since the last mouse event.
+
+        :param stage: One of STAGES.
+        :param root: If given, the "displayed" stage is recorded once Tk has processed its pending
+                     redraws, i.e. once the main loop is idle again.
+        """
+        if self.input_time is None:
+            return
+
+        self.record(self.input_name + ":" + stage, self.now() - self.input_time)
+
+        if root is not None and not self.is_display_pending:
+            self.is_display_pending = True
+            root.after_idle(self.on_displayed)
+
+    def on_displayed(self):
+        self.is_display_pending = False
+        self.mark("displayed")
+        self.input_time = None
+
+    def record_loading_phase(self, img_name, phase, duration_ns):
+        """Adds the duration of a loading phase of one of the files of a stimulus.
+
+        :param img_name: The name of the stimulus.
+        :param phase: One of LOADING_PHASES.
+        :param duration_ns: The duration in nanoseconds.
+        """
+        phases = self.loading_phases.setdefault(img_name, OrderedDict((p, LatencyHistogram()) for p in LOADING_PHASES))
+        phases[phase].add(duration_ns)
+
+    def record_loading_time(self, img_name, event, duration_ns):
+        """Records the time a stimulus took to become interactive ("interactive") or fully loaded ("complete")."""
+
+        self.loading_times.setdefault(img_name, {})[event] = duration_ns
+
+    def record_preview(self, img_name, report):
+        """Records the timing of the frames of the preview of a stimulus, as returned by FrameScheduler.report()."""
+
+        self.preview_reports[img_name] = report
+
+    def report(self):
+        """Returns the report of the session as a string."""
+
+        lines = ["Interaction latencies (from the mouse event)"]
+        for name, histogram in self.histograms.items():
+            lines.append("  {:22} {}".format(name, histogram.summary()))
+
+        lines.append("")
+        lines.append("Loading (total time per phase, and time until interactive / fully loaded)")
+        for img_name in list(OrderedDict.fromkeys(list(self.loading_phases) + list(self.loading_times))):
+            phases = self.loading_phases.get(img_name, {})
+            times = self.loading_times.get(img_name, {})
+            lines.append("  {:30} {}  interactive={}  complete={}".format(
+                img_name,
+                "  ".join("{}={:.1f} ms ({} files)".format(phase, h.total_ns / 1e6, h.count)
+                          for phase, h in phases.items()),
+                _format_ms(times.get("interactive")), _format_ms(times.get("complete"))))
+
+        if self.preview_reports:
+            lines.append("")
+            lines.append("Previews")
+            for img_name, report in self.preview_reports.items():
+                lines.append("  {:30} {}".format(img_name, report))
+
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path):
+        """Writes the report of the session in a text file."""
+
+        with open(path, "w") as f:
+            f.write(self.report())
+
+
+def _format_ms(duration_ns):
+    return "-" if duration_ns is None else "{:.1f} ms".format(duration_ns / 1e6)
+
+
+# Instrumentation of the session
+instrumentation = Instrumentation()
@@ -0,0 +1,257 @@
+#   LFContainer.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+from PIL import Image
+
+from helper import IMG_PATH_PREFIX, IMG_FORMAT, CONTAINER_FORMAT
+
+# File layout: MAGIC, header length (little-endian uint32), JSON header, then the raw pixel
+# planes. The data section and each plane start on a multiple of ALIGNMENT bytes, and the
+# offsets stored in the header are relative to the start of the data section.
+# Colour images are stored as RGBX planes (4 bytes per pixel, the layout of RGB images in
+# Pillow), since Image.frombuffer copies RGB buffers and only maps the buffers of some modes.
+MAGIC = b"LFC1"
+ALIGNMENT = 64
+DEPTH_MAP_KEY = "depth_map"
+
+
+class LFContainer:
+    """Represents a packed light-field image: all its views, its refocus stack and its depth map
+    stored as raw pixel planes in a single memory-mapped file.
+
+    Entries are indexed by the name of the image file they were packed from, without extension
+    (e.g. "003_004" for a view, "003_004_005" for a refocused image), and by DEPTH_MAP_KEY.
+    """
+
+    # Containers already opened, indexed by image name (None if the image has no container)
+    opened = {}
+
+    def __init__(self, path):
+        """Opens and memory-maps a container file.
+
+        :param path: The path of the container file.
+        """
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a light-field container".format(path))
+
+        header_start = len(MAGIC) + 4
+        header_len, = struct.unpack_from("<I", self.mmap, len(MAGIC))
+        header = json.loads(self.mmap[header_start:header_start + header_len].decode("utf-8"))
+
+        self.img_name = header["img_name"]
+        self.entries = header["entries"]
+        self.buffer = memoryview(self.mmap)
+        self.data_start = _align(header_start + header_len)
+
+    @classmethod
+    def get(cls, img_name):
+        """Returns the container of the given light-field image, or None if it was not packed.
+
+        :param img_name: The name of the image (i.e. of the folder containing all its image files).
+        """
+        if img_name not in cls.opened:
+            path = container_path(img_name)
+            cls.opened[img_name] = cls(path) if os.path.exists(path) else None
+
+        return cls.opened[img_name]
+
+    def has(self, key):
+        return key in self.entries
+
+    def get_image(self, key):
+        """Returns the image stored under the given key.
+
+        The image is built directly on the mapped buffer: no pixel is copied nor decoded. Colour
+        images are returned in the RGBX mode, which Pillow and Tk handle as RGB. The RGB planes of the
+        containers packed before RGBX planes were used are still read, but copied by Pillow.
+
+        :param key: The key of the entry (e.g. "003_004").
+        """
+        entry = self.entries[key]
+        size = (entry["width"], entry["height"])
+        start = self.data_start + entry["offset"]
+        data = self.buffer[start:start + entry["length"]]
+
+        return Image.frombuffer(entry["mode"], size, data, "raw", entry["mode"], 0, 1)
+
+    def get_array(self, key):
+        """Returns the pixels stored under the given key as a read-only view of the mapped buffer.
+
+        The array has the shape (height, width) for a grey-level image, and (height, width, 4) for a colour
+        image: the padding channel of RGBX planes is kept, so that the array stays contiguous.
+
+        :param key: The key of the entry (e.g. "003_004").
+        :return: A tuple (array, mode of the image).
+        """
+        entry = self.entries[key]
+        start = self.data_start + entry["offset"]
+        pixels = np.frombuffer(self.buffer, np.uint8, entry["length"], start)
+
+        if len(entry["mode"]) == 1:
+            return pixels.reshape(entry["height"], entry["width"]), entry["mode"]
+        return pixels.reshape(entry["height"], entry["width"], len(entry["mode"])), entry["mode"]
+
+    @staticmethod
+    def pack(img_name, depth_map_name=None):
+        """Packs the image files of a light-field image into a single container file.
+
+        Every file of the folder img/<img_name> is packed, as well as the depth map.
+
+        :param img_name: The name of the image (i.e. of the folder containing all its image files).
+        :param depth_map_name: The name of the depth map to pack. If it is None, the depth map of
+                               the reference image is taken.
+        :return: The path of the container file.
+        """
+        if depth_map_name is None:
+            depth_map_name = img_name.split("R")[0] + "R0"
+
+        sources = []
+        folder = IMG_PATH_PREFIX + img_name
+        for file_name in sorted(os.listdir(folder)):
+            key, ext = os.path.splitext(file_name)
+            if ext == "." + IMG_FORMAT:
+                sources.append((key, "{}/{}".format(folder, file_name)))
+
+        depth_map_path = "{}depth_map/{}.{}".format(IMG_PATH_PREFIX, depth_map_name, IMG_FORMAT)
+        if os.path.exists(depth_map_path):
+            sources.append((DEPTH_MAP_KEY, depth_map_path))
+
+        # First pass: read the dimensions of every image to build the index
+        entries = {}
+        offset = 0
+        for key, path in sources:
+            with Image.open(path) as img:
+                mode = img.mode if img.mode in ("L", "RGBA") else "RGBX"
+                length = img.size[0] * img.size[1] * len(mode)
+                entries[key] = {"offset": offset, "length": length, "mode": mode,
+                                "width": img.size[0], "height": img.size[1]}
+                offset += _align(length)
+
+        header = json.dumps({"img_name": img_name, "entries": entries}).encode("utf-8")
+        data_start = _align(len(MAGIC) + 4 + len(header))
+
+        # Second pass: write the raw pixel planes
+        path = container_path(img_name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+
+            for key, src in sources:
+                entry = entries[key]
+                with Image.open(src) as img:
+                    f.seek(data_start + entry["offset"])
+                    f.write(img.convert(entry["mode"]).tobytes())
+
+            f.truncate(data_start + offset)
+
+        os.replace(tmp_path, path)
+        LFContainer.opened.pop(img_name, None)
+
+        return path
+
+
+def container_path(img_name):
+    """Returns the path of the container file of the given light-field image."""
+
+    return "{}{}.{}".format(IMG_PATH_PREFIX, img_name, CONTAINER_FORMAT)
+
+
+def open_image(img_path):
+    """Returns the image at the given path, relative to IMG_PATH_PREFIX (e.g. "I01R1/003_004.png").
+
+    The image is read from the container of its light-field image if it was packed,
+    and decoded from the image file otherwise.
+
+    :param img_path: The path of the image, as used in the tracking file.
+    """
+    img = find_packed_image(img_path)
+
+    if img is None:
+        img = Image.open(IMG_PATH_PREFIX + img_path)
+
+    return img
+
+
+def open_array(img_path):
+    """Returns the pixels of the image at the given path, relative to IMG_PATH_PREFIX, as an array.
+
+    If its light-field image was packed, the array is a view of the container (see LFContainer.get_array) and no
+    pixel is copied. Otherwise, the image file is decoded.
+
+    :param img_path: The path of the image, as used in the tracking file.
+    :return: A tuple (array of shape (height, width) or (height, width, channels), mode of the image).
+    """
+    folder, file_name = img_path.split("/", 1)
+    container = LFContainer.get(folder)
+    key = os.path.splitext(file_name)[0]
+
+    if container is not None and container.has(key):
+        return container.get_array(key)
+
+    with Image.open(IMG_PATH_PREFIX + img_path) as img:
+        if img.mode not in ("L", "RGB", "RGBA"):
+            img = img.convert("RGB")
+        return np.asarray(img), img.mode
+
+
+def find_packed_image(img_path):
+    """Returns the image at the given path if its light-field image was packed, and None otherwise.
+
+    :param img_path: The path of the image, relative to IMG_PATH_PREFIX (e.g. "I01R1/003_004.png").
+    """
+    folder, file_name = img_path.split("/", 1)
+    container = LFContainer.get(folder)
+    key = os.path.splitext(file_name)[0]
+
+    if container is not None and container.has(key):
+        return container.get_image(key)
+
+    return None
+
+
+def open_depth_map(img_name, depth_map_name):
+    """Returns the depth map of a light-field image.
+
+    :param img_name: The name of the image whose container is searched first.
+    :param depth_map_name: The name of the depth map file, used if the image was not packed.
+    """
+    container = LFContainer.get(img_name)
+
+    if container is not None and container.has(DEPTH_MAP_KEY):
+        return container.get_image(DEPTH_MAP_KEY)
+
+    return Image.open("{}depth_map/{}.{}".format(IMG_PATH_PREFIX, depth_map_name, IMG_FORMAT))
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
@@ -19,20 +19,33 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import datetime
-from threading import Timer
-import threading
-
-from PIL import Image, ImageTk
-
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from ImageLoader import ImageLoader, fit_size, resample
+from Instrumentation import instrumentation
+from Refocuser import Refocuser
+from DepthMap import DepthMap
+from LFContainer import open_image, open_array, find_packed_image
+from MemoryAccounting import memory_accounting
+import TrackingLog
 from SubapertureImage import SubapertureImage
-from helper import IMG_PATH_PREFIX, IMG_FORMAT, f_tracking, clamp, Helper
+from ViewCache import view_cache
+from ViewTable import ViewTable
+from helper import IMG_PATH_PREFIX, IMG_FORMAT, PROGRESSIVE_LOADING_RADIUS, REFOCUS_ANIMATION_TIME_PER_IMAGE, \
+    SYNTHETIC_REFOCUS, DEPTH_MEDIAN_RADIUS, PASTE_VIEWS, VIEW_DECODE_THREADS, clamp, Helper
 
 
 class LFImage:
     """"Represents a light-field image."""
 
-    def __init__(self, img_name, nb_img_x=9, nb_img_y=9, nb_img_depth=11, top_left=(3, 3), base_img=None, focus_depth=None, unit=20):
+    # Refocusers of the reference images, shared by the light-field images with the same reference
+    reference_refocusers = {}
+    # Threads decoding the views that are not in the view cache when they are displayed
+    decode_executor = None
+
+    def __init__(self, img_name, nb_img_x=9, nb_img_y=9, nb_img_depth=11, top_left=(3, 3), base_img=None, focus_depth=None, unit=20,
+                 other_img_names=()):
         """Initializes a light-field image.
         
         :param img_name: The name of the image (i.e. of the folder containing all its image files).
@@ -44,9 +57,16 @@ class LFImage:
                          If it is None, the middle center image is taken.
         :param focus_depth: The initial depth that should be in focus.
         :param unit: The number of pixels one should move the mouse to switch to another viewpoint.
+        :param other_img_names: The names of the other test images displayed next to this one with the multi
+                                stimulus method (e.g. the same content with other codecs). They share the reference
+                                image, the depth map and the viewpoint of this image.
         """
 
         self.img_name = img_name
+        self.other_img_names = tuple(other_img_names)
+        self.test_img_names = (img_name,) + self.other_img_names
+        # Name of the stimulus in the output files
+        self.stimulus_name = "+".join(self.test_img_names)
         self.reference_img_name = img_name.split("R")[0] + "R0"
         self.nb_img_x = nb_img_x
         self.nb_img_y = nb_img_y
@@ -63,21 +83,30 @@ class LFImage:
 
         self.unit = unit
 
-        self.test_images = [[None for _ in range(top_left[0] + nb_img_x)] for _ in range(top_left[1] + nb_img_y)]
-        self.test_images_refocus = [None for _ in range(nb_img_depth)]
-        self.ref_images = [[None for _ in range(top_left[0] + nb_img_x)] for _ in range(top_left[1] + nb_img_y)]
-        self.ref_images_refocus = [None for _ in range(nb_img_depth)]
+        # Perspective images of the grid, indexed by (u - top_left[0]) * nb_img_y + (v - top_left[1])
+        self.perspective_images = [SubapertureImage(u, v, None)
+                                   for u in range(top_left[0], top_left[0] + nb_img_x)
+                                   for v in range(top_left[1], top_left[1] + nb_img_y)]
 
         self.cur_img = None
         self.next_img = self.base_img
-        self.depth_map = Image.open("{}/depth_map/{}.{}".format(IMG_PATH_PREFIX, self.reference_img_name, IMG_FORMAT)).load()
+        self.depth_map = DepthMap(self.img_name, self.reference_img_name, nb_img_depth)
         self.click_pos = (0, 0)
         self.prev_time = 0
         self.cur_time = 0
         self.panels = None
+        self.composite_frame = None
+        self.view_size = None
+        self.view_table = None
         self.test_image_side = None
         self.is_preview_running = False
         self.is_loaded = False
+        self.is_fully_loaded = False
+        self.loader = None
+        # Keys of the views whose image could not be decoded by the loader
+        self.unavailable_keys = set()
+        self.refocusers = {}
+        self.is_reference_acquired = False
 
     def click(self, click_pos):
         """Stores the mouse position and the image diplayed at the time of the click.
@@ -96,43 +125,80 @@ class LFImage:
         :param move_pos: The current position of the mouse.
         """
         if not self.is_preview_running:
-            diff_x = self.click_pos[0] - move_pos[0]
-            diff_y = self.click_pos[1] - move_pos[1]
+            next_img = self.get_dragged_image(move_pos)
 
-            img_diff_x = int(round(diff_x / float(self.unit)))
-            img_diff_y = int(round(diff_y / float(self.unit)))
+            # Most mouse events do not change the viewpoint
+            if next_img == self.next_img:
+                return
 
-            next_img_x = clamp(self.base_img.u + img_diff_x,
-                               self.top_left[0],
-                               self.top_left[0] + self.nb_img_x - 1)
-            next_img_y = clamp(self.base_img.v + img_diff_y,
-                               self.top_left[1],
-                               self.top_left[1] + self.nb_img_y - 1)
-            self.next_img = SubapertureImage(next_img_x, next_img_y, None)
+            self.next_img = next_img
 
             self.update_images()
             self.set_focus_slider_value(0)
 
+    def get_dragged_image(self, move_pos):
+        """Returns the perspective image to display when the mouse is dragged to the given position
+        since the last click (see click()).
+
+        :param move_pos: The current position of the mouse.
+        """
+        diff_x = self.click_pos[0] - move_pos[0]
+        diff_y = self.click_pos[1] - move_pos[1]
+
+        img_diff_x = int(round(diff_x / float(self.unit)))
+        img_diff_y = int(round(diff_y / float(self.unit)))
+
+        next_img_x = clamp(self.base_img.u + img_diff_x,
+                           self.top_left[0],
+                           self.top_left[0] + self.nb_img_x - 1)
+        next_img_y = clamp(self.base_img.v + img_diff_y,
+                           self.top_left[1],
+                           self.top_left[1] + self.nb_img_y - 1)
+
+        return self.perspective_images[(next_img_x - self.top_left[0]) * self.nb_img_y + next_img_y - self.top_left[1]]
+
     def refocus_to_depth(self, focus_depth):
         """Displays the image corresponding to the given focus depth.
         
         :param focus_depth: The depth to focus to image on.
         """
         if not self.is_preview_running:
-            self.next_img = SubapertureImage(self.top_left[0] + self.nb_img_x // 2,
-                                             self.top_left[1] + self.nb_img_y // 2,
-                                             int(focus_depth))
+            self.next_img = self.get_refocused_image(focus_depth)
             self.update_images()
 
-            self.set_focus_slider_value(focus_depth)
+            self.set_focus_slider_value(self.next_img.focus_depth)
+
+    def get_refocused_image(self, focus_depth):
+        """Returns the refocused image corresponding to the given focus depth.
+
+        :param focus_depth: The depth to focus to image on, as a number or a string (e.g. from the focus slider).
+        """
+        # Synthetic refocusing allows intermediate depths
+        focus_depth = round(float(focus_depth), 1) if SYNTHETIC_REFOCUS else int(float(focus_depth))
+        return SubapertureImage(self.top_left[0] + self.nb_img_x // 2,
+                                self.top_left[1] + self.nb_img_y // 2,
+                                focus_depth)
 
     def refocus_to_point(self, event):
         """Refocus the current image on the given point using the depth map
 
         :param event: The event that triggered the refocusing and contains the point coordinates
         """
-        depth_map_value = self.depth_map[event.x, event.y] / 255
-        focus_depth = round(depth_map_value * (self.nb_img_depth - 1))
+        x, y = event.x, event.y
+        if self.composite_frame is not None:
+            # All the views of the composite frame show the same scene
+            location = self.composite_frame.locate(x, y)
+            if location is None:
+                return
+            _, x, y, view_size = location
+            view_width = view_size[0]
+        else:
+            displayed_view = getattr(self.panels[0], "image", None)
+            view_width = displayed_view.width() if displayed_view is not None else None
+
+        # The views may be downscaled, while the depth map has the original resolution
+        scale = self.depth_map.get_size()[0] / view_width if view_width is not None else 1
+        focus_depth = self.depth_map.depth_at(x * scale, y * scale, DEPTH_MEDIAN_RADIUS)
         self.refocus_animation(focus_depth)
 
     def refocus_animation(self, depth):
@@ -140,132 +206,349 @@ class LFImage:
         
         :param depth: The final depth at the end of the animation
         """
-        if self.cur_img.focus_depth is not None:
-            if self.cur_img.focus_depth != depth:
-                depth_delta = 1 if (depth - self.cur_img.focus_depth > 0) else -1
-                new_depth = self.cur_img.focus_depth + depth_delta
-                self.refocus_to_depth(new_depth)
+        if self.is_preview_running:
+            return
 
-                if new_depth != depth:
-                    Timer(0.01, lambda: self.refocus_animation(depth)).start()
+        if self.cur_img.focus_depth is not None:
+            # Go through all the depths between the current one and the final one
+            step = 1 if depth > self.cur_img.focus_depth else -1
+            nb_steps = int(math.ceil(abs(depth - self.cur_img.focus_depth)))
+            depths = [self.cur_img.focus_depth + step * (i + 1) for i in range(nb_steps - 1)] + [depth]
         else:
-            self.refocus_to_depth(depth)
+            depths = [depth]
+
+        frames = [(lambda d=d: self.refocus_to_depth(d), REFOCUS_ANIMATION_TIME_PER_IMAGE) for d in depths]
+        Helper.frame_scheduler.play(frames)
 
     def set_focus_slider_value(self, value):
-        Helper.is_focus_slider_enabled = False
-        Helper.focus_slider.set(value)
+        """Moves the focus slider to the given depth without refocusing. Nothing is done if it is already there,
+        as the slider would not call its command to enable itself again."""
+
+        if float(Helper.focus_slider.get()) != float(value):
+            Helper.is_focus_slider_enabled = False
+            Helper.focus_slider.set(value)
 
     def update_images(self):
         """Updates the image displayed according to the next_img attribute"""
 
         if self.next_img != self.cur_img:
+            displayed_img = self.next_img
+
+            # Synthetic refocused images are not loaded but computed when they are displayed
+            is_loaded_view = not (SYNTHETIC_REFOCUS and displayed_img.focus_depth is not None)
+
+            if is_loaded_view and not self.is_view_ready(displayed_img) and \
+                    (self.is_loading() or self.is_view_unavailable(displayed_img)):
+                # Show the closest view already loaded instead of waiting (next_img is displayed as soon as it is
+                # loaded, see load_images), or instead of a view that could not be loaded
+                nearest_img = self.get_nearest_ready_view(displayed_img)
+                if nearest_img is None and self.is_view_unavailable(displayed_img):
+                    return
+                displayed_img = nearest_img or displayed_img
+                if displayed_img == self.cur_img:
+                    return
+
             if not self.is_preview_running:
                 self.close_img()
 
-            self.cur_img = self.next_img
-
-            if self.cur_img.focus_depth is None:
-                # Display a normal image
-                new_test_img = self.test_images[self.cur_img.u][self.cur_img.v]
-                new_ref_img = self.ref_images[self.cur_img.u][self.cur_img.v]
-
-            else:
-                # Display a refocused image
-                new_test_img = self.test_images_refocus[self.cur_img.focus_depth]
-                new_ref_img = self.ref_images_refocus[self.cur_img.focus_depth]
+            self.cur_img = displayed_img
 
-            test_img_name, ref_img_name = self.get_cur_img_names()
+            # The test views, followed by the reference view if it is displayed
+            views = self.get_views(self.get_displayed_views(self.cur_img))
 
-            # Load the images if they were not already loaded
-            if new_test_img is None:
-                new_test_img = ImageTk.PhotoImage(Image.open(IMG_PATH_PREFIX + test_img_name))
-                self.test_images[self.cur_img.u][self.cur_img.v] = new_test_img
-            if new_ref_img is None and len(self.panels) == 2:
-                # The reference image is only needed for the double stimulus method
-                new_ref_img = ImageTk.PhotoImage(Image.open(IMG_PATH_PREFIX + ref_img_name))
-                self.ref_images[self.cur_img.u][self.cur_img.v] = new_ref_img
+            if instrumentation.enabled:
+                instrumentation.mark("view_ready")
 
-            if len(self.panels) == 2: # Double stimulus
+            if self.composite_frame is not None: # Multi stimulus
+                # The reference is displayed after the test images, or before them if they are on the right
+                if self.test_image_side is Helper.Side.RIGHT:
+                    views = views[-1:] + views[:-1]
+                # All the views are displayed in the same frame
+                self.composite_frame.show(views)
+            elif len(self.panels) == 2: # Double stimulus
                 # Set the test and reference image on the correct side (left=0, right=1)
-                self.panels[self.test_image_side.value].configure(image=new_test_img)
-                self.panels[self.test_image_side.value].image = new_test_img
-                self.panels[(self.test_image_side.value + 1) % 2].configure(image=new_ref_img)
-                self.panels[(self.test_image_side.value + 1) % 2].image = new_ref_img
+                self.show_view(self.panels[self.test_image_side.value], views[0])
+                self.show_view(self.panels[(self.test_image_side.value + 1) % 2], views[1])
             elif len(self.panels) == 1: # Single stimulus
-                self.panels[0].configure(image=new_test_img)
-                self.panels[0].image = new_test_img
-
-    def load_images(self, assessment_method):
-        def callback():
-
-            # Load normal images
-            for x in range(self.top_left[0], self.top_left[0] + self.nb_img_x):
-                for y in range(self.top_left[1], self.top_left[1] + self.nb_img_y):
-                    test_img_name = '{}/{:03}_{:03}.{}'.format(self.img_name, x, y, IMG_FORMAT)
-                    ref_img_name = '{}/{:03}_{:03}.{}'.format(self.reference_img_name, x, y, IMG_FORMAT)
-
-                    self.test_images[x][y] = ImageTk.PhotoImage(Image.open(IMG_PATH_PREFIX + test_img_name))
-
-                    # The reference image is only needed for the double stimulus method
-                    if assessment_method is Helper.IQA.DOUBLE_STIMULUS:
-                        self.ref_images[x][y] = ImageTk.PhotoImage(Image.open(IMG_PATH_PREFIX + ref_img_name))
-
-            # Load refocused images
-            for depth in range(self.nb_img_depth):
-                test_img_name = '{}/{:03}_{:03}_{:03}.{}'.format(self.img_name, self.base_img.u, self.base_img.v,
-                                                                 depth, IMG_FORMAT)
-                ref_img_name = '{}/{:03}_{:03}_{:03}.{}'.format(self.reference_img_name, self.base_img.u, self.base_img.v,
-                                                                depth, IMG_FORMAT)
-                self.test_images_refocus[depth] = ImageTk.PhotoImage(Image.open(IMG_PATH_PREFIX + test_img_name))
-                # The reference image is only needed for the double stimulus method
-                if assessment_method is Helper.IQA.DOUBLE_STIMULUS:
-                    self.ref_images_refocus[depth] = ImageTk.PhotoImage(Image.open(IMG_PATH_PREFIX + ref_img_name))
+                self.show_view(self.panels[0], views[0])
+
+            if instrumentation.enabled:
+                instrumentation.mark("configured", Helper.root)
+
+    @staticmethod
+    def show_view(panel, view):
+        """Displays a view on a panel.
+
+        If the views are pasted (see PASTE_VIEWS), they are copied into the Tk image of the panel, which is
+        only created again when the size of the views changes. Otherwise, the view is set as the image of the panel.
+
+        :param panel: The panel.
+        :param view: The view, as returned by get_view().
+        """
+        if PASTE_VIEWS:
+            photo_img = getattr(panel, "image", None)
+            if photo_img is not None and (photo_img.width(), photo_img.height()) == view.size:
+                photo_img.paste(view)
+                return
+            view = ImageLoader.to_photo_image(view)
+
+        panel.configure(image=view)
+        panel.image = view
+
+    def to_view(self, img):
+        """Converts a PIL image into a view stored in the view cache: a Tk image, or the PIL image itself
+        if the views are pasted into the panels or composited (see CompositeFrame).
+        """
+        if PASTE_VIEWS or self.composite_frame is not None:
+            # Reads the pixels and closes the image file
+            img.load()
+            return img
+
+        return ImageLoader.to_photo_image(img)
 
+    def get_view(self, key, img_name):
+        """Returns the view with the given key from the view cache, loading it if it was not already loaded.
+
+        :param key: The key of the view in the cache, see get_view_keys().
+        :param img_name: The name of the image file of the view.
+        """
+        return self.get_views([(key, img_name)])[0]
+
+    def get_views(self, views):
+        """Returns the views with the given keys from the view cache, loading those that were not already loaded.
+
+        The missing views are decoded and downscaled at the same time by the decode threads (Pillow releases the
+        GIL while doing it), so that displaying the views of several images takes about as long as displaying one.
+        They are then converted into views by the calling thread, as Tk images can only be created by the Tk thread.
+
+        :param views: The list of tuples (key of the view in the cache, name of the image file of the view).
+        """
+        result = [view_cache.get(key) for key, _ in views]
+        missing = [views[i] for i, view in enumerate(result) if view is None]
+
+        if len(missing) > 1:
+            images = list(LFImage.get_decode_executor().map(lambda view: self.decode_view(*view), missing))
+        else:
+            images = [self.decode_view(*view) for view in missing]
+
+        images = iter(images)
+        for i, (key, _) in enumerate(views):
+            if result[i] is None:
+                result[i] = self.to_view(next(images))
+                view_cache.put(key, result[i])
+
+        return result
+
+    def decode_view(self, key, img_name):
+        """Returns the image of a view, decoded and downscaled to the size of the views. Called by the decode threads.
+
+        :param key: The key of the view in the cache, see get_view_keys().
+        :param img_name: The name of the image file of the view.
+        """
+        if SYNTHETIC_REFOCUS and key[3] is not None:
+            img = resample(self.get_refocuser(key[0]).refocus(key[3]), self.view_size)
+        else:
+            img = resample(open_image(img_name), self.view_size)
+        img.load()
+
+        return img
+
+    @classmethod
+    def get_decode_executor(cls):
+        """Returns the threads decoding the views, which are created the first time they are needed."""
+
+        if cls.decode_executor is None:
+            cls.decode_executor = ThreadPoolExecutor(VIEW_DECODE_THREADS)
+        return cls.decode_executor
+
+    def get_refocuser(self, img_name):
+        """Returns the refocuser computing the refocused images of the test or of the reference image.
+
+        :param img_name: The name of the test image or of the reference image.
+        """
+        if img_name == self.reference_img_name:
+            refocusers = LFImage.reference_refocusers
+            key = (img_name, self.top_left, self.nb_img_x, self.nb_img_y, self.nb_img_depth)
+        else:
+            refocusers = self.refocusers
+            key = img_name
+
+        if key not in refocusers:
+            refocusers[key] = Refocuser(
+                lambda u, v: open_array('{}/{:03}_{:03}.{}'.format(img_name, u, v, IMG_FORMAT)),
+                range(self.top_left[0], self.top_left[0] + self.nb_img_x),
+                range(self.top_left[1], self.top_left[1] + self.nb_img_y),
+                self.nb_img_depth)
+
+        return refocusers[key]
+
+    def load_images(self, assessment_method, show_preview=False, on_loaded_all=None, paused=False):
+        """Loads all the images of the light-field image without blocking the GUI.
+
+        The images are decoded in parallel by worker processes and converted into views (see to_view) by
+        the Tk main loop, the most urgent first (see get_loading_order). is_loaded is set to True as soon
+        as the images needed to start interacting are available, and is_fully_loaded once they all are.
+
+        :param assessment_method: The assessment method, used to know if the reference images are needed.
+                                  The views of all the images displayed at each viewpoint are loaded together.
+        :param show_preview: True iff the preview will be shown, in which case its images are loaded first.
+        :param on_loaded_all: If given, function called once all the images are loaded.
+        :param paused: If True, the loader is created paused (see ImageLoader.pause), it is resumed with
+                       self.loader.resume().
+        """
+        def on_loaded(key, view):
+            # The memory may have been cleared while the images were being loaded
+            if loader is not self.loader:
+                return
+
+            # The view is None if it was loaded by another light-field image with the same reference
+            if view is not None:
+                view_cache.put(key, view)
+
+            keys_needed.discard(key)
+            if not keys_needed and not self.is_loaded:
+                on_ready()
+
+            # Display the requested image if a closer one was displayed while it was not loaded
+            if self.cur_img is not None and self.next_img != self.cur_img \
+                    and key in [view_key for view_key, _ in self.get_displayed_views(self.next_img)] \
+                    and self.is_view_ready(self.next_img):
+                self.update_images()
+
+        def on_error(key, exception):
+            if loader is not self.loader:
+                return
+
+            print("Warning: the view {} could not be loaded ({}), it is replaced by the closest view".format(
+                key, exception))
+            self.unavailable_keys.add(key)
+            keys_needed.discard(key)
+            if not keys_needed and not self.is_loaded:
+                on_ready()
+
+        def on_ready():
             self.is_loaded = True
+            if instrumentation.enabled:
+                instrumentation.record_loading_time(self.img_name, "interactive", instrumentation.now() - start)
             # Hide loading message
             if Helper.fullscreen_msg is not None:
                 Helper.fullscreen_msg.pack_forget()
 
-        t = threading.Thread(target=callback)
-        t.start()
-
-    def preview(self, time_per_image=0.1, time_per_image_refocus=0.25, start=3, end=11):
+        def on_complete():
+            if loader is self.loader:
+                self.is_fully_loaded = True
+                if instrumentation.enabled:
+                    instrumentation.record_loading_time(self.img_name, "complete", instrumentation.now() - start)
+                if on_loaded_all is not None:
+                    on_loaded_all()
+                if not self.is_loaded:
+                    on_ready()
+
+        def on_timing(key, phase, duration_ns):
+            instrumentation.record_loading_phase(self.img_name, phase, duration_ns)
+
+        start = instrumentation.now()
+        # The reference views are shared with the other light-field images with the same reference
+        if assessment_method is not Helper.IQA.SINGLE_STIMULUS and not self.is_reference_acquired:
+            view_cache.acquire(self.reference_img_name)
+            self.is_reference_acquired = True
+
+        loader = ImageLoader(Helper.root, on_loaded, on_complete, on_timing if instrumentation.enabled else None,
+                             self.view_size, self.to_view, view_cache.contains, on_error)
+        self.loader = loader
+        self.is_fully_loaded = False
+        self.unavailable_keys = set()
+
+        order, needed = self.get_loading_order(show_preview)
+        needed = set(needed)
+        keys_needed = set()
+
+        def add(key, img_name, is_needed):
+            if not view_cache.contains(key):
+                if is_needed:
+                    keys_needed.add(key)
+
+                read_start = instrumentation.now() if instrumentation.enabled else 0
+                img = find_packed_image(img_name)
+
+                if img is None:
+                    loader.add_file(key, IMG_PATH_PREFIX + img_name)
+                elif fit_size(img.size, self.view_size) != img.size:
+                    # Downscaling is slow, it is done by the worker processes
+                    loader.add_packed_image(key, img_name)
+                else:
+                    if instrumentation.enabled:
+                        # The other images are read by the loader, which measures it
+                        on_timing(key, "read", instrumentation.now() - read_start)
+                    loader.add_image(key, img)
+
+        for view in order:
+            is_needed = view in needed
+            for key, img_name in self.get_views_needed(view, assessment_method):
+                add(key, img_name, is_needed)
+
+        if not keys_needed:
+            on_ready()
+
+        if paused:
+            loader.pause()
+        loader.start()
+
+    def preview(self, time_per_image=0.1, time_per_image_refocus=0.25, start=None, end=None):
         """Display a preview of the LF image by going through a predefined subset of the sub-aperture images.
-           It first shows the perspective images in alternate scanner order, starting with the coordinate 
-           (start, start) and ending with (end, end). Then, it shows the refocused images by going from the foreground
-           to the background and back to the foreground.
+           It first shows the perspective images in alternate scanner order, starting with the coordinates
+           start and ending with end (by default the corners of the grid of viewpoints). Then, it shows the refocused
+           images by going from the foreground to the background and back to the foreground.
         """
 
-        def preview_inner(index, preview_images):
-            """Displays the images given by 'preview_images', starting at position 'index'.
-            :param index: Index of the first image to display.
-            :param preview_images: List of images to show in the preview.
-            """
-            self.next_img = preview_images[index]
+        def show(img):
+            self.next_img = img
             self.update_images()
 
-            if index + 1 < len(preview_images):
-                timeout = time_per_image if (self.next_img.focus_depth is None) else time_per_image_refocus
-                Timer(timeout, lambda: preview_inner(index + 1, preview_images)).start()
-            else:
-                # End the preview and display the base image
-                self.is_preview_running = False
-                self.next_img = self.base_img
-                # self.cur_time = 0
-                self.update_images()
+        def on_done():
+            # End the preview and display the base image
+            self.is_preview_running = False
+            self.next_img = self.base_img
+            self.update_images()
+            if instrumentation.enabled:
+                instrumentation.record_preview(self.get_stimulus_name(), Helper.frame_scheduler.report())
+
+        frames = [(lambda img=img: show(img), time_per_image if img.focus_depth is None else time_per_image_refocus)
+                  for img in self.get_preview_images(start, end)]
+
+        # Start the preview
+        self.is_preview_running = True
+        Helper.frame_scheduler.play(frames, on_done)
+
+    def stop_animations(self):
+        """Stops the preview or the refocus animation being played, if any."""
+
+        Helper.frame_scheduler.cancel()
+        self.is_preview_running = False
+
+    def get_preview_images(self, start=None, end=None):
+        """Returns the list of the sub-aperture images shown by the preview, in the order they are shown.
+
+        :param start: The coordinates (u, v) of the first perspective image, by default the top-left viewpoint.
+        :param end: The coordinates (u, v) of the last perspective image, by default the bottom-right viewpoint.
+        """
+        if start is None:
+            start = self.top_left
+        if end is None:
+            end = (self.top_left[0] + self.nb_img_x - 1, self.top_left[1] + self.nb_img_y - 1)
 
         # List of images ordered for the preview
         preview_images_list = []
 
-        next_img = SubapertureImage(start, start, None)
+        next_img = SubapertureImage(start[0], start[1], None)
         delta_x = 1
 
         # Set the order of images for the preview
-        for y in range(start, end + 1):
+        for y in range(start[1], end[1] + 1):
             next_img = SubapertureImage(next_img.u, y, None)
             preview_images_list.append(next_img)
 
-            for _ in range(start, end):
+            for _ in range(start[0], end[0]):
                 next_img = SubapertureImage(next_img.u + delta_x, next_img.v, None)
                 preview_images_list.append(next_img)
 
@@ -276,58 +559,189 @@ class LFImage:
             next_img = SubapertureImage(self.base_img.u, self.base_img.v, depth)
             preview_images_list.append(next_img)
 
-        # Start the preview
-        self.is_preview_running = True
-        preview_inner(0, preview_images_list)
+        return preview_images_list
+
+    def get_loading_order(self, show_preview):
+        """Returns the list of all the sub-aperture images to load, the most urgent first, and the list of the
+        images that must be loaded before the user can interact: the perspective images within
+        PROGRESSIVE_LOADING_RADIUS of the base image and the refocused image at the initial focus depth.
+
+        If the preview is shown, the images are loaded in the order of the preview. Otherwise, the perspective
+        images are loaded in a spiral around the base image, and the refocused images are loaded around the
+        initial focus depth once the images close to the base image are loaded.
+
+        :param show_preview: True iff the preview is shown before the user can interact.
+        """
+        base = self.base_img
+        views = list(self.perspective_images)
+        # Spiral order: ring after ring around the base image
+        views.sort(key=lambda img: (max(abs(img.u - base.u), abs(img.v - base.v)),
+                                    math.atan2(img.v - base.v, img.u - base.u)))
+
+        focus_depth = base.focus_depth if base.focus_depth is not None else 0
+        # Synthetic refocused images are computed when they are displayed
+        nb_loaded_depths = 0 if SYNTHETIC_REFOCUS else self.nb_img_depth
+        refocus_views = [SubapertureImage(base.u, base.v, depth) for depth in range(nb_loaded_depths)]
+        refocus_views.sort(key=lambda img: abs(img.focus_depth - focus_depth))
+
+        nb_close_views = sum(1 for img in views
+                             if max(abs(img.u - base.u), abs(img.v - base.v)) <= PROGRESSIVE_LOADING_RADIUS)
+        needed = views[:nb_close_views] + refocus_views[:1]
+
+        if show_preview:
+            order = []
+            seen = set()
+            for img in self.get_preview_images() + views[:nb_close_views] + refocus_views + views:
+                if SYNTHETIC_REFOCUS and img.focus_depth is not None:
+                    continue
+                if (img.u, img.v, img.focus_depth) not in seen:
+                    seen.add((img.u, img.v, img.focus_depth))
+                    order.append(img)
+        else:
+            order = views[:nb_close_views] + refocus_views + views[nb_close_views:]
+
+        return order, needed
+
+    def is_view_ready(self, img):
+        """Returns True iff all the views needed to display the given sub-aperture image are in the view cache.
+
+        :param img: The SubapertureImage.
+        """
+        return all(view_cache.contains(key) for key, _ in self.get_displayed_views(img))
+
+    def is_view_unavailable(self, img):
+        """Returns True iff one of the views needed to display the given sub-aperture image could not be loaded.
+
+        :param img: The SubapertureImage.
+        """
+        return bool(self.unavailable_keys) and \
+            any(key in self.unavailable_keys for key, _ in self.get_displayed_views(img))
+
+    def is_loading(self):
+        """Returns True iff the images are being loaded in the background."""
+
+        return self.loader is not None and not self.is_fully_loaded
+
+    def get_nearest_ready_view(self, img):
+        """Returns the sub-aperture image closest to the given one that can be displayed right away,
+        or None if there is none.
+
+        :param img: The SubapertureImage.
+        """
+        if img.focus_depth is None:
+            candidates = self.perspective_images
+            distance = lambda c: (c.u - img.u) ** 2 + (c.v - img.v) ** 2
+        else:
+            candidates = [SubapertureImage(img.u, img.v, depth) for depth in range(self.nb_img_depth)]
+            distance = lambda c: abs(c.focus_depth - img.focus_depth)
+
+        ready = [c for c in candidates if self.is_view_ready(c)]
+        return min(ready, key=distance) if ready else None
 
-    def close_img(self):
+    def close_img(self, tracking_log=None):
         """Perform actions necessary when an image is replaced by another.
         
-        This method is used to write the end time and on-screen time in the tracking.txt file.
+        This method is used to record the start and end time of the image in the tracking log.
+
+        :param tracking_log: The tracking log of the session, by default the one of the session run by this process.
         """
         self.prev_time = self.cur_time
-        self.cur_time = datetime.datetime.now()
+        self.cur_time = TrackingLog.now()
 
         if self.prev_time != 0:
-            onscreen = self.cur_time - self.prev_time
+            (tracking_log or Helper.tracking_log).record(self.cur_img.u, self.cur_img.v, self.cur_img.focus_depth,
+                                       self.prev_time, self.cur_time)
 
-            test_img_name, _ = self.get_cur_img_names()
+    def get_cur_img_names(self):
+        """Returns a tuple containing the name of the current test image and of the current reference image"""
 
-            to_write = "{}  start: {}  end: {}  on-screen: {}\n".format(
-                test_img_name,
-                self.prev_time.strftime('%H:%M:%S.%f'),
-                self.cur_time.strftime('%H:%M:%S.%f'),
-                onscreen
-            )
+        return self.get_img_names(self.cur_img)
 
-            f_tracking.write(to_write)
+    def get_img_names(self, img):
+        """Returns a tuple containing the name of the test image and of the reference image of a sub-aperture image.
 
-    def get_cur_img_names(self):
-        """Returns a tuple containing the name of the current test image and of the current reference image"""
+        :param img: The SubapertureImage.
+        """
+        views = self.get_view_table().get_views(img)
+        return views[0][1], views[-1][1]
 
-        if self.cur_img.focus_depth is None:
-            # Normal image
-            test_img_name = '{}/{:03}_{:03}.{}'.format(self.img_name, self.cur_img.u, self.cur_img.v, IMG_FORMAT)
-            ref_img_name = '{}/{:03}_{:03}.{}'.format(self.reference_img_name, self.cur_img.u, self.cur_img.v,
-                                                      IMG_FORMAT)
+    def get_view_keys(self, img):
+        """Returns a tuple containing the keys of the test view and of the reference view in the view cache.
 
+        The keys include the size the views are downscaled to, so that views of different sizes are not mixed up.
+
+        :param img: The SubapertureImage.
+        """
+        views = self.get_view_table().get_views(img)
+        return views[0][0], views[-1][0]
+
+    def get_view_table(self):
+        """Returns the table of the keys and file names of the views, which is created the first time it is needed
+        and once the size of the views is known."""
+
+        if self.view_table is None:
+            self.view_table = ViewTable(self.test_img_names, self.reference_img_name, self.top_left,
+                                        self.nb_img_x, self.nb_img_y, self.view_size)
+        return self.view_table
+
+    def get_views_needed(self, img, assessment_method):
+        """Returns the tuple of the views needed to display a sub-aperture image with an assessment method, as tuples
+        (key in the view cache, name of the image file): the test views, followed by the reference view for the
+        double and multi stimulus methods.
+
+        :param img: The SubapertureImage.
+        :param assessment_method: The assessment method.
+        """
+        return self.get_view_table().get_views(img, assessment_method is not Helper.IQA.SINGLE_STIMULUS)
+
+    def get_displayed_views(self, img):
+        """Returns the views displayed on the panels for a sub-aperture image, see get_views_needed().
+
+        :param img: The SubapertureImage.
+        """
+        if self.composite_frame is not None:
+            assessment_method = Helper.IQA.MULTI_STIMULUS
+        elif len(self.panels) == 2:
+            assessment_method = Helper.IQA.DOUBLE_STIMULUS
         else:
-            # Refocused image
-            test_img_name = '{}/{:03}_{:03}_{:03}.{}'.format(self.img_name, self.cur_img.u, self.cur_img.v,
-                                                             self.cur_img.focus_depth, IMG_FORMAT)
-            ref_img_name = '{}/{:03}_{:03}_{:03}.{}'.format(self.reference_img_name, self.cur_img.u, self.cur_img.v,
-                                                            self.cur_img.focus_depth, IMG_FORMAT)
+            assessment_method = Helper.IQA.SINGLE_STIMULUS
+
+        return self.get_views_needed(img, assessment_method)
 
-        return test_img_name, ref_img_name
+    def get_stimulus_name(self):
+        """Returns the name of the stimulus in the output files: the name of the image, or the names of all the
+        test images joined by '+' for the multi stimulus method."""
+
+        return self.stimulus_name
 
     def clear_memory(self):
-        """Dereference the arrays of images loaded so that they are cleared by the garbage collector"""
+        """Removes the test views of the image from the view cache and stops loading them.
+
+        The reference views are only removed if no other light-field image that is loaded uses them. The views
+        removed are then checked to be really freed (see MemoryAccounting).
+        """
 
-        self.ref_images = None
-        self.ref_images_refocus = None
-        self.test_images = None
-        self.test_images_refocus = None
+        if self.loader is not None:
+            self.loader.cancel()
+        self.loader = None
+        self.refocusers = {}
+        self.depth_map.release()
+        released_views = []
+        for img_name in self.test_img_names:
+            released_views += view_cache.get_views(img_name)
+            view_cache.discard(img_name)
+
+        if self.is_reference_acquired:
+            self.is_reference_acquired = False
+            reference_views = view_cache.get_views(self.reference_img_name)
+            if view_cache.release(self.reference_img_name):
+                released_views += reference_views
+                for key in [key for key in LFImage.reference_refocusers if key[0] == self.reference_img_name]:
+                    del LFImage.reference_refocusers[key]
         self.is_loaded = False
+        self.is_fully_loaded = False
+
+        memory_accounting.on_cleared(self, released_views)
 
     def set_panels(self, panels):
         """Configure the LFImage to use the given panels for display.
@@ -336,6 +750,22 @@ class LFImage:
         """
         self.panels = panels
 
+    def set_composite_frame(self, frame):
+        """Configure the LFImage to display all its views in a single frame (multi stimulus method).
+
+        :param frame: The CompositeFrame, which displays the views on the panel given to set_panels().
+        """
+        self.composite_frame = frame
+
+    def set_view_size(self, size):
+        """Set the maximum size of the views displayed. Larger views are downscaled when they are loaded.
+
+        :param size: The maximum size (width, height) of a panel, or None to display the views at their original
+                     resolution.
+        """
+        self.view_size = size
+        self.view_table = None
+
     def set_test_image_side(self, side):
         """Set the side on which the test image should be displayed.
 
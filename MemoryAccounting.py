@@ -0,0 +1,248 @@
+#   MemoryAccounting.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Accounting of the memory held by each stimulus of a test session, and detection of the memory not released.
+
+The bytes held by a light-field image are those of its views in the view cache (the reference views being shared
+with the other stimuli with the same reference), of its refocusers and of its depth map. They are sampled with the
+resident memory of the process every MEMORY_SAMPLE_INTERVAL seconds while a stimulus is shown, which gives its peak
+usage, and when the subject answers, which gives its steady-state usage.
+
+When the memory of a light-field image is cleared, the views removed from the cache are followed with weak
+references, and checked MEMORY_LEAK_CHECK_DELAY seconds later (once the next stimulus is displayed): a view still
+alive is referenced by something else than the cache, and is reported as leaked. A warning is printed when the
+resident memory goes over MEMORY_BUDGET. Everything is written at the end of the session in <session>-memory.txt.
+"""
+
+import gc
+import os
+import resource
+import weakref
+from collections import OrderedDict
+
+from ViewCache import view_cache, image_nbytes
+from helper import MEMORY_BUDGET, MEMORY_SAMPLE_INTERVAL, MEMORY_LEAK_CHECK_DELAY, Helper
+
+# Categories of the memory held by a light-field image, see lf_image_nbytes()
+CATEGORIES = ["views", "reference_views", "refocusers", "depth_map"]
+
+
+def lf_image_nbytes(img):
+    """Returns the number of bytes held by a light-field image, as a dictionary {category: bytes}.
+
+    :param img: The LFImage.
+    """
+    from LFImage import LFImage  # Imports this module
+
+    nbytes = OrderedDict((category, 0) for category in CATEGORIES)
+    nbytes["views"] = sum(view_cache.image_nbytes(img_name) for img_name in img.test_img_names)
+    if img.is_reference_acquired:
+        nbytes["reference_views"] = view_cache.image_nbytes(img.reference_img_name)
+        nbytes["refocusers"] = sum(refocuser.nbytes() for key, refocuser in LFImage.reference_refocusers.items()
+                                   if key[0] == img.reference_img_name)
+    nbytes["refocusers"] += sum(refocuser.nbytes() for refocuser in img.refocusers.values())
+    nbytes["depth_map"] = img.depth_map.nbytes()
+
+    return nbytes
+
+
+def get_rss():
+    """Returns the resident memory of the process in bytes, or its peak if the current value is not available."""
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if os.uname().sysname == "Darwin" else maxrss * 1024
+
+
+class StimulusMemory:
+    """Memory used while a light-field image was shown, and what was left after its memory was cleared."""
+
+    def __init__(self, img_name):
+        self.img_name = img_name
+        self.is_shown = False
+        self.peak = OrderedDict((category, 0) for category in CATEGORIES)
+        self.steady = None
+        self.peak_cache = 0
+        self.peak_rss = 0
+        self.steady_rss = None
+        # Memory still held after clear_memory(), and resident memory once the leaked views were checked
+        self.remaining = None
+        self.rss_after_clear = None
+        self.nb_leaked_views = 0
+        self.leaked_bytes = 0
+
+
+class MemoryAccounting:
+    """Follows the memory of the light-field images of a test session."""
+
+    def __init__(self, budget=MEMORY_BUDGET):
+        """Initializes the accounting.
+
+        :param budget: The resident memory (in bytes) above which a warning is printed.
+        """
+        self.budget = budget
+        # LFImage -> StimulusMemory, in the order the images were shown or cleared
+        self.records = OrderedDict()
+        self.cur_img = None
+        self.sample_after_id = None
+        self.is_over_budget = False
+        self.nb_budget_warnings = 0
+        self.peak_rss = 0
+        # Views of the cleared images being followed: list of (StimulusMemory, [(weak reference, bytes)])
+        self.pending_checks = []
+
+    def get_record(self, img):
+        if img not in self.records:
+            self.records[img] = StimulusMemory(img.get_stimulus_name())
+        return self.records[img]
+
+    def start_stimulus(self, img):
+        """Called when a light-field image starts being shown. Its memory is sampled until end_stimulus()."""
+
+        self.cur_img = img
+        self.get_record(img).is_shown = True
+        self.sample()
+
+    def end_stimulus(self, img):
+        """Called when the subject answers, before the memory of the light-field image is cleared."""
+
+        self.sample()
+        record = self.get_record(img)
+        record.steady = lf_image_nbytes(img)
+        record.steady_rss = get_rss()
+        self.cur_img = None
+
+    def sample(self):
+        """Samples the memory of the current light-field image and of the process, and schedules the next sample."""
+
+        if self.sample_after_id is not None:
+            Helper.root.after_cancel(self.sample_after_id)
+            self.sample_after_id = None
+
+        rss = get_rss()
+        self.peak_rss = max(self.peak_rss, rss)
+        self.check_budget(rss)
+
+        if self.cur_img is not None:
+            record = self.get_record(self.cur_img)
+            for category, nbytes in lf_image_nbytes(self.cur_img).items():
+                record.peak[category] = max(record.peak[category], nbytes)
+            record.peak_cache = max(record.peak_cache, view_cache.nbytes)
+            record.peak_rss = max(record.peak_rss, rss)
+
+            if Helper.root is not None:
+                self.sample_after_id = Helper.root.after(int(MEMORY_SAMPLE_INTERVAL * 1000), self.sample)
+
+    def check_budget(self, rss):
+        if rss > self.budget and not self.is_over_budget:
+            self.nb_budget_warnings += 1
+            print("Warning: the process uses {:.0f} MB, over the budget of {:.0f} MB ({})".format(
+                rss / 1024 ** 2, self.budget / 1024 ** 2, view_cache.stats()))
+        # Warn again only once the memory went back under the budget
+        self.is_over_budget = rss > self.budget
+
+    def on_cleared(self, img, views):
+        """Called by LFImage.clear_memory() once the memory of a light-field image is cleared.
+
+        :param img: The LFImage.
+        :param views: The views that were removed from the view cache, which should be freed.
+        """
+        record = self.get_record(img)
+        record.remaining = lf_image_nbytes(img)
+
+        refs = [(weakref.ref(view), image_nbytes(view)) for view in views]
+        self.pending_checks.append((record, refs))
+        if Helper.root is not None:
+            Helper.root.after(int(MEMORY_LEAK_CHECK_DELAY * 1000), self.check_leaks)
+
+    def check_leaks(self, force=False):
+        """Counts the views of the cleared images that are still alive.
+
+        :param force: If True, all the pending checks are done now (e.g. at the end of the session), otherwise
+                      only the oldest one, which was scheduled first.
+        """
+        checks = self.pending_checks if force else self.pending_checks[:1]
+        self.pending_checks = [] if force else self.pending_checks[1:]
+
+        for record, refs in checks:
+            alive = [nbytes for ref, nbytes in refs if ref() is not None]
+            if alive:
+                # The views may only be part of reference cycles waiting for the garbage collector
+                gc.collect()
+                alive = [nbytes for ref, nbytes in refs if ref() is not None]
+
+            record.nb_leaked_views += len(alive)
+            record.leaked_bytes += sum(alive)
+            record.rss_after_clear = get_rss()
+            if alive:
+                print("Warning: {} views of {} ({:.1f} MB) were not freed after clearing its memory".format(
+                    len(alive), record.img_name, sum(alive) / 1024 ** 2))
+
+    def stop(self):
+        """Stops sampling and does the pending leak checks."""
+
+        if self.sample_after_id is not None:
+            Helper.root.after_cancel(self.sample_after_id)
+            self.sample_after_id = None
+        self.cur_img = None
+        self.check_leaks(force=True)
+
+    def report(self):
+        """Returns the report of the session as a string, with sizes in MB."""
+
+        def mb(nbytes):
+            return "-" if nbytes is None else "{:.1f}".format(nbytes / 1024 ** 2)
+
+        def total(nbytes):
+            return None if nbytes is None else sum(nbytes.values())
+
+        lines = ["Memory per stimulus (MB): peak and steady state while shown (views, reference views, refocusers,",
+                 "depth map), peak of the view cache and of the process, and memory left after clearing it",
+                 "  {:30} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>10} {:>8}".format(
+                     "stimulus", "peak", "steady", "cache", "rss", "left", "leaked", "rss_after", "shown")]
+
+        for record in self.records.values():
+            lines.append("  {:30} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>10} {:>8}".format(
+                record.img_name, mb(total(record.peak)), mb(total(record.steady)), mb(record.peak_cache),
+                mb(record.peak_rss or None), mb(total(record.remaining)), mb(record.leaked_bytes),
+                mb(record.rss_after_clear), "yes" if record.is_shown else "no"))
+
+        lines.append("")
+        lines.append("Peak resident memory: {} MB (budget {} MB, exceeded {} times)".format(
+            mb(self.peak_rss), mb(self.budget), self.nb_budget_warnings))
+        lines.append("Leaked views: {} ({} MB)".format(sum(r.nb_leaked_views for r in self.records.values()),
+                                                       mb(sum(r.leaked_bytes for r in self.records.values()))))
+        lines.append(view_cache.stats())
+
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path):
+        """Writes the report of the session in a text file."""
+
+        with open(path, "w") as f:
+            f.write(self.report())
+
+
+# Memory accounting of the session
+memory_accounting = MemoryAccounting()
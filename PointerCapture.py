@@ -0,0 +1,252 @@
+#   PointerCapture.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Capture of the raw pointer events of a test session: presses, drag motions, releases and double-clicks.
+
+Unlike the tracking log, which records the sub-aperture images displayed, every mouse event received by the panels is
+recorded, before the drag motions are coalesced. The events are records of POINTER_DTYPE stored in a preallocated
+ring buffer, with times taken from the monotonic clock of the tracking log (see TrackingLog.now()). The buffer is
+written in chunks to <session>-pointer.bin, each chunk being a header of CHUNK_HEADER (number of events, CRC-32 of
+the events) followed by the events, so that a chunk cut by a crash is detected. <session>-pointer.json holds the
+names of the stimuli and the offset between the monotonic clock and the wall clock.
+
+Usage:
+    python PointerCapture.py output/<session>-pointer.bin ...   Exports captures as CSV files
+"""
+
+import csv
+import datetime
+import json
+import sys
+import time
+import zlib
+
+import numpy as np
+
+import TrackingLog
+from helper import POINTER_CAPTURE_BUFFER_SIZE, DURABLE_COMMIT_INTERVAL, Helper
+
+POINTER_DTYPE = np.dtype([("time", "<i8"),  # Monotonic time in ns
+                          ("x", "<i4"),  # Position in the panel
+                          ("y", "<i4"),
+                          ("stimulus", "<u2"),  # Index of the stimulus in the session
+                          ("kind", "u1"),
+                          ("button", "u1"),
+                          ("panel", "u1")])  # Index of the panel, from left to right
+
+CHUNK_HEADER = np.dtype([("nb_events", "<u4"), ("crc", "<u4")])
+
+# Kinds of events
+PRESS = 0
+MOTION = 1
+RELEASE = 2
+DOUBLE_CLICK = 3
+KIND_NAMES = ["press", "motion", "release", "double_click"]
+
+
+class PointerCapture:
+    """Records pointer events in a ring buffer, which is written to disk in chunks.
+
+    Recording an event only writes its fields into the buffer. The events recorded are written at least every
+    DURABLE_COMMIT_INTERVAL seconds by the Tk main loop, and when the buffer is full. The files are written to disk
+    by the DurableWriter thread.
+    """
+
+    def __init__(self, path_prefix, session_name, capacity=POINTER_CAPTURE_BUFFER_SIZE, writer=None):
+        """Initializes a pointer capture.
+
+        :param path_prefix: The path of the capture files, without the ".bin" and ".json" extensions.
+        :param session_name: The name of the test session.
+        :param capacity: The number of events the ring buffer can hold.
+        :param writer: The DurableWriter writing the files in the background. If it is None,
+                       the files are written directly.
+        """
+        self.bin_path = path_prefix + ".bin"
+        self.meta_path = path_prefix + ".json"
+        self.session_name = session_name
+        self.stimuli = []
+
+        self.events = np.zeros(capacity, dtype=POINTER_DTYPE)
+        # Views of the fields, so that recording an event does not create them
+        self.times = self.events["time"]
+        self.xs = self.events["x"]
+        self.ys = self.events["y"]
+        self.stimulus_indices = self.events["stimulus"]
+        self.kinds = self.events["kind"]
+        self.buttons = self.events["button"]
+        self.panels = self.events["panel"]
+
+        # Number of events recorded and written since the start: the events not written yet are at the indices
+        # nb_written % capacity to nb_recorded % capacity (excluded) of the ring buffer
+        self.nb_recorded = 0
+        self.nb_written = 0
+        self.cur_stimulus = 0
+        self.flush_after_id = None
+
+        # Anchor used to convert monotonic times into wall-clock times
+        self.wall_ns = time.time_ns()
+        self.monotonic_ns = TrackingLog.now()
+
+        self.writer = writer
+        if writer is None:
+            self.file = open(self.bin_path, "wb")
+        else:
+            self.file = writer.open_stream(self.bin_path, binary=True)
+        self.write_metadata()
+
+    def start_stimulus(self, stimulus_name):
+        """Starts a new stimulus: the following events are attributed to it.
+
+        :param stimulus_name: The name of the stimulus (see LFImage.get_stimulus_name()).
+        """
+        self.flush()
+        self.stimuli.append(stimulus_name)
+        self.cur_stimulus = len(self.stimuli) - 1
+        self.write_metadata()
+
+    def record(self, kind, x, y, button=1, panel=0):
+        """Records a pointer event of the current stimulus, at the current time.
+
+        :param kind: The kind of event: PRESS, MOTION, RELEASE or DOUBLE_CLICK.
+        :param x: The x coordinate of the pointer in the panel.
+        :param y: The y coordinate of the pointer in the panel.
+        :param button: The mouse button pressed.
+        :param panel: The index of the panel.
+        """
+        if self.nb_recorded - self.nb_written == len(self.events):
+            self.flush()
+
+        i = self.nb_recorded % len(self.events)
+        self.times[i] = TrackingLog.now()
+        self.xs[i] = x
+        self.ys[i] = y
+        self.stimulus_indices[i] = self.cur_stimulus
+        self.kinds[i] = kind
+        self.buttons[i] = button
+        self.panels[i] = panel
+        self.nb_recorded += 1
+
+        if self.flush_after_id is None and Helper.root is not None:
+            self.flush_after_id = Helper.root.after(int(DURABLE_COMMIT_INTERVAL * 1000), self.flush)
+
+    def flush(self):
+        """Writes the events recorded since the last flush as a chunk."""
+
+        if self.flush_after_id is not None:
+            Helper.root.after_cancel(self.flush_after_id)
+            self.flush_after_id = None
+
+        nb_events = self.nb_recorded - self.nb_written
+        if nb_events == 0:
+            return
+
+        start = self.nb_written % len(self.events)
+        end = start + nb_events
+        if end <= len(self.events):
+            data = self.events[start:end].tobytes()
+        else:
+            # The events wrap around the end of the buffer
+            data = self.events[start:].tobytes() + self.events[:end - len(self.events)].tobytes()
+
+        header = np.array([(nb_events, zlib.crc32(data))], dtype=CHUNK_HEADER)
+        self.file.write(header.tobytes() + data)
+        self.file.flush()
+        self.nb_written = self.nb_recorded
+
+    def close(self):
+        self.flush()
+        self.write_metadata()
+        self.file.close()
+
+    def write_metadata(self):
+        metadata = {"session_name": self.session_name,
+                    "stimuli": self.stimuli,
+                    "kinds": KIND_NAMES,
+                    "wall_ns": self.wall_ns,
+                    "monotonic_ns": self.monotonic_ns,
+                    "dtype": POINTER_DTYPE.descr,
+                    "chunk_header": CHUNK_HEADER.descr}
+
+        if self.writer is None:
+            with open(self.meta_path, "w") as f:
+                json.dump(metadata, f)
+        else:
+            self.writer.replace(self.meta_path, json.dumps(metadata).encode("utf-8"))
+
+
+def read(bin_path):
+    """Reads a pointer capture. A chunk that is truncated or corrupted, and the following ones, are ignored.
+
+    :param bin_path: The path of the .bin file of the capture.
+    :return: A tuple (events, metadata), events being an array of POINTER_DTYPE.
+    """
+    with open(bin_path[:-len(".bin")] + ".json") as f:
+        metadata = json.load(f)
+    with open(bin_path, "rb") as f:
+        data = f.read()
+
+    chunks = []
+    offset = 0
+    while offset + CHUNK_HEADER.itemsize <= len(data):
+        nb_events, crc = np.frombuffer(data, CHUNK_HEADER, 1, offset)[0]
+        start = offset + CHUNK_HEADER.itemsize
+        end = start + int(nb_events) * POINTER_DTYPE.itemsize
+        if end > len(data) or zlib.crc32(data[start:end]) != crc:
+            print("Warning: {} is corrupted after {} bytes, the following events are ignored".format(
+                bin_path, offset))
+            break
+
+        chunks.append(np.frombuffer(data, POINTER_DTYPE, int(nb_events), start))
+        offset = end
+
+    events = np.concatenate(chunks) if chunks else np.zeros(0, dtype=POINTER_DTYPE)
+    return events, metadata
+
+
+def to_csv(bin_path, csv_path=None):
+    """Exports a pointer capture as a CSV file, with one row per event.
+
+    :param bin_path: The path of the .bin file of the capture.
+    :param csv_path: The path of the CSV file. If it is None, the extension of bin_path is replaced by ".csv".
+    :return: The path of the CSV file.
+    """
+    if csv_path is None:
+        csv_path = bin_path[:-len(".bin")] + ".csv"
+
+    events, metadata = read(bin_path)
+    offset_ns = metadata["wall_ns"] - metadata["monotonic_ns"]
+
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["stimulus", "kind", "time", "time_ns", "x", "y", "button", "panel"])
+
+        for t_ns, x, y, stimulus, kind, button, panel in events.tolist():
+            wall_ns = t_ns + offset_ns
+            wall_time = datetime.datetime.fromtimestamp(wall_ns // 10 ** 9) + \
+                datetime.timedelta(microseconds=wall_ns % 10 ** 9 // 1000)
+            writer.writerow([metadata["stimuli"][stimulus], metadata["kinds"][kind],
+                             wall_time.strftime('%H:%M:%S.%f'), t_ns, x, y, button, panel])
+
+    return csv_path
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print("{} -> {}".format(path, to_csv(path)))
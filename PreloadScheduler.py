@@ -0,0 +1,182 @@
+#   PreloadScheduler.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import math
+import statistics
+import time
+from collections import OrderedDict, deque
+
+from ViewCache import view_cache
+from helper import NB_IMAGES_PRELOADED, MAX_IMAGES_PRELOADED, PRELOAD_CONCURRENCY, VIEW_CACHE_BUDGET, Helper
+
+# Number of recent load and answer times used to choose how many images are preloaded (one load time per image)
+NB_TIMES_MEASURED = 5
+# Minimum fraction of an image that must be loaded to extrapolate its load time
+MIN_PROGRESS_MEASURED = 0.1
+
+
+class PreloadScheduler:
+    """Chooses which light-field images of a test session are loaded in advance, and when.
+
+    The number of images loaded after the current one is adapted to the subject: it is the number of answers
+    given during the time needed to load an image, between NB_IMAGES_PRELOADED and MAX_IMAGES_PRELOADED, and
+    limited by the number of images that fit in the view cache. The images are loaded in the order they are shown,
+    at most PRELOAD_CONCURRENCY at the same time since they compete for the disk and the worker processes. The
+    other loaders are paused, and the loaders of the images that are not needed anymore are cancelled.
+    """
+
+    def __init__(self, images, assessment_method, show_preview, memory_budget=VIEW_CACHE_BUDGET):
+        """Initializes a preload scheduler.
+
+        :param images: The light-field images of the test session, in the order they are shown.
+        :param assessment_method: The assessment method, used to know if the reference images are needed.
+        :param show_preview: True iff the preview is shown for each image.
+        :param memory_budget: The maximum number of bytes used by the views of the images loaded.
+        """
+        self.images = images
+        self.assessment_method = assessment_method
+        self.show_preview = show_preview
+        self.memory_budget = memory_budget
+
+        self.cur_index = 0
+        # Index of an image -> its load time, measured once it is fully loaded, extrapolated before
+        self.load_times = OrderedDict()
+        self.answer_times = deque(maxlen=NB_TIMES_MEASURED)
+        self.image_sizes = deque(maxlen=NB_TIMES_MEASURED)
+        self.shown_time = None
+        # Index of each image being loaded -> [time spent loading before its last pause, time at which its loader
+        # was started or resumed (None if paused)]
+        self.loading = {}
+
+    def get_nb_preloaded(self):
+        """Returns the number of images following the current one that should be loaded."""
+
+        nb_preloaded = NB_IMAGES_PRELOADED
+
+        if self.load_times and self.answer_times:
+            # Images needed while the next one is loading
+            nb_preloaded = math.ceil(statistics.median(self.load_times.values()) /
+                                     max(0.1, statistics.median(self.answer_times)))
+
+        nb_preloaded = max(NB_IMAGES_PRELOADED, min(MAX_IMAGES_PRELOADED, nb_preloaded))
+
+        if self.image_sizes:
+            # The current image must fit in the budget as well
+            nb_fitting = int(self.memory_budget // max(1, statistics.median(self.image_sizes))) - 1
+            nb_preloaded = max(0, min(nb_preloaded, nb_fitting))
+
+        return nb_preloaded
+
+    def on_image_shown(self, index):
+        """Called when an image starts being shown (i.e. when the subject can start answering)."""
+
+        self.shown_time = time.perf_counter()
+
+    def on_answer(self, index):
+        """Called when the subject answers, before the next image is shown."""
+
+        if self.shown_time is not None:
+            self.answer_times.append(time.perf_counter() - self.shown_time)
+            self.shown_time = None
+
+        # Subjects may answer before any image is fully loaded, the load time is then extrapolated
+        for loading_index in self.loading:
+            loader = self.images[loading_index].loader
+            if loader is not None and loader.get_progress() >= MIN_PROGRESS_MEASURED:
+                self.add_load_time(loading_index, self.get_loading_time(loading_index) / loader.get_progress())
+
+    def get_loading_time(self, index):
+        """Returns the time spent loading an image being loaded, excluding the time its loader was paused."""
+
+        elapsed, start = self.loading[index]
+        return elapsed + (time.perf_counter() - start if start is not None else 0)
+
+    def add_load_time(self, index, load_time):
+        """Sets the load time of an image, replacing its previous estimate if any."""
+
+        self.load_times.pop(index, None)
+        self.load_times[index] = load_time
+        while len(self.load_times) > NB_TIMES_MEASURED:
+            self.load_times.popitem(last=False)
+
+    def update(self, cur_index):
+        """Starts, resumes, pauses or cancels the loaders according to the image currently shown.
+
+        :param cur_index: The index of the image currently shown.
+        """
+        self.cur_index = cur_index
+        wanted = range(cur_index, min(len(self.images), cur_index + self.get_nb_preloaded() + 1))
+
+        # Images not needed anymore, or not yet, being loaded or fully loaded (e.g. when fewer images are preloaded)
+        for index in list(self.loading):
+            if index not in wanted:
+                del self.loading[index]
+                self.images[index].clear_memory()
+        for index, img in enumerate(self.images):
+            if index not in wanted and img.is_fully_loaded:
+                img.clear_memory()
+
+        nb_running = 0
+        for index in wanted:
+            img = self.images[index]
+            if img.is_fully_loaded:
+                continue
+
+            run = nb_running < PRELOAD_CONCURRENCY
+            nb_running += run
+
+            if index not in self.loading:
+                print("Loading image {}/{}...".format(index + 1, len(self.images)))
+                self.loading[index] = [0, time.perf_counter() if run else None]
+                img.load_images(self.assessment_method, self.show_preview,
+                                on_loaded_all=lambda index=index: self.on_loaded(index), paused=not run)
+            elif run and self.loading[index][1] is None:
+                self.loading[index][1] = time.perf_counter()
+                img.loader.resume()
+            elif not run and self.loading[index][1] is not None:
+                # Only the time spent loading is measured
+                self.loading[index] = [self.get_loading_time(index), None]
+                img.loader.pause()
+
+    def on_loaded(self, index):
+        """Called when all the images of a light-field image are loaded."""
+
+        if index in self.loading:
+            load_time = self.get_loading_time(index)
+            del self.loading[index]
+            # Images whose views were all loaded by other images are not measured
+            if load_time > 0:
+                self.add_load_time(index, load_time)
+
+        img = self.images[index]
+        nbytes = sum(view_cache.image_nbytes(img_name) for img_name in img.test_img_names)
+        if self.assessment_method is not Helper.IQA.SINGLE_STIMULUS:
+            nbytes += view_cache.image_nbytes(img.reference_img_name)
+        self.image_sizes.append(nbytes)
+
+        self.update(self.cur_index)
+
+    def cancel(self):
+        """Cancels all the loaders, e.g. at the end of the session."""
+
+        for index in self.loading:
+            if self.images[index].loader is not None:
+                self.images[index].loader.cancel()
+        self.loading = {}
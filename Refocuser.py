@@ -0,0 +1,236 @@
+#   Refocuser.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Synthetic refocusing of a light-field image by shifting and adding its perspective images.
+
+Usage:
+    python Refocuser.py I01R1   Compares the time needed to refocus with the time needed to load a refocused image
+"""
+
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from helper import REFOCUS_SLOPE_RANGE, REFOCUS_CACHE_SIZE, REFOCUS_SUBPIXEL
+
+# Number of positions between two pixels for sub-pixel shifts
+SUBPIXEL_STEPS = 16
+
+
+class Refocuser:
+    """Computes refocused images of a light-field image from its perspective images.
+
+    Each perspective image (u, v) is shifted by slope * (u - u_center, v - v_center) pixels and all the images are
+    averaged. The slope is interpolated linearly from the focus depth, which can take any value between 0 and
+    nb_img_depth - 1. Since the shift only depends on u along the x-axis and on v along the y-axis, the images are
+    first shifted and added along x for each row of viewpoints, then the rows are shifted and added along y.
+    """
+
+    def __init__(self, load_view, viewpoints_x, viewpoints_y, nb_img_depth, slope_range=REFOCUS_SLOPE_RANGE,
+                 subpixel=REFOCUS_SUBPIXEL, cache_size=REFOCUS_CACHE_SIZE):
+        """Initializes a refocuser.
+
+        :param load_view: Function returning the perspective image (u, v) as a tuple (array of shape
+                          (height, width[, channels]), mode of the image), e.g. LFContainer.open_array.
+        :param viewpoints_x: The u coordinates of the perspective images.
+        :param viewpoints_y: The v coordinates of the perspective images.
+        :param nb_img_depth: The number of pre-rendered focus depths, which is used to scale the depths.
+        :param slope_range: The slopes (in pixels per viewpoint) corresponding to the depths 0 and nb_img_depth - 1.
+        :param subpixel: If True, the images are shifted by fractions of pixels, otherwise the shifts are rounded.
+        :param cache_size: The number of refocused images kept in memory.
+        """
+        self.load_view = load_view
+        self.viewpoints_x = list(viewpoints_x)
+        self.viewpoints_y = list(viewpoints_y)
+        self.nb_img_depth = nb_img_depth
+        self.slope_range = slope_range
+        self.subpixel = subpixel
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.views = None
+        self.mode = None
+
+    def get_views(self):
+        """Returns the perspective images as a list of rows (one per v) of arrays, loading them if needed."""
+
+        if self.views is None:
+            # The arrays of packed images are views of their container, they are not copied
+            views = [[self.load_view(u, v) for u in self.viewpoints_x] for v in self.viewpoints_y]
+            self.mode = views[0][0][1]
+            self.views = [[pixels for pixels, _ in row] for row in views]
+        return self.views
+
+    def nbytes(self):
+        """Returns the number of bytes held by the perspective images and the refocused images in the cache.
+        The perspective images mapped from a container are not counted, their pixels are in the page cache."""
+
+        nbytes = sum(view.nbytes for row in self.views for view in row if not _is_mapped(view)) \
+            if self.views is not None else 0
+        return nbytes + sum(img.size[0] * img.size[1] * len(img.getbands()) for img in self.cache.values())
+
+    def get_slope(self, focus_depth):
+        """Returns the shift in pixels between two neighbour viewpoints for the given focus depth."""
+
+        t = focus_depth / max(1, self.nb_img_depth - 1)
+        return self.slope_range[0] + t * (self.slope_range[1] - self.slope_range[0])
+
+    def refocus(self, focus_depth):
+        """Returns the image refocused at the given depth, as a PIL image.
+
+        :param focus_depth: The focus depth, between 0 and nb_img_depth - 1. It does not need to be an integer.
+        """
+        key = round(focus_depth, 2)
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        pixels = self.shift_and_add(self.get_slope(focus_depth))
+        # The padding channel of RGBX views is averaged as well, the image is built on the array
+        img = Image.frombuffer(self.mode, (pixels.shape[1], pixels.shape[0]), pixels, "raw", self.mode, 0, 1)
+
+        self.cache[key] = img
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return img
+
+    def shift_and_add(self, slope):
+        """Shifts every perspective image proportionally to its distance to the center viewpoint and averages them.
+
+        The images are accumulated in fixed point: with sub-pixel shifts, each image is split between its two
+        nearest integer positions with weights quantized to 1/scale, otherwise the shifts are rounded.
+
+        :param slope: The shift in pixels between two neighbour viewpoints.
+        :return: The refocused image as an array of uint8.
+        """
+        views = self.get_views()
+        shape = views[0][0].shape
+        center_x = (self.viewpoints_x[0] + self.viewpoints_x[-1]) / 2
+        center_y = (self.viewpoints_y[0] + self.viewpoints_y[-1]) / 2
+
+        # The sum of a row of views must fit in 16 bits
+        scale = max(1, min(SUBPIXEL_STEPS, 65535 // (255 * len(self.viewpoints_x)))) if self.subpixel else 1
+
+        result = np.zeros(shape, dtype=np.uint32)
+        row = np.empty(shape, dtype=np.uint16)
+        tmp_row = np.empty(shape, dtype=np.uint16)
+        tmp_result = np.empty(shape, dtype=np.uint32)
+        coverage_y = np.zeros(shape[0], dtype=np.float64)
+        coverage_x = np.zeros(shape[1], dtype=np.float64)
+
+        for v, row_views in zip(self.viewpoints_y, views):
+            row.fill(0)
+            coverage_x.fill(0)
+            for u, view in zip(self.viewpoints_x, row_views):
+                _shift_add(row, tmp_row, coverage_x, view, slope * (u - center_x), 1, scale)
+
+            _shift_add(result, tmp_result, coverage_y, row, slope * (v - center_y), 0, scale)
+
+        # All rows have the same horizontal coverage, so the coverage of a pixel is separable
+        coverage = np.maximum(coverage_y[:, None] * coverage_x[None, :], 1)
+        if len(shape) == 3:
+            coverage = coverage[:, :, None]
+
+        return np.clip(result / coverage + 0.5, 0, 255).astype(np.uint8)
+
+
+def _is_mapped(array):
+    """Returns True iff the array is a view of a memory-mapped buffer (see LFContainer.get_array)."""
+
+    while isinstance(array, np.ndarray):
+        array = array.base
+    return isinstance(array, memoryview)
+
+
+def _shift_add(acc, tmp, coverage, img, shift, axis, scale):
+    """Adds img shifted by a number of pixels along an axis to acc, with weights in fixed point.
+
+    :param acc: The integer array accumulating the images.
+    :param tmp: An array of the same shape and type as acc, used to store the weighted image.
+    :param coverage: The array accumulating, for each position along the axis, the weight of the pixels added.
+    :param img: The image to add.
+    :param shift: The shift in pixels. If scale is 1, it is rounded to the closest integer.
+    :param axis: The axis along which the image is shifted (0 for y, 1 for x).
+    :param scale: The weights are integers between 0 and scale, which corresponds to a weight of 1.
+    """
+    quantized_shift = int(round(shift * scale))
+    integer_shift = quantized_shift // scale
+    fraction = quantized_shift - integer_shift * scale
+    n = img.shape[axis]
+
+    for s, weight in ((integer_shift, scale - fraction), (integer_shift + 1, fraction)):
+        if weight == 0 or abs(s) >= n:
+            continue
+
+        dst = slice(s, n) if s >= 0 else slice(0, n + s)
+        src = slice(0, n - s) if s >= 0 else slice(-s, n)
+        if axis == 1:
+            dst = (slice(None), dst)
+            src = (slice(None), src)
+
+        if weight == 1:
+            acc[dst] += img[src]
+        else:
+            np.multiply(img[src], weight, out=tmp[dst], dtype=tmp.dtype)
+            acc[dst] += tmp[dst]
+        coverage[dst[-1] if axis == 1 else dst] += weight
+
+
+if __name__ == "__main__":
+    from LFContainer import open_image, open_array
+    from helper import IMG_FORMAT
+
+    img_name = sys.argv[1] if len(sys.argv) > 1 else "I01R1"
+    nb_img_x, nb_img_y, nb_img_depth, top_left = 9, 9, 11, (3, 3)
+    xs = range(top_left[0], top_left[0] + nb_img_x)
+    ys = range(top_left[1], top_left[1] + nb_img_y)
+    center = (top_left[0] + nb_img_x // 2, top_left[1] + nb_img_y // 2)
+
+    refocuser = Refocuser(lambda u, v: open_array('{}/{:03}_{:03}.{}'.format(img_name, u, v, IMG_FORMAT)),
+                          xs, ys, nb_img_depth)
+
+    start = time.perf_counter()
+    refocuser.get_views()
+    print("Loading the perspective images: {:.3f} s".format(time.perf_counter() - start))
+
+    depths = [d / 2 for d in range(2 * nb_img_depth - 1)]
+    for subpixel in (False, True):
+        refocuser.subpixel = subpixel
+        refocuser.cache.clear()
+        start = time.perf_counter()
+        for depth in depths:
+            refocuser.refocus(depth)
+        print("Refocusing ({} shifts): {:.1f} ms per depth".format(
+            "sub-pixel" if subpixel else "integer", 1000 * (time.perf_counter() - start) / len(depths)))
+
+    start = time.perf_counter()
+    for depth in depths:
+        refocuser.refocus(depth)
+    print("Refocusing (cached): {:.3f} ms per depth".format(1000 * (time.perf_counter() - start) / len(depths)))
+
+    start = time.perf_counter()
+    for depth in range(nb_img_depth):
+        open_image('{}/{:03}_{:03}_{:03}.{}'.format(img_name, center[0], center[1], depth, IMG_FORMAT)).load()
+    print("Loading a pre-rendered refocused image: {:.1f} ms per depth".format(
+        1000 * (time.perf_counter() - start) / nb_img_depth))
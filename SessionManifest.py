@@ -0,0 +1,269 @@
+#   SessionManifest.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Test sessions defined by a manifest file, and validation of the image files they need.
+
+The manifest is a JSON file giving the stimuli and the parameters of the session (see session.json). Before the
+session starts, every file needed by the stimuli is checked: it must exist and, if it was added or changed since the
+last check, its header must be readable. The size and modification time of each file are stored in an index next to
+the manifest (<manifest>.index.json), so that the next launches only stat the files and their folders and compare
+them with the index, without decoding anything. Every file is stat'ed: a file replaced in place (e.g. by cp) does not
+change the modification time of its folder.
+
+Usage:
+    python SessionManifest.py session.json [--full]   Checks the files of a session (--full ignores the index)
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from LFContainer import LFContainer, container_path, DEPTH_MAP_KEY
+from helper import IMG_PATH_PREFIX, IMG_FORMAT, SYNTHETIC_REFOCUS, Helper
+
+# Parameters of the light-field images that can be given for all the stimuli ("defaults") or for each of them
+LF_PARAMETERS = ["nb_img_x", "nb_img_y", "nb_img_depth", "top_left", "unit"]
+ORDERS = ["fixed", "random", "rotation"]
+# Entry of a stimulus giving the other test images displayed with the multi stimulus method
+OTHERS_KEY = "others"
+
+# Number of threads checking the files
+NB_CHECK_THREADS = 16
+
+
+class SessionManifest:
+    """Represents the manifest of a test session."""
+
+    def __init__(self, path):
+        """Reads a manifest file.
+
+        :param path: The path of the JSON manifest file.
+        """
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.content = f.read()
+        manifest = json.loads(self.content.decode("utf-8"))
+
+        try:
+            self.question = manifest["question"]
+            self.answers = manifest["answers"]
+            self.answers_description = manifest["answers_description"]
+            self.assessment_method = Helper.IQA[manifest.get("assessment_method", "double_stimulus").upper()]
+            self.test_image_side = Helper.Side[manifest.get("test_image_side", "left").upper()]
+            self.show_preview = manifest.get("show_preview", True)
+            self.preload_images = manifest.get("preload_images", True)
+            self.order = manifest.get("order", "fixed")
+            defaults = manifest.get("defaults", {})
+            self.stimuli = [dict(defaults, **(stimulus if isinstance(stimulus, dict) else {"name": stimulus}))
+                            for stimulus in manifest["stimuli"]]
+        except KeyError as e:
+            raise ValueError("{}: missing or invalid entry {}".format(path, e))
+
+        if len(self.answers) != len(self.answers_description):
+            raise ValueError("{}: answers and answers_description have different lengths".format(path))
+        if self.order not in ORDERS:
+            raise ValueError("{}: order should be one of {}".format(path, ", ".join(ORDERS)))
+        for stimulus in self.stimuli:
+            unknown = set(stimulus) - set(LF_PARAMETERS) - {"name", OTHERS_KEY}
+            if "name" not in stimulus or unknown:
+                raise ValueError("{}: invalid stimulus {}".format(path, stimulus))
+            if stimulus.get(OTHERS_KEY) and self.assessment_method is not Helper.IQA.MULTI_STIMULUS:
+                raise ValueError("{}: the stimulus {} has other test images, which are only displayed with the "
+                                 "multi_stimulus method".format(path, stimulus["name"]))
+
+    def get_stimuli(self, subject=None):
+        """Returns the stimuli in the order they are shown to a subject.
+
+        :param subject: The number of the subject. With the "random" order, it is the seed of the shuffle, and with
+                        the "rotation" order, each subject starts one stimulus later than the previous one.
+        """
+        stimuli = list(self.stimuli)
+
+        if self.order == "random":
+            random.Random(subject).shuffle(stimuli)
+        elif self.order == "rotation" and subject is not None:
+            shift = subject % len(stimuli)
+            stimuli = stimuli[shift:] + stimuli[:shift]
+
+        return stimuli
+
+    def create_images(self, subject=None):
+        """Returns the light-field images of the session, in the order they are shown to a subject."""
+
+        from LFImage import LFImage  # Not needed to check the files
+
+        images = []
+        for stimulus in self.get_stimuli(subject):
+            parameters = {key: value for key, value in stimulus.items() if key in LF_PARAMETERS}
+            if "top_left" in parameters:
+                parameters["top_left"] = tuple(parameters["top_left"])
+            images.append(LFImage(stimulus["name"], other_img_names=stimulus.get(OTHERS_KEY, ()), **parameters))
+
+        return images
+
+    def get_required_files(self):
+        """Returns the files needed by the session, as a dictionary {path: keys}.
+
+        keys is None for an image file, and the list of the entries needed for a container.
+        """
+        required = {}
+
+        img_names = []
+        for stimulus in self.stimuli:
+            img_name = stimulus["name"]
+            reference_img_name = img_name.split("R")[0] + "R0"
+            img_names.append((img_name, reference_img_name, stimulus))
+            for other_img_name in stimulus.get(OTHERS_KEY, ()):
+                img_names.append((other_img_name, reference_img_name, stimulus))
+            if self.assessment_method is not Helper.IQA.SINGLE_STIMULUS:
+                img_names.append((reference_img_name, reference_img_name, stimulus))
+
+        for img_name, reference_img_name, stimulus in img_names:
+            nb_img_x, nb_img_y = stimulus.get("nb_img_x", 9), stimulus.get("nb_img_y", 9)
+            nb_img_depth, top_left = stimulus.get("nb_img_depth", 11), stimulus.get("top_left", (3, 3))
+            center = (top_left[0] + nb_img_x // 2, top_left[1] + nb_img_y // 2)
+
+            keys = ["{:03}_{:03}".format(u, v)
+                    for u in range(top_left[0], top_left[0] + nb_img_x)
+                    for v in range(top_left[1], top_left[1] + nb_img_y)]
+            if not SYNTHETIC_REFOCUS:
+                keys += ["{:03}_{:03}_{:03}".format(center[0], center[1], d) for d in range(nb_img_depth)]
+
+            depth_map_path = "{}depth_map/{}.{}".format(IMG_PATH_PREFIX, reference_img_name, IMG_FORMAT)
+
+            if os.path.exists(container_path(img_name)):
+                # Same order of precedence as open_image() and open_depth_map()
+                container_keys = required.setdefault(container_path(img_name), [])
+                container_keys += keys
+                if DEPTH_MAP_KEY in LFContainer.get(img_name).entries:
+                    container_keys.append(DEPTH_MAP_KEY)
+                elif img_name == stimulus["name"]:
+                    required[depth_map_path] = None
+            else:
+                for key in keys:
+                    required["{}{}/{}.{}".format(IMG_PATH_PREFIX, img_name, key, IMG_FORMAT)] = None
+                if img_name == stimulus["name"]:
+                    required[depth_map_path] = None
+
+        return required
+
+    def get_index_path(self):
+        return os.path.splitext(self.path)[0] + ".index.json"
+
+    def check_files(self, full=False):
+        """Checks that all the files needed by the session exist and can be read, and updates the index.
+
+        :param full: If True, the index of the previous check is ignored and every file is checked again.
+        :return: The list of the problems found (empty if the session can start).
+        """
+        required = self.get_required_files()
+        folders = sorted({os.path.dirname(path) for path in required})
+        # The index is only valid for the same manifest and settings
+        version = hashlib.sha1(self.content + repr((IMG_PATH_PREFIX, IMG_FORMAT, SYNTHETIC_REFOCUS)).encode())\
+            .hexdigest()
+
+        index = None
+        if not full and os.path.exists(self.get_index_path()):
+            with open(self.get_index_path()) as f:
+                index = json.load(f)
+            if index.get("version") != version:
+                index = None
+
+        # Fast path: a file can only be added, removed or renamed if the mtime of its folder changed, and a file
+        # overwritten in place changes its own size or mtime (only stat() is called, nothing is decoded)
+        if index is not None and index["folders"] == _stat_folders(folders) and \
+                all(_stat(path) == index["files"].get(path) for path in required):
+            return []
+
+        previous_files = index["files"] if index is not None else {}
+        with ThreadPoolExecutor(NB_CHECK_THREADS) as executor:
+            results = list(executor.map(lambda item: _check_file(item[0], item[1], previous_files.get(item[0])),
+                                        required.items()))
+
+        problems = [problem for _, problem in results if problem is not None]
+        if not problems:
+            index = {"version": version,
+                     "folders": _stat_folders(folders),
+                     "files": {path: stat for (path, _), (stat, _) in zip(required.items(), results)}}
+            with open(self.get_index_path(), "w") as f:
+                json.dump(index, f)
+
+        return problems
+
+
+def _stat(path):
+    """Returns [size, mtime in ns] of a file, or None if it does not exist."""
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _stat_folders(folders):
+    return {folder: _stat(folder) for folder in folders}
+
+
+def _check_file(path, keys, previous_stat):
+    """Checks a file needed by a session.
+
+    :param path: The path of the file.
+    :param keys: The entries needed if it is a container, None if it is an image file.
+    :param previous_stat: The [size, mtime] of the file at the last successful check, if any.
+    :return: A tuple ([size, mtime], problem), problem being None if the file is valid.
+    """
+    stat = _stat(path)
+    if stat is None:
+        return None, "missing file {}".format(path)
+    if stat == previous_stat:
+        return stat, None
+
+    try:
+        if keys is None:
+            with Image.open(path):
+                pass
+        else:
+            container = LFContainer(path)
+            missing = [key for key in keys if not container.has(key)]
+            if missing:
+                return stat, "{} entries missing in {} (e.g. {})".format(len(missing), path, missing[0])
+    except Exception as e:
+        return stat, "unreadable file {}: {}".format(path, e)
+
+    return stat, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks the files needed by a test session.")
+    parser.add_argument("manifest", help="the manifest of the session (e.g. session.json)")
+    parser.add_argument("--full", action="store_true", help="check every file again, ignoring the index")
+    args = parser.parse_args()
+
+    problems = SessionManifest(args.manifest).check_files(args.full)
+    for problem in problems:
+        print(problem)
+    print("{} problem(s) found".format(len(problems)))
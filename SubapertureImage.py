@@ -21,27 +21,47 @@
 #
 
 class SubapertureImage:
-    """"Represents a sub-aperture image via its coordinates"""
+    """"Represents a sub-aperture image via its coordinates.
 
-    def __init__(self, u, v, focus_depth):
-        """Initializes a sub-aperture image.
+    Sub-aperture images are immutable and interned: SubapertureImage(u, v, focus_depth) always returns the same
+    object for the same coordinates, so that they are compared by identity and creating one on every mouse event
+    allocates nothing.
+    """
 
-        :param x:
-        :param y:
-        :param focus_depth:
+    __slots__ = ("u", "v", "focus_depth")
+
+    # (u, v, focus depth, type of the focus depth) -> SubapertureImage. The type keeps apart the depths 2 and 2.0,
+    # which are equal but do not give the same file names
+    interned = {}
+
+    def __new__(cls, u, v, focus_depth):
+        """Returns the sub-aperture image with the given coordinates.
+
+        :param u: The u coordinate (column of the viewpoint).
+        :param v: The v coordinate (row of the viewpoint).
+        :param focus_depth: The focus depth of a refocused image, or None for a perspective image.
         """
-        self.u = u
-        self.v = v
-        self.focus_depth = focus_depth
+        key = (u, v, focus_depth, type(focus_depth))
+        img = cls.interned.get(key)
+
+        if img is None:
+            img = object.__new__(cls)
+            object.__setattr__(img, "u", u)
+            object.__setattr__(img, "v", v)
+            object.__setattr__(img, "focus_depth", focus_depth)
+            cls.interned[key] = img
+
+        return img
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SubapertureImage is immutable")
 
-    def __eq__(self, other):
-        if isinstance(other, self.__class__):
-            return self.__dict__ == other.__dict__
-        else:
-            return False
+    def __reduce__(self):
+        # Unpickled images are interned too
+        return SubapertureImage, (self.u, self.v, self.focus_depth)
 
-    def __ne__(self, other):
-        return not self.__eq__(other)
+    def __repr__(self):
+        return "SubapertureImage({}, {}, {})".format(self.u, self.v, self.focus_depth)
 
     def __str__(self):
-        return "({}, {}, )".format(self.u, self.v, self.focus_depth)
+        return "({}, {}, {})".format(self.u, self.v, self.focus_depth)
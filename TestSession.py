@@ -1,7 +1,18 @@
+import time
 import tkinter as tk
 from PIL import Image, ImageTk
 
-from helper import BG_COLOR, NB_IMAGES_PRELOADED, IMG_PATH_PREFIX, f_tracking, f_answers, Helper
+from CompositeFrame import CompositeFrame
+from FrameScheduler import FrameScheduler
+from ImageLoader import ImageLoader
+from Instrumentation import instrumentation
+from MemoryAccounting import memory_accounting
+from PointerCapture import PRESS, MOTION, RELEASE, DOUBLE_CLICK
+from PreloadScheduler import PreloadScheduler
+from ViewCache import view_cache
+from helper import BG_COLOR, IMG_PATH_PREFIX, OUTPUT_PATH_PREFIX, SYNTHETIC_REFOCUS, \
+    NATIVE_RESOLUTION, GUI_RESERVED_WIDTH, GUI_RESERVED_HEIGHT, DRAG_FRAME_TIME, MULTI_STIMULUS_GAP, Helper, \
+    open_output_files, close_output_files
 
 
 
@@ -43,10 +54,11 @@ class TestSession:
         :param answers_description: The descriptions corresponding to each of the answers in possible_answers.
         :param show_preview: if True, show the preview animation for each image
         :param preload_images: if True, preloads the images for a smoother experience (recommended)
-        :param assessment_method: Assessment method to be used in the test session.
-                                  It should be either Helper.IQA.SINGLE_STIMULUS or Helper.IQA.SINGLE_STIMULUS
+        :param assessment_method: Assessment method to be used in the test session. It should be either
+                                  Helper.IQA.SINGLE_STIMULUS, Helper.IQA.DOUBLE_STIMULUS or Helper.IQA.MULTI_STIMULUS
         :param test_image_side: Side on which the test image should be displayed.
-                                This should be either Helper.Side.LEFT or Helper.Side.Right
+                                This should be either Helper.Side.LEFT or Helper.Side.Right. With the multi stimulus
+                                method, the reference image is on the other side of all the test images.
         """
 
         self.images = images
@@ -58,24 +70,40 @@ class TestSession:
         self.assessment_method = assessment_method
         self.test_image_side = test_image_side
         self.panels = None
+        self.composite_frame = None
+        self.view_labels = []
         self.img_index = 0
         self.img_index_label = None
         self.message_label = None
         self.cur_img = images[self.img_index]
         self.answers = [None] * len(images)
 
+        # Latest mouse position while dragging, not applied yet, and time at which the last one was applied
+        self.pending_move_pos = None
+        self.move_after_id = None
+        self.last_move_time = 0
+
+        open_output_files()
+
         self.root = tk.Tk()
+        Helper.root = self.root
+        Helper.frame_scheduler = FrameScheduler(self.root)
         self.root.title("lf-tracking")
         self.root.configure(background=BG_COLOR)
         self.root.geometry("{0}x{1}+0+0".format(self.root.winfo_screenwidth(), self.root.winfo_screenheight()))
 
         self.logo_img = ImageTk.PhotoImage(Image.open(IMG_PATH_PREFIX + "epfl-mmspg.png"))
 
+        # The views must be downscaled before they are loaded
+        view_size = None if NATIVE_RESOLUTION else self.get_panel_size()
+        for img in self.images:
+            img.set_view_size(view_size)
+
+        self.preloader = None
         if self.preload_images:
             # Loads the first few images asynchronously
-            for i in range(NB_IMAGES_PRELOADED + 1):
-                print("Loading image {}/{}...".format(i + 1, len(self.images)))
-                self.images[i].load_images(self.assessment_method)
+            self.preloader = PreloadScheduler(self.images, self.assessment_method, self.show_preview)
+            self.preloader.update(self.img_index)
 
         if show_preview:
             self.start_btn = tk.Button(self.root, text="START", command=self.start_session,
@@ -98,11 +126,20 @@ class TestSession:
 
         for img in self.images:
             img.set_panels(self.panels)
+            img.set_composite_frame(self.composite_frame)
             img.set_test_image_side(self.test_image_side)
 
-        if self.preload_images and not self.cur_img.is_loaded:
-            Helper.fullscreen_msg.config(text="Loading image...")
-            Helper.fullscreen_msg.pack(fill="both", expand="true")
+        view_cache.set_current(*self.cur_img.test_img_names, self.cur_img.reference_img_name)
+        Helper.tracking_log.start_stimulus(self.cur_img.get_stimulus_name())
+        if Helper.pointer_capture is not None:
+            Helper.pointer_capture.start_stimulus(self.cur_img.get_stimulus_name())
+        memory_accounting.start_stimulus(self.cur_img)
+
+        if self.preload_images:
+            self.preloader.on_image_shown(self.img_index)
+            if not self.cur_img.is_loaded:
+                Helper.fullscreen_msg.config(text="Loading image...")
+                Helper.fullscreen_msg.pack(fill="both", expand="true")
 
         # Start by either showing the preview or the normal interactive view
         if self.show_preview:
@@ -134,7 +171,18 @@ class TestSession:
         ref_label.grid(row=1, column=ref_col, pady=5)
 
         # Panel(s) where the image(s) is(are) displayed
-        if self.assessment_method is Helper.IQA.DOUBLE_STIMULUS:
+        if self.assessment_method is Helper.IQA.MULTI_STIMULUS:
+            # All the views are displayed side by side on one panel, with one label above each of them
+            labels_frame = tk.Frame(main_frame, background=BG_COLOR)
+            labels_frame.grid(row=1, column=0, sticky="ew")
+            self.view_labels = [tk.Label(labels_frame, background=BG_COLOR) for _ in range(self.get_nb_views())]
+            test_label.grid_remove()
+            ref_label.grid_remove()
+
+            self.panels = [tk.Label(main_frame, background=BG_COLOR)]
+            self.panels[0].grid(row=2, column=0)
+            self.composite_frame = CompositeFrame(self.panels[0])
+        elif self.assessment_method is Helper.IQA.DOUBLE_STIMULUS:
             self.panels = [tk.Label(main_frame, background=BG_COLOR), tk.Label(main_frame, background=BG_COLOR)]
             self.panels[0].grid(row=2, column=0)
             self.panels[1].grid(row=2, column=2)
@@ -147,11 +195,14 @@ class TestSession:
             panel.bind('<Button-1>', self.click)
             panel.bind('<B1-Motion>', self.move)
             panel.bind('<Double-Button-1>', self.refocus_to_point)
+            if Helper.pointer_capture is not None:
+                panel.bind('<ButtonRelease-1>', self.release)
 
         # Scale (a.k.a. slider) to perform refocusing
         focus_frame = tk.Frame(main_frame, background=BG_COLOR, padx=5)
         self.focus_slider = tk.Scale(focus_frame, from_=self.cur_img.nb_img_depth - 1, to=0,
                                      command=self.slider_refocus_to_depth,
+                                     resolution=0.1 if SYNTHETIC_REFOCUS else 1,
                                      showvalue=0, length=200, background=BG_COLOR)
         self.focus_slider.grid(row=1, column=0)
         tk.Label(focus_frame, text="Far", background=BG_COLOR).grid(row=0, column=0)
@@ -184,6 +235,7 @@ class TestSession:
         main_frame.place(anchor="c", relx=.50, rely=.50)
 
         self.display_img_index()
+        self.display_view_labels()
 
         # Information message used when loading inmage and when the test session ends
         Helper.fullscreen_msg = tk.Label(self.root, text="", background=BG_COLOR)
@@ -194,33 +246,61 @@ class TestSession:
         logo_label.configure(image=self.logo_img)
         logo_label.place(anchor="se", relx=1, rely=1)
 
+    def get_panel_size(self):
+        """Returns the maximum size (width, height) of a panel such that the GUI built by setup_gui fits
+        on the screen."""
+
+        nb_panels = self.get_nb_views()
+        width = (self.root.winfo_screenwidth() - GUI_RESERVED_WIDTH - (nb_panels - 1) * self.get_gap()) // nb_panels
+        height = self.root.winfo_screenheight() - GUI_RESERVED_HEIGHT
+
+        return max(1, width), max(1, height)
+
+    def get_nb_views(self):
+        """Returns the maximum number of views displayed next to each other."""
+
+        if self.assessment_method is Helper.IQA.MULTI_STIMULUS:
+            return max(len(img.test_img_names) for img in self.images) + 1
+        return 2 if self.assessment_method is Helper.IQA.DOUBLE_STIMULUS else 1
+
+    def get_gap(self):
+        """Returns the space in pixels between two views displayed on the same panel."""
+
+        return MULTI_STIMULUS_GAP if self.assessment_method is Helper.IQA.MULTI_STIMULUS else 0
+
     def next_img(self):
         """Displays the next image"""
 
         if not self.is_last_image():
+            self.cancel_move()
+            self.cur_img.stop_animations()
             self.cur_img.close_img()
+            memory_accounting.end_stimulus(self.cur_img)
             self.cur_img.clear_memory()
             self.cur_img.cur_time = 0
             self.img_index += 1
             self.cur_img = self.images[self.img_index]
+            view_cache.set_current(*self.cur_img.test_img_names, self.cur_img.reference_img_name)
 
             if self.preload_images:
+                # Load the current image first if needed, and the following images already
+                self.preloader.update(self.img_index)
+                self.preloader.on_image_shown(self.img_index)
+
                 # Display loading message is image is not loaded yet
                 if not self.cur_img.is_loaded:
                     Helper.fullscreen_msg.config(text="Loading image...")
                     Helper.fullscreen_msg.pack(fill="both", expand="true")
 
-                # Preload the following image already
-                if self.img_index + NB_IMAGES_PRELOADED < len(self.images):
-                    print("Loading image {}/{}...".format(self.img_index + NB_IMAGES_PRELOADED + 1, len(self.images)))
-                    self.images[self.img_index + NB_IMAGES_PRELOADED].load_images(self.assessment_method)
-
             self.display_img_index()
-            f_tracking.write("\n")
+            self.display_view_labels()
+            Helper.tracking_log.start_stimulus(self.cur_img.get_stimulus_name())
+            if Helper.pointer_capture is not None:
+                Helper.pointer_capture.start_stimulus(self.cur_img.get_stimulus_name())
+            memory_accounting.start_stimulus(self.cur_img)
 
             # Reset slider value to 0
-            Helper.is_focus_slider_enabled = False
-            Helper.focus_slider.set(0)
+            self.cur_img.set_focus_slider_value(0)
 
             if self.show_preview:
                 self.cur_img.preview()
@@ -236,7 +316,13 @@ class TestSession:
         # The user cannot answer during the preview, or when the images are not yet loaded
         if self.cur_img.is_loaded and not self.cur_img.is_preview_running:
             self.answers[self.img_index] = answ
-            f_answers.write("{:30}: {}\n".format(self.cur_img.img_name, answ))
+            if self.preloader is not None:
+                self.preloader.on_answer(self.img_index)
+            # With the multi stimulus method, the grade applies to each of the test images displayed
+            for img_name in self.cur_img.test_img_names:
+                Helper.f_answers.write("{:30}: {}\n".format(img_name, answ))
+            # Committed to disk by the writer thread, without waiting
+            Helper.f_answers.flush()
 
             if self.is_last_image():
                 self.finish_test_session()
@@ -246,21 +332,74 @@ class TestSession:
     def click(self, event):
         """Method  called whenever an image is clicked on."""
 
+        self.capture_pointer(PRESS, event)
+
+        # The end of the previous drag must be applied before the new click
+        if self.pending_move_pos is not None:
+            self.apply_move()
+
         self.cur_img.click((event.x, event.y))
         return
 
     def move(self, event):
-        """Method  called when the mouse is dragged over an image."""
+        """Method  called when the mouse is dragged over an image.
 
-        self.cur_img.move((event.x, event.y))
+        The position is only stored, it is applied at most once per DRAG_FRAME_TIME by apply_move,
+        so that the events received faster than the views can be displayed do not pile up.
+        """
+        self.capture_pointer(MOTION, event)
+
+        if self.pending_move_pos is None:
+            if instrumentation.enabled:
+                instrumentation.start_input("move")
+            delay = max(0, self.last_move_time + DRAG_FRAME_TIME - time.perf_counter())
+            self.move_after_id = self.root.after(int(round(delay * 1000)), self.apply_move)
+
+        self.pending_move_pos = (event.x, event.y)
         return
 
+    def release(self, event):
+        """Method called when the mouse button is released, only bound when the pointer events are captured."""
+
+        self.capture_pointer(RELEASE, event)
+
+    def capture_pointer(self, kind, event):
+        """Records a pointer event received by a panel if the pointer events are captured (see PointerCapture)."""
+
+        if Helper.pointer_capture is not None:
+            Helper.pointer_capture.record(kind, event.x, event.y, 1, self.panels.index(event.widget))
+
+    def apply_move(self):
+        """Changes the image displayed according to the latest mouse position received while dragging."""
+
+        if self.move_after_id is not None:
+            self.root.after_cancel(self.move_after_id)
+            self.move_after_id = None
+
+        move_pos = self.pending_move_pos
+        self.pending_move_pos = None
+        self.last_move_time = time.perf_counter()
+
+        self.cur_img.move(move_pos)
+        if instrumentation.enabled:
+            instrumentation.end_input()
+
+    def cancel_move(self):
+        """Drops the mouse position that was not applied yet, if any."""
+
+        if self.move_after_id is not None:
+            self.root.after_cancel(self.move_after_id)
+            self.move_after_id = None
+        self.pending_move_pos = None
+
     def slider_refocus_to_depth(self, focus_depth):
         """Displays the image corresponding to the given focus depth.
         
         :param focus_depth: The depth to focus to image on.
         """
         if Helper.is_focus_slider_enabled:
+            if instrumentation.enabled:
+                instrumentation.start_input("slider")
             self.cur_img.refocus_to_depth(focus_depth)
         else:
             Helper.is_focus_slider_enabled = True
@@ -270,6 +409,10 @@ class TestSession:
 
         :param event: The event that triggered the refocusing and contains the point coordinates
         """
+        self.capture_pointer(DOUBLE_CLICK, event)
+
+        if instrumentation.enabled:
+            instrumentation.start_input("refocus_to_point")
         self.cur_img.refocus_to_point(event)
 
     def display_img_index(self):
@@ -277,6 +420,25 @@ class TestSession:
 
         self.img_index_label.configure(text="Image {}/{}".format(self.img_index + 1, len(self.images)))
 
+    def display_view_labels(self):
+        """Displays a label above each view of the current image with the multi stimulus method."""
+
+        if not self.view_labels:
+            return
+
+        texts = ["Test {}".format(i + 1) for i in range(len(self.cur_img.test_img_names))]
+        texts = ["Reference"] + texts if self.test_image_side is Helper.Side.RIGHT else texts + ["Reference"]
+
+        labels_frame = self.view_labels[0].master
+        for i, label in enumerate(self.view_labels):
+            if i < len(texts):
+                label.configure(text=texts[i])
+                label.grid(row=0, column=i, padx=self.get_gap() // 2)
+                labels_frame.columnconfigure(i, weight=1, uniform="views")
+            else:
+                label.grid_remove()
+                labels_frame.columnconfigure(i, weight=0, uniform="")
+
     def is_last_image(self):
         """Return True iff the current image displayed is the last one."""
 
@@ -285,13 +447,22 @@ class TestSession:
     def finish_test_session(self):
         """Called at the end of the test session to close all files and display a message"""
 
+        self.cancel_move()
+        self.cur_img.stop_animations()
         self.cur_img.close_img()
+        memory_accounting.end_stimulus(self.cur_img)
         self.cur_img.clear_memory()
+        if self.preloader is not None:
+            self.preloader.cancel()
+        memory_accounting.stop()
+
+        close_output_files()
 
-        f_tracking.flush()
-        f_tracking.close()
-        f_answers.flush()
-        f_answers.close()
+        ImageLoader.shutdown()
+        print(view_cache.stats())
+        if instrumentation.enabled:
+            instrumentation.write_report(OUTPUT_PATH_PREFIX + Helper.session_timestamp + '-performance.txt')
+        memory_accounting.write_report(OUTPUT_PATH_PREFIX + Helper.session_timestamp + '-memory.txt')
 
         Helper.fullscreen_msg.config(text="Thank you!")
         Helper.fullscreen_msg.pack(fill="both", expand="true")
@@ -0,0 +1,210 @@
+#   TrackingLog.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Binary log of the sub-aperture images displayed during a test session.
+
+Each event is a fixed-size record of EVENT_DTYPE, with times taken from a monotonic clock in nanoseconds.
+The records are stored in <session>-tracking.bin and described by <session>-tracking.json, which holds
+the names of the stimuli and the offset between the monotonic clock and the wall clock.
+
+Usage:
+    python TrackingLog.py output/<session>-tracking.bin ...   Converts logs into the tracking.txt text format
+"""
+
+import datetime
+import json
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from helper import IMG_FORMAT, TRACKING_BUFFER_SIZE, DURABLE_COMMIT_INTERVAL
+
+EVENT_DTYPE = np.dtype([("session", "<u4"),
+                        ("stimulus", "<u2"),  # Index of the stimulus in the session
+                        ("u", "<u2"),
+                        ("v", "<u2"),
+                        ("depth", "<i2"),  # -1 for a perspective image
+                        ("start", "<i8"),  # Monotonic time in ns
+                        ("end", "<i8")])
+
+NO_DEPTH = -1
+
+
+class TrackingLog:
+    """Records the sub-aperture images displayed in a preallocated buffer, which is written to disk in bulk.
+
+    The buffer is written when it is full, when a new stimulus starts, and at least every DURABLE_COMMIT_INTERVAL
+    seconds while events are recorded, so that little is lost if the session crashes.
+    """
+
+    def __init__(self, path_prefix, session_name, capacity=TRACKING_BUFFER_SIZE, writer=None):
+        """Initializes a tracking log.
+
+        :param path_prefix: The path of the log files, without the ".bin" and ".json" extensions.
+        :param session_name: The name of the test session.
+        :param capacity: The number of events kept in memory before being written to disk.
+        :param writer: The DurableWriter writing the files in the background. If it is None,
+                       the files are written directly.
+        """
+        self.bin_path = path_prefix + ".bin"
+        self.meta_path = path_prefix + ".json"
+        self.session_name = session_name
+        self.session = zlib.crc32(session_name.encode("utf-8"))
+        self.stimuli = []
+
+        self.events = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.nb_events = 0
+        self.flush_interval_ns = int(DURABLE_COMMIT_INTERVAL * 1e9)
+        self.last_flush_ns = time.perf_counter_ns()
+
+        # Anchor used to convert monotonic times into wall-clock times
+        self.wall_ns = time.time_ns()
+        self.monotonic_ns = time.perf_counter_ns()
+
+        self.writer = writer
+        if writer is None:
+            self.file = open(self.bin_path, "wb")
+        else:
+            self.file = writer.open_stream(self.bin_path, binary=True)
+        self.write_metadata()
+
+    def start_stimulus(self, img_name):
+        """Starts a new stimulus: the following events are attributed to it.
+
+        :param img_name: The name of the test image of the stimulus.
+        """
+        # Good time to write the events of the previous stimulus, the user is not interacting
+        if self.nb_events > 0:
+            self.flush()
+        self.stimuli.append(img_name)
+        self.write_metadata()
+
+    def record(self, u, v, focus_depth, start_ns, end_ns):
+        """Records that a sub-aperture image of the current stimulus was displayed.
+
+        :param u: The u coordinate of the image.
+        :param v: The v coordinate of the image.
+        :param focus_depth: The focus depth of the image, or None for a perspective image.
+                            Intermediate depths of synthetic refocused images are rounded.
+        :param start_ns: The time at which the image was displayed (see now()).
+        :param end_ns: The time at which the image was replaced (see now()).
+        """
+        self.events[self.nb_events] = (self.session, len(self.stimuli) - 1, u, v,
+                                       NO_DEPTH if focus_depth is None else round(focus_depth), start_ns, end_ns)
+        self.nb_events += 1
+
+        if self.nb_events == len(self.events) or end_ns - self.last_flush_ns >= self.flush_interval_ns:
+            self.flush()
+
+    def flush(self):
+        """Writes the events in memory to disk."""
+
+        if self.nb_events > 0:
+            self.file.write(self.events[:self.nb_events].tobytes())
+            self.nb_events = 0
+        self.file.flush()
+        self.last_flush_ns = time.perf_counter_ns()
+
+    def close(self):
+        self.flush()
+        self.write_metadata()
+        self.file.close()
+
+    def write_metadata(self):
+        metadata = {"session": self.session,
+                    "session_name": self.session_name,
+                    "stimuli": self.stimuli,
+                    "img_format": IMG_FORMAT,
+                    "wall_ns": self.wall_ns,
+                    "monotonic_ns": self.monotonic_ns,
+                    "dtype": EVENT_DTYPE.descr}
+
+        if self.writer is None:
+            with open(self.meta_path, "w") as f:
+                json.dump(metadata, f)
+        else:
+            self.writer.replace(self.meta_path, json.dumps(metadata).encode("utf-8"))
+
+
+def now():
+    """Returns the current time of the monotonic clock used in the tracking logs, in nanoseconds."""
+
+    return time.perf_counter_ns()
+
+
+def read(bin_path):
+    """Reads a tracking log.
+
+    :param bin_path: The path of the .bin file of the log.
+    :return: A tuple (events, metadata), events being an array of EVENT_DTYPE.
+    """
+    with open(bin_path[:-len(".bin")] + ".json") as f:
+        metadata = json.load(f)
+
+    return np.fromfile(bin_path, dtype=EVENT_DTYPE), metadata
+
+
+def to_text(bin_path, txt_path=None):
+    """Converts a tracking log into the text format of the tracking.txt files.
+
+    :param bin_path: The path of the .bin file of the log.
+    :param txt_path: The path of the text file. If it is None, the extension of bin_path is replaced by ".txt".
+    :return: The path of the text file.
+    """
+    if txt_path is None:
+        txt_path = bin_path[:-len(".bin")] + ".txt"
+
+    events, metadata = read(bin_path)
+    offset_ns = metadata["wall_ns"] - metadata["monotonic_ns"]
+
+    def wall_clock(t_ns):
+        t_ns += offset_ns
+        t = datetime.datetime.fromtimestamp(t_ns // 10 ** 9)
+        t += datetime.timedelta(microseconds=t_ns % 10 ** 9 // 1000)
+        return t.strftime('%H:%M:%S.%f')
+
+    with open(txt_path, "w") as f:
+        prev_stimulus = None
+        for e in events.tolist():
+            _, stimulus, u, v, depth, start, end = e
+
+            # Stimuli are separated by an empty line
+            if prev_stimulus is not None and stimulus != prev_stimulus:
+                f.write("\n")
+            prev_stimulus = stimulus
+
+            if depth == NO_DEPTH:
+                img_name = '{}/{:03}_{:03}.{}'.format(metadata["stimuli"][stimulus], u, v, metadata["img_format"])
+            else:
+                img_name = '{}/{:03}_{:03}_{:03}.{}'.format(metadata["stimuli"][stimulus], u, v, depth,
+                                                            metadata["img_format"])
+
+            f.write("{}  start: {}  end: {}  on-screen: {}\n".format(
+                img_name, wall_clock(start), wall_clock(end),
+                datetime.timedelta(microseconds=(end - start) // 1000)))
+
+    return txt_path
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print("{} -> {}".format(path, to_text(path)))
@@ -0,0 +1,174 @@
+#   ViewCache.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from collections import OrderedDict
+
+from PIL import Image
+
+from helper import VIEW_CACHE_BUDGET
+
+
+def image_nbytes(view):
+    """Returns the memory used by a view: a PIL image, or a Tk image, which stores 4 bytes per pixel."""
+
+    if isinstance(view, Image.Image):
+        return view.size[0] * view.size[1] * len(view.getbands())
+
+    return view.width() * view.height() * 4
+
+
+class ViewCache:
+    """Cache of the views displayed, shared by all the light-field images of the session.
+
+    Views are indexed by (image name, u, v, focus depth). When the total size of the views exceeds the
+    budget, the least recently used views are evicted first, but the views of the current
+    stimulus are only evicted when no other view is left.
+    """
+
+    def __init__(self, budget):
+        """Initializes a view cache.
+
+        :param budget: The maximum number of bytes held by the cached views.
+        """
+        self.budget = budget
+        self.views = OrderedDict()
+        self.sizes = {}
+        self.keys_by_image = {}
+        self.current_images = set()
+        self.nbytes = 0
+        # Number of light-field images using each shared image (e.g. a reference image)
+        self.refcounts = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the view with the given key, or None if it is not cached.
+
+        :param key: A tuple (image name, u, v, focus depth).
+        """
+        view = self.views.get(key)
+
+        if view is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.views.move_to_end(key)
+
+        return view
+
+    def contains(self, key):
+        """Returns True iff the view with the given key is cached. It does not count as an access."""
+
+        return key in self.views
+
+    def put(self, key, view):
+        """Adds a view to the cache, evicting other views if needed.
+
+        :param key: A tuple (image name, u, v, focus depth).
+        :param view: The view (a Tk image, or a PIL image if the views are pasted into the panels).
+        """
+        self.remove(key)
+
+        size = image_nbytes(view)
+        self.views[key] = view
+        self.sizes[key] = size
+        self.keys_by_image.setdefault(key[0], set()).add(key)
+        self.nbytes += size
+
+        self.evict(keep=key)
+
+    def remove(self, key):
+        if key in self.views:
+            del self.views[key]
+            self.nbytes -= self.sizes.pop(key)
+            self.keys_by_image[key[0]].discard(key)
+
+    def discard(self, img_name):
+        """Removes all the views of the given image.
+
+        :param img_name: The name of the image.
+        """
+        for key in list(self.keys_by_image.get(img_name, ())):
+            self.remove(key)
+        self.keys_by_image.pop(img_name, None)
+
+    def acquire(self, img_name):
+        """Registers a user of the views of an image shared by several light-field images."""
+
+        self.refcounts[img_name] = self.refcounts.get(img_name, 0) + 1
+
+    def release(self, img_name):
+        """Unregisters a user of the views of a shared image. They are discarded once they have no user left.
+
+        :return: True iff the views were discarded.
+        """
+        self.refcounts[img_name] -= 1
+        if self.refcounts[img_name] > 0:
+            return False
+
+        del self.refcounts[img_name]
+        self.discard(img_name)
+        return True
+
+    def get_views(self, img_name):
+        """Returns the cached views of the given image. It does not count as an access."""
+
+        return [self.views[key] for key in self.keys_by_image.get(img_name, ())]
+
+    def image_nbytes(self, img_name):
+        """Returns the number of bytes held by the cached views of the given image."""
+
+        return sum(self.sizes[key] for key in self.keys_by_image.get(img_name, ()))
+
+    def set_current(self, *img_names):
+        """Sets the images of the current stimulus, whose views are kept as long as possible.
+
+        :param img_names: The names of the images displayed (e.g. the test and the reference image).
+        """
+        self.current_images = set(img_names)
+
+    def evict(self, keep=None):
+        """Evicts views until the cache fits in its budget.
+
+        :param keep: Key of a view that should not be evicted.
+        """
+        if self.nbytes <= self.budget:
+            return
+
+        # Views of other stimuli first, then the views of the current stimulus
+        for current in (False, True):
+            for key in list(self.views):
+                if self.nbytes <= self.budget:
+                    return
+                if key != keep and (key[0] in self.current_images) == current:
+                    self.remove(key)
+                    self.evictions += 1
+
+    def stats(self):
+        """Returns a string describing the usage of the cache."""
+
+        return "view cache: {} views, {:.1f}/{:.1f} MB, {} hits, {} misses, {} evictions".format(
+            len(self.views), self.nbytes / 1e6, self.budget / 1e6, self.hits, self.misses, self.evictions)
+
+
+# Cache shared by all LFImage instances
+view_cache = ViewCache(VIEW_CACHE_BUDGET)
@@ -0,0 +1,109 @@
+#   ViewTable.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from SubapertureImage import SubapertureImage
+from helper import IMG_FORMAT
+
+
+def get_view_name(img_name, img):
+    """Returns the name of the image file of a sub-aperture image of a light-field image.
+
+    :param img_name: The name of the light-field image.
+    :param img: The SubapertureImage.
+    """
+    if img.focus_depth is None:
+        # Normal image
+        return '{}/{:03}_{:03}.{}'.format(img_name, img.u, img.v, IMG_FORMAT)
+
+    # Refocused image
+    return '{}/{:03}_{:03}_{:03}.{}'.format(img_name, img.u, img.v, img.focus_depth, IMG_FORMAT)
+
+
+class ViewTable:
+    """Keys in the view cache and file names of all the views of a stimulus, computed once.
+
+    For each sub-aperture image, the table holds a tuple of (key, file name) pairs: one per test image, followed
+    by the reference image. The entries of the perspective images are stored in a flat list indexed by their
+    offset in the grid of viewpoints. The entries of the refocused images (whose depths are not known in advance
+    with synthetic refocusing) and of the images outside the grid are added the first time they are needed.
+    Looking up the views of a sub-aperture image then allocates nothing.
+    """
+
+    def __init__(self, test_img_names, reference_img_name, top_left, nb_img_x, nb_img_y, view_size):
+        """Initializes the table of the views of a light-field image.
+
+        :param test_img_names: The names of the test images displayed.
+        :param reference_img_name: The name of the reference image.
+        :param top_left: The coordinates of the top-left viewpoint.
+        :param nb_img_x: The number of images in the x-axis.
+        :param nb_img_y: The number of images in the y-axis.
+        :param view_size: The size the views are downscaled to, which is part of their keys in the view cache.
+        """
+        self.img_names = tuple(test_img_names) + (reference_img_name,)
+        self.nb_test_images = len(test_img_names)
+        self.top_left = top_left
+        self.nb_img_x = nb_img_x
+        self.nb_img_y = nb_img_y
+        self.view_size = view_size
+
+        # Entries (views with the reference, views without it) of the perspective images, indexed by
+        # (u - top_left[0]) * nb_img_y + (v - top_left[1]), and of the other sub-aperture images
+        self.grid_entries = [None] * (nb_img_x * nb_img_y)
+        self.other_entries = {}
+
+        for u in range(top_left[0], top_left[0] + nb_img_x):
+            for v in range(top_left[1], top_left[1] + nb_img_y):
+                self.grid_entries[self.get_offset(u, v)] = self.create_entry(SubapertureImage(u, v, None))
+
+    def get_offset(self, u, v):
+        """Returns the offset of a viewpoint in the grid, or -1 if it is outside the grid."""
+
+        du, dv = u - self.top_left[0], v - self.top_left[1]
+        if 0 <= du < self.nb_img_x and 0 <= dv < self.nb_img_y:
+            return du * self.nb_img_y + dv
+
+        return -1
+
+    def create_entry(self, img):
+        views = tuple(((img_name, img.u, img.v, img.focus_depth, self.view_size), get_view_name(img_name, img))
+                      for img_name in self.img_names)
+        return views, views[:self.nb_test_images]
+
+    def get_entry(self, img):
+        if img.focus_depth is None:
+            offset = self.get_offset(img.u, img.v)
+            if offset >= 0:
+                return self.grid_entries[offset]
+
+        entry = self.other_entries.get(img)
+        if entry is None:
+            entry = self.create_entry(img)
+            self.other_entries[img] = entry
+
+        return entry
+
+    def get_views(self, img, with_reference=True):
+        """Returns the views of a sub-aperture image, as a tuple of (key in the view cache, file name) pairs:
+        the test views, followed by the reference view if with_reference is True.
+
+        :param img: The SubapertureImage.
+        :param with_reference: True iff the reference view is displayed.
+        """
+        return self.get_entry(img)[0 if with_reference else 1]
@@ -0,0 +1,320 @@
+#   WebSocket.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Minimal HTTP/1.1 and WebSocket (RFC 6455) implementation on asyncio streams, used by the web front end
+(see web_server.py) and its load test (see web_load_test.py).
+
+Only what they need is implemented: requests without body, text messages, ping/pong and closing handshakes.
+"""
+
+import asyncio
+import base64
+import hashlib
+import os
+import struct
+from urllib.parse import urlsplit, parse_qs
+
+# Key suffix defined by RFC 6455 for the handshake
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+# Maximum size of a message or of the headers of a request, larger ones close the connection
+MAX_MESSAGE_SIZE = 1024 ** 2
+MAX_HEADERS_SIZE = 16 * 1024
+
+
+class ProtocolError(Exception):
+    """Raised when the peer does not follow the protocol."""
+
+
+class HttpRequest:
+    """Represents an HTTP request without body."""
+
+    def __init__(self, method, target, headers):
+        """Initializes a request.
+
+        :param method: The method (e.g. "GET").
+        :param target: The target, with its query string (e.g. "/ws?subject=3").
+        :param headers: The headers, as a dictionary whose keys are lower case.
+        """
+        self.method = method
+        self.target = target
+        self.headers = headers
+
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+    def is_websocket(self):
+        """Returns True iff the request asks to upgrade the connection to a WebSocket."""
+
+        return self.headers.get("upgrade", "").lower() == "websocket" and "sec-websocket-key" in self.headers
+
+    def keep_alive(self):
+        """Returns True iff the connection can be used for other requests after this one."""
+
+        return self.headers.get("connection", "").lower() != "close"
+
+
+async def read_headers(reader):
+    """Reads the start line and the headers of an HTTP request or response.
+
+    :param reader: The asyncio.StreamReader of the connection.
+    :return: A tuple (start line, headers), or None if the connection was closed before a request.
+    """
+    try:
+        data = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise ProtocolError("incomplete headers")
+        return None
+    except asyncio.LimitOverrunError:
+        raise ProtocolError("headers too large")
+
+    if len(data) > MAX_HEADERS_SIZE:
+        raise ProtocolError("headers too large")
+
+    lines = data.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    return lines[0], headers
+
+
+async def read_request(reader):
+    """Reads an HTTP request without body.
+
+    :param reader: The asyncio.StreamReader of the connection.
+    :return: An HttpRequest, or None if the connection was closed.
+    """
+    result = await read_headers(reader)
+    if result is None:
+        return None
+
+    start_line, headers = result
+    try:
+        method, target, _ = start_line.split(" ", 2)
+    except ValueError:
+        raise ProtocolError("invalid request line {!r}".format(start_line))
+    if headers.get("content-length", "0") != "0" or "transfer-encoding" in headers:
+        raise ProtocolError("requests with a body are not supported")
+
+    return HttpRequest(method, target, headers)
+
+
+def write_response(writer, status, headers=(), body=b""):
+    """Writes an HTTP response. The data is sent by the event loop, see asyncio.StreamWriter.write.
+
+    :param writer: The asyncio.StreamWriter of the connection.
+    :param status: The status, e.g. "200 OK".
+    :param headers: The list of the (name, value) headers, Content-Length is added.
+    :param body: The body, as bytes.
+    """
+    lines = ["HTTP/1.1 " + status] + ["{}: {}".format(name, value) for name, value in headers]
+    lines.append("Content-Length: {}".format(len(body)))
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+
+def accept_key(key):
+    """Returns the Sec-WebSocket-Accept value answering the given Sec-WebSocket-Key."""
+
+    return base64.b64encode(hashlib.sha1((key + GUID).encode("ascii")).digest()).decode("ascii")
+
+
+async def accept(request, reader, writer):
+    """Completes the opening handshake of a WebSocket requested by a client.
+
+    :param request: The HttpRequest asking for the upgrade (see HttpRequest.is_websocket).
+    :param reader: The asyncio.StreamReader of the connection.
+    :param writer: The asyncio.StreamWriter of the connection.
+    :return: The WebSocket.
+    """
+    writer.write("HTTP/1.1 101 Switching Protocols\r\n"
+                 "Upgrade: websocket\r\n"
+                 "Connection: Upgrade\r\n"
+                 "Sec-WebSocket-Accept: {}\r\n\r\n".format(accept_key(request.headers["sec-websocket-key"]))
+                 .encode("ascii"))
+    await writer.drain()
+
+    return WebSocket(reader, writer, is_client=False)
+
+
+async def connect(host, port, target):
+    """Opens a WebSocket to a server.
+
+    :param host: The host of the server.
+    :param port: The port of the server.
+    :param target: The target of the request, e.g. "/ws?subject=3".
+    :return: The WebSocket.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+
+    writer.write("GET {} HTTP/1.1\r\n"
+                 "Host: {}:{}\r\n"
+                 "Upgrade: websocket\r\n"
+                 "Connection: Upgrade\r\n"
+                 "Sec-WebSocket-Key: {}\r\n"
+                 "Sec-WebSocket-Version: 13\r\n\r\n".format(target, host, port, key).encode("ascii"))
+    await writer.drain()
+
+    result = await read_headers(reader)
+    if result is None or result[0].split(" ")[1:2] != ["101"] or \
+            result[1].get("sec-websocket-accept") != accept_key(key):
+        writer.close()
+        raise ProtocolError("the server refused the WebSocket: {}".format(result[0] if result else "no response"))
+
+    return WebSocket(reader, writer, is_client=True)
+
+
+class WebSocket:
+    """WebSocket exchanging text messages over an asyncio connection."""
+
+    def __init__(self, reader, writer, is_client):
+        """Initializes a WebSocket whose opening handshake is done (see accept and connect).
+
+        :param reader: The asyncio.StreamReader of the connection.
+        :param writer: The asyncio.StreamWriter of the connection.
+        :param is_client: True on the client side, whose frames must be masked.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.is_client = is_client
+        self.is_closed = False
+
+    async def recv(self):
+        """Returns the next text message, or None once the connection is closed."""
+
+        fragments = []
+        size = 0
+
+        while True:
+            try:
+                opcode, is_final, payload = await self.read_frame()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.is_closed = True
+                return None
+
+            if opcode == OP_CLOSE:
+                if not self.is_closed:
+                    # Echo the close frame to complete the closing handshake
+                    self.write_frame(OP_CLOSE, payload[:2])
+                    self.is_closed = True
+                self.writer.close()
+                return None
+            elif opcode == OP_PING:
+                self.write_frame(OP_PONG, payload)
+                continue
+            elif opcode == OP_PONG:
+                continue
+            elif opcode in (OP_TEXT, OP_BINARY, OP_CONTINUATION):
+                if (opcode == OP_CONTINUATION) != bool(fragments):
+                    raise ProtocolError("unexpected frame")
+                fragments.append(payload)
+                size += len(payload)
+                if size > MAX_MESSAGE_SIZE:
+                    raise ProtocolError("message too large")
+                if is_final:
+                    return b"".join(fragments).decode("utf-8")
+            else:
+                raise ProtocolError("unknown opcode {}".format(opcode))
+
+    async def read_frame(self):
+        """Reads a frame and returns (opcode, is_final, unmasked payload)."""
+
+        header = await self.reader.readexactly(2)
+        is_final = bool(header[0] & 0x80)
+        opcode = header[0] & 0x0F
+        is_masked = bool(header[1] & 0x80)
+        length = header[1] & 0x7F
+
+        if length == 126:
+            length, = struct.unpack("!H", await self.reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack("!Q", await self.reader.readexactly(8))
+        if length > MAX_MESSAGE_SIZE:
+            raise ProtocolError("frame too large")
+        # The frames sent by a client must be masked, those sent by a server must not
+        if is_masked == self.is_client:
+            raise ProtocolError("invalid masking")
+
+        mask = await self.reader.readexactly(4) if is_masked else None
+        payload = await self.reader.readexactly(length)
+        if mask is not None:
+            payload = _apply_mask(payload, mask)
+
+        return opcode, is_final, payload
+
+    def write_frame(self, opcode, payload):
+        """Writes a frame. The data is sent by the event loop, see asyncio.StreamWriter.write."""
+
+        header = bytearray([0x80 | opcode])
+        mask_bit = 0x80 if self.is_client else 0
+
+        if len(payload) < 126:
+            header.append(mask_bit | len(payload))
+        elif len(payload) < 1 << 16:
+            header.append(mask_bit | 126)
+            header += struct.pack("!H", len(payload))
+        else:
+            header.append(mask_bit | 127)
+            header += struct.pack("!Q", len(payload))
+
+        if self.is_client:
+            mask = os.urandom(4)
+            header += mask
+            payload = _apply_mask(payload, mask)
+
+        self.writer.write(bytes(header) + payload)
+
+    async def send(self, text):
+        """Sends a text message, waiting if the peer does not read fast enough.
+
+        :param text: The message, as a string.
+        """
+        if self.is_closed:
+            raise ConnectionError("the WebSocket is closed")
+
+        self.write_frame(OP_TEXT, text.encode("utf-8"))
+        await self.writer.drain()
+
+    async def close(self, code=1000):
+        """Starts the closing handshake. The peer answers with a close frame, which recv() returns None for."""
+
+        if not self.is_closed:
+            self.is_closed = True
+            try:
+                self.write_frame(OP_CLOSE, struct.pack("!H", code))
+                await self.writer.drain()
+            except ConnectionError:
+                self.writer.close()
+
+
+def _apply_mask(payload, mask):
+    """Applies (or removes) the mask of a frame, with a single XOR on big integers."""
+
+    length = len(payload)
+    repeated_mask = (mask * (length // 4 + 1))[:length]
+
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(repeated_mask, "big")).to_bytes(length, "big")
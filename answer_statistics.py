@@ -0,0 +1,346 @@
+#   answer_statistics.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Computes the mean opinion scores (MOS) of the stimuli from the answers files of many sessions.
+
+The answers are gathered in a matrix of shape (nb_sessions, nb_stimuli), each session being one subject, with NaN
+where a subject did not rate a stimulus. The subjects whose scores are outliers are rejected with the screening of
+ITU-R BT.500 (Annex 2, 2.3), then the MOS and their 95% confidence intervals are computed per stimulus, per content
+and per rate (a stimulus "I01R1" is the content "I01" at the rate "R1", as in LFImage).
+
+The parsed answers are kept in <out>/answers.npz with the size and modification time of their files, so that only
+the new or modified answers files are parsed by the next runs.
+
+Usage:
+    python answer_statistics.py [--out analytics/] [--no-screening] [output/ or answers files...]
+"""
+
+import argparse
+import csv
+import glob
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+# Confidence intervals: MOS +/- CONFIDENCE_COEFFICIENT * std / sqrt(N), as in BT.500
+CONFIDENCE_COEFFICIENT = 1.96
+# BT.500 screening: the scores of a stimulus are considered normally distributed if their kurtosis is in this range
+NORMAL_KURTOSIS_RANGE = (2, 4)
+# A subject is rejected if more than this fraction of their scores are outliers...
+MAX_OUTLIER_FRACTION = 0.05
+# ... and if their outliers are not mostly above or mostly below the others (|P - Q| / (P + Q) below this value)
+MAX_OUTLIER_BIAS = 0.3
+
+CACHE_FILE = "answers.npz"
+
+
+def parse_answers_file(path):
+    """Reads the answers of a session.
+
+    :param path: The path of the answers file, whose lines are "<stimulus name>: <score>".
+    :return: A tuple (stimuli, scores): the names of the stimuli rated, and an array of their scores.
+             Answers that are not numbers are skipped.
+    """
+    stimuli = []
+    scores = []
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            name, separator, score = line.rpartition(":")
+            if not separator:
+                continue
+            try:
+                scores.append(float(score))
+            except ValueError:
+                continue
+            stimuli.append(name.strip())
+
+    return stimuli, np.array(scores)
+
+
+def _parse_answers_worker(path):
+    try:
+        return path, parse_answers_file(path), None
+    except Exception as e:
+        return path, None, "{}: {}".format(type(e).__name__, e)
+
+
+def _stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class AnswerMatrix:
+    """Scores of the subjects (rows) for the stimuli (columns), NaN if a subject did not rate a stimulus.
+
+    A subject who rated a stimulus several times is given the mean of their scores.
+    """
+
+    def __init__(self, sessions=(), stimuli=(), scores=None, file_stats=None):
+        """Initializes a matrix.
+
+        :param sessions: The paths of the answers files, one per row.
+        :param stimuli: The names of the stimuli, one per column.
+        :param scores: The array of shape (len(sessions), len(stimuli)).
+        :param file_stats: The array of shape (len(sessions), 2) of the sizes and modification times of the files.
+        """
+        self.sessions = list(sessions)
+        self.stimuli = list(stimuli)
+        self.scores = np.full((len(self.sessions), len(self.stimuli)), np.nan) if scores is None else scores
+        self.file_stats = np.zeros((len(self.sessions), 2), dtype=np.int64) if file_stats is None else file_stats
+
+    @classmethod
+    def load(cls, path):
+        """Loads a matrix saved with save(), or returns an empty matrix if the file does not exist."""
+
+        if not os.path.exists(path):
+            return cls()
+
+        with np.load(path) as data:
+            return cls(data["sessions"].tolist(), data["stimuli"].tolist(), data["scores"], data["file_stats"])
+
+    def save(self, path):
+        np.savez_compressed(path, sessions=np.array(self.sessions, dtype=str), stimuli=np.array(self.stimuli, dtype=str),
+                            scores=self.scores, file_stats=self.file_stats)
+
+    def update(self, paths, processes=None):
+        """Updates the matrix with the given answers files: the files that are new or were modified since they were
+        parsed are parsed in parallel, and the sessions whose file is not given anymore are removed.
+
+        :param paths: The paths of the answers files.
+        :param processes: The number of worker processes. If it is None, the number of CPUs is used.
+        :return: The number of files parsed.
+        """
+        stats = {path: _stat(path) for path in paths}
+        row_of = {session: i for i, session in enumerate(self.sessions)}
+
+        kept = [row_of[path] for path in paths
+                if path in row_of and tuple(self.file_stats[row_of[path]]) == stats[path]]
+        kept_paths = {self.sessions[row] for row in kept}
+        to_parse = [path for path in paths if path not in kept_paths]
+
+        self.sessions = [self.sessions[row] for row in kept]
+        self.scores = self.scores[kept]
+        self.file_stats = self.file_stats[kept]
+        if not to_parse:
+            return 0
+
+        parsed = []
+        with Pool(processes) as pool:
+            for path, result, error in pool.imap_unordered(_parse_answers_worker, to_parse, chunksize=32):
+                if error is not None:
+                    print("Skipping {} ({})".format(path, error))
+                else:
+                    parsed.append((path, result))
+        parsed.sort()
+
+        # New stimuli are appended as new columns
+        column_of = {name: j for j, name in enumerate(self.stimuli)}
+        for _, (stimuli, _) in parsed:
+            for name in stimuli:
+                if name not in column_of:
+                    column_of[name] = len(self.stimuli)
+                    self.stimuli.append(name)
+
+        # The scores of all the new sessions are summed in place, then divided by their counts
+        rows = np.concatenate([np.full(len(scores), i, dtype=np.intp) for i, (_, (_, scores)) in enumerate(parsed)]
+                              + [np.zeros(0, dtype=np.intp)])
+        columns = np.array([column_of[name] for _, (stimuli, _) in parsed for name in stimuli], dtype=np.intp)
+        values = np.concatenate([scores for _, (_, scores) in parsed] + [np.zeros(0)])
+
+        sums = np.zeros((len(parsed), len(self.stimuli)))
+        counts = np.zeros((len(parsed), len(self.stimuli)))
+        np.add.at(sums, (rows, columns), values)
+        np.add.at(counts, (rows, columns), 1)
+        with np.errstate(invalid="ignore"):
+            new_scores = sums / counts
+
+        old_scores = np.full((len(self.sessions), len(self.stimuli)), np.nan)
+        old_scores[:, :self.scores.shape[1]] = self.scores
+
+        self.sessions += [path for path, _ in parsed]
+        self.scores = np.vstack([old_scores, new_scores])
+        self.file_stats = np.vstack([self.file_stats.reshape(-1, 2),
+                                     np.array([stats[path] for path, _ in parsed], dtype=np.int64).reshape(-1, 2)])
+
+        return len(parsed)
+
+
+def screen_subjects(scores):
+    """Finds the subjects whose scores are outliers, following ITU-R BT.500 (Annex 2, 2.3.1).
+
+    For each stimulus, a score is an outlier if it is more than 2 standard deviations from the mean when the scores
+    are normally distributed (kurtosis between 2 and 4), and more than sqrt(20) standard deviations otherwise.
+
+    :param scores: The matrix of the scores (subjects x stimuli), NaN where a subject did not rate a stimulus.
+    :return: A tuple (rejected, P, Q) of arrays with one value per subject: True if the subject is rejected,
+             and the numbers of their scores above and below the outlier thresholds.
+    """
+    mean, std, _ = score_statistics(scores)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        m2 = np.nanmean((scores - mean) ** 2, axis=0)
+        kurtosis = np.nanmean((scores - mean) ** 4, axis=0) / m2 ** 2
+    is_normal = (kurtosis >= NORMAL_KURTOSIS_RANGE[0]) & (kurtosis <= NORMAL_KURTOSIS_RANGE[1])
+    margin = np.where(is_normal, 2, np.sqrt(20)) * std
+
+    with np.errstate(invalid="ignore"):
+        above = (scores >= mean + margin) & (margin > 0)
+        below = (scores <= mean - margin) & (margin > 0)
+    p = above.sum(axis=1)
+    q = below.sum(axis=1)
+    nb_rated = np.maximum(1, (~np.isnan(scores)).sum(axis=1))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rejected = ((p + q) / nb_rated > MAX_OUTLIER_FRACTION) & (np.abs(p - q) / (p + q) < MAX_OUTLIER_BIAS)
+
+    return rejected, p, q
+
+
+def score_statistics(scores, axis=0):
+    """Returns the mean, the standard deviation (N - 1) and the number of the scores along an axis, ignoring NaN."""
+
+    count = (~np.isnan(scores)).sum(axis=axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nansum(scores, axis=axis) / count
+        deviations = scores - (np.expand_dims(mean, axis) if np.ndim(mean) else mean)
+        std = np.sqrt(np.nansum(deviations ** 2, axis=axis) / (count - 1))
+    return mean, std, count
+
+
+def confidence_interval(std, count):
+    """Returns the half-width of the 95% confidence interval of a mean."""
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return CONFIDENCE_COEFFICIENT * std / np.sqrt(count)
+
+
+def split_name(name):
+    """Splits the name of a stimulus into its content and its rate (e.g. "I01R1" -> ("I01", "R1"))."""
+
+    content = name.split("R")[0]
+    return content, name[len(content):]
+
+
+def group_statistics(scores, groups):
+    """Computes the MOS of groups of stimuli from all the scores of their stimuli.
+
+    :param scores: The matrix of the scores (subjects x stimuli).
+    :param groups: The name of the group of each stimulus.
+    :return: A list of tuples (group, number of stimuli, number of scores, MOS, std, confidence interval).
+    """
+    names, stimulus_group = np.unique(np.array(groups, dtype=str), return_inverse=True)
+    group_of = np.broadcast_to(stimulus_group, scores.shape)
+    rated = ~np.isnan(scores)
+
+    count = np.bincount(group_of[rated], minlength=len(names))
+    total = np.bincount(group_of[rated], weights=scores[rated], minlength=len(names))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        squares = np.bincount(group_of[rated], weights=(scores - mean[group_of])[rated] ** 2, minlength=len(names))
+        std = np.sqrt(squares / (count - 1))
+    nb_stimuli = np.bincount(stimulus_group, minlength=len(names))
+
+    return list(zip(names.tolist(), nb_stimuli.tolist(), count.tolist(), mean.tolist(), std.tolist(),
+                    confidence_interval(std, count).tolist()))
+
+
+def find_answers_files(paths):
+    """Returns the answers files given, looking for them in the folders given."""
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += glob.glob(os.path.join(path, "*-answers.txt"))
+        else:
+            files.append(path)
+    return sorted(set(files))
+
+
+def export_mos(matrix, accepted, path):
+    """Writes a CSV table of the MOS of each stimulus, computed from the accepted subjects."""
+
+    mean, std, count = score_statistics(matrix.scores[accepted])
+    ci = confidence_interval(std, count)
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["stimulus", "content", "rate", "subjects", "mos", "std", "ci95"])
+        for j in np.argsort(np.array(matrix.stimuli, dtype=str)):
+            writer.writerow([matrix.stimuli[j], *split_name(matrix.stimuli[j]), int(count[j]),
+                             _format(mean[j]), _format(std[j]), _format(ci[j])])
+
+
+def export_groups(matrix, accepted, path):
+    """Writes a CSV table of the MOS per content and per rate, computed from the accepted subjects."""
+
+    contents, rates = zip(*[split_name(name) for name in matrix.stimuli]) if matrix.stimuli else ((), ())
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["by", "group", "stimuli", "scores", "mos", "std", "ci95"])
+        for by, groups in (("content", contents), ("rate", rates)):
+            for group, nb_stimuli, nb_scores, mean, std, ci in group_statistics(matrix.scores[accepted], groups):
+                writer.writerow([by, group, nb_stimuli, nb_scores, _format(mean), _format(std), _format(ci)])
+
+
+def export_subjects(matrix, rejected, p, q, path):
+    """Writes a CSV table of the screening of each subject."""
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["session", "answers", "above", "below", "rejected"])
+        for i, session in enumerate(matrix.sessions):
+            writer.writerow([os.path.basename(session)[:-len("-answers.txt")], int((~np.isnan(matrix.scores[i])).sum()),
+                             int(p[i]), int(q[i]), int(rejected[i])])
+
+
+def _format(value):
+    return "" if np.isnan(value) else "{:.4f}".format(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Computes mean opinion scores from answers files.")
+    parser.add_argument("paths", nargs="*", default=["output/"], help="answers files or folders containing them")
+    parser.add_argument("--out", default="analytics/", help="folder where the results are written")
+    parser.add_argument("--no-screening", action="store_true", help="keep all the subjects")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    cache_path = os.path.join(args.out, CACHE_FILE)
+
+    matrix = AnswerMatrix.load(cache_path)
+    nb_parsed = matrix.update(find_answers_files(args.paths), args.processes)
+    matrix.save(cache_path)
+
+    if args.no_screening:
+        rejected = np.zeros(len(matrix.sessions), dtype=bool)
+        p = q = np.zeros(len(matrix.sessions), dtype=int)
+    else:
+        rejected, p, q = screen_subjects(matrix.scores)
+    accepted = ~rejected
+
+    export_mos(matrix, accepted, os.path.join(args.out, "mos.csv"))
+    export_groups(matrix, accepted, os.path.join(args.out, "mos_groups.csv"))
+    export_subjects(matrix, rejected, p, q, os.path.join(args.out, "subjects.csv"))
+
+    print("{} sessions ({} parsed, {} rejected), {} stimuli, results written in {}".format(
+        len(matrix.sessions), nb_parsed, int(rejected.sum()), len(matrix.stimuli), args.out))
@@ -19,29 +19,36 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from LFImage import LFImage
+import argparse
+import sys
+
+from SessionManifest import SessionManifest
 from TestSession import TestSession
-from helper import Helper
 
 # ---------------
 # -- MAIN CODE --
 # ---------------
 
-images = []
+if __name__ == "__main__":
+    # The guard is needed because the worker processes loading the images may import this module
+
+    parser = argparse.ArgumentParser(description="Runs a test session.")
+    # The images to be tested, the question and the answers are given in the manifest
+    parser.add_argument("manifest", nargs="?", default="session.json", help="the manifest of the session")
+    parser.add_argument("--subject", type=int, help="number of the subject, which sets the order of the images")
+    parser.add_argument("--full-check", action="store_true", help="check every image file again before starting")
+    args = parser.parse_args()
 
-# Add the images to be tested here
-images.append(LFImage("I01R1"))
-images.append(LFImage("I02R2"))
-images.append(LFImage("I04R3"))
+    manifest = SessionManifest(args.manifest)
 
-question = "How would you rate the impairment of the test image compared to the reference image?"
-answers = [1, 2, 3, 4, 5]
-answers_description = ["Very annoying",
-                       "Annoying",
-                       "Slightly annoying",
-                       "Perceptible, but not annoying",
-                       "Imperceptible"]
+    # Fail before the subject sits down rather than in the middle of the session
+    problems = manifest.check_files(args.full_check)
+    if problems:
+        for problem in problems:
+            print(problem)
+        sys.exit("{} problem(s) found in the files of {}".format(len(problems), args.manifest))
 
-TestSession(images, question, answers, answers_description,
-            show_preview=True, preload_images=True,
-            assessment_method= Helper.IQA.DOUBLE_STIMULUS, test_image_side=Helper.Side.LEFT)
+    TestSession(manifest.create_images(args.subject), manifest.question, manifest.answers,
+                manifest.answers_description, show_preview=manifest.show_preview,
+                preload_images=manifest.preload_images, assessment_method=manifest.assessment_method,
+                test_image_side=manifest.test_image_side)
@@ -0,0 +1,404 @@
+#   benchmark.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Headless benchmark of the interaction with a light-field image.
+
+A synthetic light-field image is generated, loaded with the Tk objects replaced by headless ones (see headless.py),
+and driven through the LFImage API with scripted drag patterns or with the events of recorded tracking files.
+The latency of each call, the loading times and the peak memory are reported.
+
+Usage:
+    python benchmark.py [--pattern sweep] [--grid 9 9 11] [--resolution 625 434] [--packed] [--single | --multi N]
+    python benchmark.py --replay output/<session>-tracking.bin
+    python benchmark.py --replay output/<session>-pointer.bin
+"""
+
+import argparse
+import math
+import os
+import random
+import resource
+import time
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image
+
+import headless
+from CompositeFrame import CompositeFrame
+from ImageLoader import ImageLoader
+from Instrumentation import instrumentation
+from LFContainer import LFContainer
+from LFImage import LFImage
+from ViewCache import view_cache
+from helper import IMG_PATH_PREFIX, IMG_FORMAT, Helper, open_output_files, close_output_files
+
+TEST_IMG_NAME = "B01R1"
+REF_IMG_NAME = "B01R0"
+PATTERNS = ["sweep", "circle", "random", "refocus", "mixed"]
+
+
+def get_test_img_names(nb_test_images):
+    """Returns the names of the synthetic test images: TEST_IMG_NAME, then B01R2, B01R3, etc."""
+
+    return [TEST_IMG_NAME] + ["{}R{}".format(REF_IMG_NAME.split("R")[0], i + 1) for i in range(1, nb_test_images)]
+
+
+def generate_light_field(nb_img_x, nb_img_y, nb_img_depth, top_left, resolution, packed, seed=0, nb_test_images=1):
+    """Writes a synthetic light-field image (test images and reference) and its depth map in IMG_PATH_PREFIX.
+
+    The views are a smooth textured scene shifted by one pixel per viewpoint, and the test views have additional
+    noise, stronger for each test image. Nothing is written for the images that already exist with the same
+    dimensions.
+    """
+    width, height = resolution
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    scene = np.stack([128 + 60 * np.sin(x / 17.0), 128 + 60 * np.cos(y / 23.0), 128 + 60 * np.sin((x + y) / 31.0)],
+                     axis=-1)
+    scene += rng.normal(0, 12, scene.shape)
+
+    center = (top_left[0] + nb_img_x // 2, top_left[1] + nb_img_y // 2)
+    test_img_names = get_test_img_names(nb_test_images)
+
+    def exists(img_name):
+        last_view = "{}{}/{:03}_{:03}_{:03}.{}".format(IMG_PATH_PREFIX, img_name, center[0], center[1],
+                                                      nb_img_depth - 1, IMG_FORMAT)
+        return os.path.exists(last_view) and Image.open(last_view).size == (width, height)
+
+    # All the images are generated again if the first test image is missing or has other dimensions
+    missing = [(img_name, 8 * i) for i, img_name in enumerate([REF_IMG_NAME] + test_img_names)
+               if not exists(img_name) or not exists(TEST_IMG_NAME)]
+
+    if not missing:
+        print("Using the synthetic light-field image in {}".format(os.path.abspath(IMG_PATH_PREFIX)))
+    else:
+        print("Generating a synthetic light-field image in {}...".format(os.path.abspath(IMG_PATH_PREFIX)))
+        for img_name, noise in missing:
+            os.makedirs(IMG_PATH_PREFIX + img_name, exist_ok=True)
+
+            for u in range(top_left[0], top_left[0] + nb_img_x):
+                for v in range(top_left[1], top_left[1] + nb_img_y):
+                    view = np.roll(scene, (v - center[1], u - center[0]), axis=(0, 1))
+                    view = view + rng.normal(0, noise, view.shape) if noise else view
+                    Image.fromarray(np.clip(view, 0, 255).astype(np.uint8)).save(
+                        "{}{}/{:03}_{:03}.{}".format(IMG_PATH_PREFIX, img_name, u, v, IMG_FORMAT))
+
+            for depth in range(nb_img_depth):
+                blurred = (scene + np.roll(scene, depth, axis=1) + np.roll(scene, depth, axis=0)) / 3
+                Image.fromarray(np.clip(blurred, 0, 255).astype(np.uint8)).save(
+                    "{}{}/{:03}_{:03}_{:03}.{}".format(IMG_PATH_PREFIX, img_name, center[0], center[1], depth,
+                                                      IMG_FORMAT))
+
+        os.makedirs(IMG_PATH_PREFIX + "depth_map", exist_ok=True)
+        depth_map = (255 * x / max(1, width - 1)).astype(np.uint8)
+        Image.fromarray(depth_map, "L").save("{}depth_map/{}.{}".format(IMG_PATH_PREFIX, REF_IMG_NAME, IMG_FORMAT))
+
+    for img_name in test_img_names + [REF_IMG_NAME]:
+        path = "{}{}.lfc".format(IMG_PATH_PREFIX, img_name)
+        if packed and not os.path.exists(path):
+            LFContainer.pack(img_name)
+        elif not packed and os.path.exists(path):
+            os.remove(path)
+            LFContainer.opened.pop(img_name, None)
+
+
+def scripted_events(pattern, lf, nb_events, seed=0):
+    """Returns a list of events (kind, argument) reproducing a drag pattern.
+
+    The kinds are "click" and "move" (argument: mouse position), "refocus" (argument: depth)
+    and "point" (argument: position double-clicked).
+    """
+    rng = random.Random(seed)
+    unit = lf.unit
+    half_x = lf.nb_img_x * unit / 2
+    half_y = lf.nb_img_y * unit / 2
+    # Mouse events arrive every few pixels
+    step = max(1, unit // 5)
+
+    if pattern == "mixed":
+        events = []
+        for sub_pattern in ("sweep", "refocus", "circle", "random"):
+            events += scripted_events(sub_pattern, lf, nb_events // 4, seed)
+        return events
+
+    events = [("click", (0, 0))]
+    if pattern == "sweep":
+        x = 0
+        direction = step
+        while len(events) < nb_events:
+            x += direction
+            if abs(x) >= half_x:
+                direction = -direction
+            events.append(("move", (x, (len(events) // 200 % 3 - 1) * unit)))
+    elif pattern == "circle":
+        radius = min(half_x, half_y) * 0.8
+        for i in range(nb_events):
+            angle = 2 * math.pi * i / 100
+            events.append(("move", (radius * math.cos(angle) - radius, radius * math.sin(angle))))
+    elif pattern == "random":
+        x = y = 0
+        for _ in range(nb_events):
+            x = max(-half_x, min(half_x, x + rng.randint(-step, step)))
+            y = max(-half_y, min(half_y, y + rng.randint(-step, step)))
+            events.append(("move", (x, y)))
+    elif pattern == "refocus":
+        for i in range(nb_events):
+            if i % 50 == 49:
+                events.append(("point", (rng.randrange(0, 600), rng.randrange(0, 400))))
+            else:
+                period = 2 * (lf.nb_img_depth - 1)
+                depth = i % period
+                events.append(("refocus", depth if depth < lf.nb_img_depth else period - depth))
+
+    return events
+
+
+def replay_events(path, lf):
+    """Returns a list of events reproducing the images displayed in a tracking file (.bin or .txt).
+
+    All the stimuli of the session are replayed on the synthetic image, and the dwell times are kept
+    as the third element of each event. The kinds are "view" (argument: (u, v)) and "refocus" (argument: depth).
+    """
+    from tracking_analytics import parse_tracking_file
+
+    _, columns = parse_tracking_file(path)
+    events = []
+
+    for u, v, depth, dwell in zip(columns["u"].tolist(), columns["v"].tolist(), columns["depth"].tolist(),
+                                  columns["dwell"].tolist()):
+        if depth >= 0:
+            events.append(("refocus", min(depth, lf.nb_img_depth - 1), dwell))
+        else:
+            events.append(("view", (u, v), dwell))
+
+    return events
+
+
+def replay_pointer_events(path, lf):
+    """Returns a list of events reproducing the mouse events of a pointer capture (see PointerCapture.py).
+
+    All the stimuli of the session are replayed on the synthetic image, and the time until the next event is kept
+    as the third element of each event. The kinds are "click", "move" and "point" (argument: mouse position).
+    """
+    import PointerCapture
+
+    captured, _ = PointerCapture.read(path)
+    kinds = {PointerCapture.PRESS: "click", PointerCapture.MOTION: "move", PointerCapture.DOUBLE_CLICK: "point"}
+    dwells = (np.diff(captured["time"], append=captured["time"][-1:]) / 1e9).tolist()
+
+    return [(kinds[kind], (x, y), dwell)
+            for kind, x, y, dwell in zip(captured["kind"].tolist(), captured["x"].tolist(),
+                                         captured["y"].tolist(), dwells)
+            if kind in kinds]
+
+
+class PointerEvent:
+    """Replaces the Tk event given to refocus_to_point."""
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+def percentiles(values):
+    values = np.array(values) * 1000
+    return "n={:6d}  p50={:7.3f}  p90={:7.3f}  p99={:7.3f}  max={:7.3f} ms".format(
+        len(values), np.percentile(values, 50), np.percentile(values, 90), np.percentile(values, 99), values.max())
+
+
+def measure_panel_switch(lf, nb_switches):
+    """Compares the cost of switching the view of a real Tk panel with configure() and with paste().
+
+    It needs a display. Each switch is followed by update_idletasks(), so that the redraw is included.
+
+    :param lf: The light-field image whose perspective views are displayed.
+    :param nb_switches: The number of switches measured for each method.
+    """
+    import tkinter as tk
+    from PIL import ImageTk
+    from ImageLoader import resample
+    from LFContainer import open_image
+    from SubapertureImage import SubapertureImage
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print("Panel switch not measured: {}".format(e))
+        return
+    panel = tk.Label(root)
+    panel.pack()
+
+    views = []
+    for x in range(lf.top_left[0], lf.top_left[0] + lf.nb_img_x):
+        img_name, _ = lf.get_img_names(SubapertureImage(x, lf.base_img.v, None))
+        views.append(resample(open_image(img_name), lf.view_size).convert("RGB"))
+
+    photo_imgs = [ImageTk.PhotoImage(view) for view in views]
+    latencies = defaultdict(list)
+
+    for i in range(nb_switches):
+        start = time.perf_counter()
+        panel.configure(image=photo_imgs[i % len(views)])
+        root.update_idletasks()
+        latencies["configure"].append(time.perf_counter() - start)
+
+    persistent_img = ImageTk.PhotoImage(views[0])
+    panel.configure(image=persistent_img)
+    root.update_idletasks()
+    for i in range(nb_switches):
+        start = time.perf_counter()
+        persistent_img.paste(views[i % len(views)])
+        root.update_idletasks()
+        latencies["paste"].append(time.perf_counter() - start)
+
+    root.destroy()
+
+    print("Panel switch ({}x{} pixels, with redraw)".format(*views[0].size))
+    print("  {:9} {}  ({} Tk images)".format("configure", percentiles(latencies["configure"]), len(photo_imgs)))
+    print("  {:9} {}  (1 Tk image)".format("paste", percentiles(latencies["paste"])))
+
+
+def run(args):
+    nb_img_x, nb_img_y, nb_img_depth = args.grid
+    top_left = tuple(args.top_left)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    test_img_names = get_test_img_names(args.multi or 1)
+    generate_light_field(nb_img_x, nb_img_y, nb_img_depth, top_left, args.resolution, args.packed,
+                         nb_test_images=len(test_img_names))
+
+    root = headless.install()
+    open_output_files()
+    instrumentation.enabled = args.instrumentation
+
+    lf = LFImage(TEST_IMG_NAME, nb_img_x, nb_img_y, nb_img_depth, top_left, other_img_names=test_img_names[1:])
+    if args.multi:
+        assessment_method = Helper.IQA.MULTI_STIMULUS
+        lf.set_panels([headless.HeadlessPanel()])
+        lf.set_composite_frame(CompositeFrame(lf.panels[0]))
+    else:
+        assessment_method = Helper.IQA.SINGLE_STIMULUS if args.single else Helper.IQA.DOUBLE_STIMULUS
+        lf.set_panels([headless.HeadlessPanel() for _ in range(1 if args.single else 2)])
+    lf.set_test_image_side(Helper.Side.LEFT)
+    lf.set_view_size(tuple(args.view_size) if args.view_size else None)
+    view_cache.set_current(*lf.test_img_names, lf.reference_img_name)
+    Helper.tracking_log.start_stimulus(lf.get_stimulus_name())
+
+    # Loading
+    start = time.perf_counter()
+    lf.load_images(assessment_method, show_preview=False)
+    root.run(until=lambda: lf.is_loaded)
+    ready_time = time.perf_counter() - start
+    root.run(until=lambda: lf.is_fully_loaded)
+    loaded_time = time.perf_counter() - start
+    lf.update_images()
+
+    # Interaction
+    if args.replay:
+        events = []
+        for path in args.replay:
+            events += replay_pointer_events(path, lf) if path.endswith("-pointer.bin") else replay_events(path, lf)
+    else:
+        events = [event + (0,) for event in scripted_events(args.pattern, lf, args.events)]
+
+    latencies = defaultdict(list)
+    for kind, argument, dwell in events:
+        if instrumentation.enabled:
+            instrumentation.start_input(kind)
+        start = time.perf_counter()
+        if kind == "click":
+            lf.click(argument)
+        elif kind == "move":
+            lf.move(argument)
+        elif kind == "view":
+            # Click, then drag so that the image (u, v) is displayed
+            lf.click((0, 0))
+            start = time.perf_counter()
+            lf.move(((lf.base_img.u - argument[0]) * lf.unit, (lf.base_img.v - argument[1]) * lf.unit))
+            kind = "move"
+        elif kind == "refocus":
+            lf.refocus_to_depth(argument)
+        elif kind == "point":
+            lf.refocus_to_point(PointerEvent(*argument))
+        latencies[kind].append(time.perf_counter() - start)
+
+        # Let the animations and the loader run as the Tk main loop would
+        if args.realtime and dwell > 0:
+            root.run(timeout=dwell)
+            time.sleep(max(0, dwell - (time.perf_counter() - start)))
+        root.run_pending()
+
+    lf.close_img()
+    close_output_files()
+    # The workers must have ended for their peak memory to be counted in RUSAGE_CHILDREN
+    ImageLoader.shutdown(wait=True)
+
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    print()
+    print("Light field: {}x{} views, {} depths, {}x{} pixels, {}, {}{}".format(
+        nb_img_x, nb_img_y, nb_img_depth, args.resolution[0], args.resolution[1],
+        "packed" if args.packed else IMG_FORMAT.upper() + " files", assessment_method.name.lower(),
+        " ({} test images)".format(len(test_img_names)) if args.multi else ""))
+    print("Loading: interactive after {:.3f} s, fully loaded after {:.3f} s".format(ready_time, loaded_time))
+    print("Events: {} ({})".format(len(events), ", ".join(args.replay) if args.replay else args.pattern))
+    for kind in ("click", "move", "refocus", "point"):
+        if latencies[kind]:
+            print("  {:8} {}".format(kind, percentiles(latencies[kind])))
+    print("Peak memory: {:.0f} MB (main process), {:.0f} MB (largest loader process)".format(self_rss, children_rss))
+    print(view_cache.stats())
+
+    if instrumentation.enabled:
+        print()
+        print(instrumentation.report(), end="")
+
+    if args.panel_switch:
+        print()
+        measure_panel_switch(lf, args.panel_switch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless benchmark of the interaction with a light-field image.")
+    parser.add_argument("--workdir", default="bench/",
+                        help="folder where the synthetic image and the output files are written")
+    parser.add_argument("--grid", type=int, nargs=3, default=(9, 9, 11), metavar=("NB_IMG_X", "NB_IMG_Y", "DEPTHS"))
+    parser.add_argument("--top-left", type=int, nargs=2, default=(3, 3))
+    parser.add_argument("--resolution", type=int, nargs=2, default=(625, 434), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--view-size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        help="downscale the views to fit in this size (default: original resolution)")
+    parser.add_argument("--packed", action="store_true", help="load the image from a container (see pack_lf.py)")
+    parser.add_argument("--single", action="store_true", help="single stimulus (no reference image)")
+    parser.add_argument("--multi", type=int, metavar="N",
+                        help="multi stimulus: N test images composited with the reference image")
+    parser.add_argument("--pattern", choices=PATTERNS, default="mixed", help="scripted drag pattern")
+    parser.add_argument("--events", type=int, default=4000, help="number of scripted events")
+    parser.add_argument("--replay", nargs="+",
+                        help="tracking files (.bin or .txt) or pointer captures (-pointer.bin) to replay instead of "
+                             "a pattern")
+    parser.add_argument("--realtime", action="store_true", help="wait for the recorded dwell times when replaying")
+    parser.add_argument("--panel-switch", type=int, metavar="N",
+                        help="also compare N view switches of a Tk panel with configure() and paste() (needs a display)")
+    parser.add_argument("--instrumentation", action="store_true",
+                        help="also print the stage latencies and loading phases measured by Instrumentation.py")
+
+    run(parser.parse_args())
@@ -0,0 +1,137 @@
+#   headless.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Stand-ins for the Tk objects used by LFImage, so that it can run without a display (e.g. in benchmarks)."""
+
+import heapq
+import itertools
+import time
+
+from FrameScheduler import FrameScheduler
+from ImageLoader import ImageLoader
+from helper import Helper
+
+
+class HeadlessRoot:
+    """Replaces the Tk root window: runs the callbacks scheduled with after() in a simple event loop."""
+
+    def __init__(self):
+        self.callbacks = []
+        self.ids = itertools.count()
+        self.cancelled = set()
+
+    def after(self, delay, callback, *args):
+        after_id = next(self.ids)
+        heapq.heappush(self.callbacks, (time.perf_counter() + delay / 1000, after_id, callback, args))
+        return after_id
+
+    def after_idle(self, callback, *args):
+        return self.after(0, callback, *args)
+
+    def after_cancel(self, after_id):
+        self.cancelled.add(after_id)
+
+    def run_pending(self):
+        """Runs the callbacks that are due, without waiting."""
+
+        now = time.perf_counter()
+        while self.callbacks and self.callbacks[0][0] <= now:
+            _, after_id, callback, args = heapq.heappop(self.callbacks)
+            if after_id in self.cancelled:
+                self.cancelled.discard(after_id)
+            else:
+                callback(*args)
+
+    def run(self, until=None, timeout=None):
+        """Runs the event loop until the condition is true, no callback is left, or the timeout is elapsed.
+
+        :param until: Function returning True when the loop should stop.
+        :param timeout: Maximum duration in seconds.
+        """
+        start = time.perf_counter()
+
+        while self.callbacks and not (until is not None and until()):
+            if timeout is not None and time.perf_counter() - start > timeout:
+                break
+            self.run_pending()
+            if self.callbacks:
+                time.sleep(max(0, min(0.001, self.callbacks[0][0] - time.perf_counter())))
+
+
+class HeadlessPhotoImage:
+    """Replaces ImageTk.PhotoImage: keeps a copy of the pixels, as Tk does, with 4 bytes per pixel."""
+
+    def __init__(self, img):
+        self.img = img.convert("RGBA")
+
+    def width(self):
+        return self.img.size[0]
+
+    def height(self):
+        return self.img.size[1]
+
+    def paste(self, img, box=None):
+        self.img.paste(img, box)
+
+
+class HeadlessPanel:
+    """Replaces the labels on which the images are displayed."""
+
+    def __init__(self):
+        self.image = None
+        self.nb_updates = 0
+
+    def configure(self, image=None, **kwargs):
+        self.image = image
+        self.nb_updates += 1
+
+    def winfo_width(self):
+        return self.image.width() if self.image is not None else 1
+
+    def winfo_height(self):
+        return self.image.height() if self.image is not None else 1
+
+
+class HeadlessSlider:
+    """Replaces the focus slider."""
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def install():
+    """Replaces the Tk objects used by the light-field images by headless ones.
+
+    :return: The HeadlessRoot, whose event loop must be run to load the images and play the animations.
+    """
+    root = HeadlessRoot()
+    Helper.root = root
+    Helper.frame_scheduler = FrameScheduler(root)
+    Helper.focus_slider = HeadlessSlider()
+    Helper.is_focus_slider_enabled = False
+    ImageLoader.to_photo_image = staticmethod(HeadlessPhotoImage)
+
+    return root
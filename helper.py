@@ -26,19 +26,140 @@ from enum import Enum
 BG_COLOR = "#959595"  # mid-grey
 IMG_PATH_PREFIX = "img/"
 IMG_FORMAT = "png"
+CONTAINER_FORMAT = "lfc"  # Packed light-field images, see LFContainer.py
 OUTPUT_PATH_PREFIX = "output/"
 
-# Number of images following the current image that are loaded in advance
+# Minimum and maximum number of images following the current image that are loaded in advance. The number is
+# adapted to the load and answer times (see PreloadScheduler.py).
 NB_IMAGES_PRELOADED = 1
+MAX_IMAGES_PRELOADED = 4
+# Number of images loaded at the same time
+PRELOAD_CONCURRENCY = 1
 
-# Create an output folder if it doesn't already exist
-if not os.path.exists(OUTPUT_PATH_PREFIX):
-    os.makedirs(OUTPUT_PATH_PREFIX)
+# Minimum time (in seconds) between two updates of the view while the mouse is dragged. The mouse events received
+# in between are coalesced, only the latest position is applied.
+DRAG_FRAME_TIME = 1 / 60
 
-# Open the output files
-timestamp = datetime.datetime.now().strftime('%Y.%m.%d-%H.%M.%S')
-f_tracking = open(OUTPUT_PATH_PREFIX + timestamp + '-tracking.txt', 'w')
-f_answers = open(OUTPUT_PATH_PREFIX + timestamp + '-answers.txt', 'w')
+# Time (in seconds) each image is displayed during the refocus animation
+REFOCUS_ANIMATION_TIME_PER_IMAGE = 0.01
+
+# If True, refocused images are computed from the perspective images (see Refocuser.py) instead of being loaded
+# from the pre-rendered XXX_YYY_DDD images, and the focus slider can take intermediate values.
+SYNTHETIC_REFOCUS = False
+# Shift in pixels between two neighbour viewpoints at the depths 0 and nb_img_depth - 1
+REFOCUS_SLOPE_RANGE = (-1.0, 1.0)
+# If True, the perspective images are shifted by fractions of pixels, which is slower but smoother
+REFOCUS_SUBPIXEL = False
+# Number of synthetic refocused images kept in memory per light-field image
+REFOCUS_CACHE_SIZE = 32
+
+# Radius (in pixels) of the neighbourhood whose median depth is used when double-clicking on a point to refocus.
+# If it is 0, the depth of the point itself is used.
+DEPTH_MEDIAN_RADIUS = 2
+
+# Interaction starts once the views at most this number of viewpoints away from the base image are loaded
+PROGRESSIVE_LOADING_RADIUS = 1
+
+# Number of tracking events kept in memory before being written to disk (see TrackingLog.py)
+TRACKING_BUFFER_SIZE = 4096
+
+# Multi stimulus method: space (in pixels) between two views composited in the same panel (see CompositeFrame.py)
+MULTI_STIMULUS_GAP = 10
+# Number of threads decoding the views of the different images of a stimulus when they are displayed before being
+# loaded in the background
+VIEW_DECODE_THREADS = 4
+
+# If True, every mouse event received by the panels is recorded in <session>-pointer.bin (see PointerCapture.py),
+# and number of events kept in memory before being written to disk
+POINTER_CAPTURE = False
+POINTER_CAPTURE_BUFFER_SIZE = 16384
+
+# If True, the views are displayed with their original resolution (1 image pixel = 1 screen pixel), as some
+# protocols require. Otherwise, they are downscaled to the size of the panels when they do not fit on the screen.
+NATIVE_RESOLUTION = False
+# Space (in pixels) taken by the rest of the GUI around the panels (see TestSession.setup_gui): the focus slider
+# column horizontally, and the labels, question and answer buttons vertically
+GUI_RESERVED_WIDTH = 100
+GUI_RESERVED_HEIGHT = 280
+
+# If True, each panel displays a single Tk image, into which the views are copied when they are displayed, and the
+# views are kept in memory as PIL images. Otherwise, each view is a Tk image, which is set on the panel.
+PASTE_VIEWS = True
+
+# Maximum time (in seconds) between the recording of an answer or of a tracking event and its commit to disk
+# (see DurableWriter.py)
+DURABLE_COMMIT_INTERVAL = 0.5
+
+# Maximum number of bytes used by the views kept in memory (see ViewCache.py)
+VIEW_CACHE_BUDGET = 4 * 1024 ** 3
+
+# Resident memory (in bytes) of the process above which a warning is printed, and interval (in seconds) between two
+# samples of the memory used by the current stimulus (see MemoryAccounting.py)
+MEMORY_BUDGET = VIEW_CACHE_BUDGET + 2 * 1024 ** 3
+MEMORY_SAMPLE_INTERVAL = 1.0
+# Time (in seconds) after which the views of a stimulus whose memory was cleared should all have been freed
+MEMORY_LEAK_CHECK_DELAY = 2.0
+
+# If True, the interaction latencies and loading times are measured and written in
+# <session>-performance.txt (see Instrumentation.py)
+ENABLE_INSTRUMENTATION = False
+
+# Web front end (see web_server.py): format in which the views are sent to the browsers, and maximum number of
+# bytes used by the encoded views kept in memory, which are shared by all the subjects
+WEB_VIEW_FORMAT = "png"
+WEB_BLOB_CACHE_BUDGET = 512 * 1024 ** 2
+
+
+def open_output_files():
+    """Opens the tracking log and the answers file of a new test session.
+
+    The files are named after the time at which the session starts, in the OUTPUT_PATH_PREFIX folder,
+    and written in the background by a DurableWriter.
+    """
+    # DurableWriter imports this module
+    from DurableWriter import DurableWriter
+
+    # Create an output folder if it doesn't already exist
+    if not os.path.exists(OUTPUT_PATH_PREFIX):
+        os.makedirs(OUTPUT_PATH_PREFIX)
+
+    timestamp = datetime.datetime.now().strftime('%Y.%m.%d-%H.%M.%S')
+    Helper.session_timestamp = timestamp
+    Helper.writer = DurableWriter(OUTPUT_PATH_PREFIX + timestamp + '-journal.txt')
+    Helper.tracking_log, Helper.f_answers = open_session_files(timestamp, Helper.writer)
+
+    if POINTER_CAPTURE:
+        from PointerCapture import PointerCapture  # Imports this module
+        Helper.pointer_capture = PointerCapture(OUTPUT_PATH_PREFIX + timestamp + '-pointer', timestamp,
+                                                writer=Helper.writer)
+
+
+def open_session_files(session_name, writer):
+    """Opens the tracking log and the answers file of a test session, written by the given DurableWriter.
+
+    :param session_name: The name of the session, which prefixes the names of the files.
+    :param writer: The DurableWriter.
+    :return: A tuple (tracking log, answers stream).
+    """
+    from TrackingLog import TrackingLog  # Imports this module
+
+    tracking_log = TrackingLog(OUTPUT_PATH_PREFIX + session_name + '-tracking', session_name, writer=writer)
+    f_answers = writer.open_stream(OUTPUT_PATH_PREFIX + session_name + '-answers.txt')
+
+    return tracking_log, f_answers
+
+
+def close_output_files():
+    """Writes the remaining data of the test session and closes its files, waiting for them to be on disk."""
+
+    try:
+        Helper.tracking_log.close()
+        if Helper.pointer_capture is not None:
+            Helper.pointer_capture.close()
+        Helper.f_answers.close()
+    finally:
+        # The writer thread always ends, even if the files could not be written
+        Helper.writer.close()
 
 def clamp(x, minimum, maximum):
     """Clamps the value x between a minimum and a maximum."""
@@ -47,11 +168,21 @@ def clamp(x, minimum, maximum):
     return max(minimum, min(maximum, x))
 
 class Helper:
+    root = None
+    frame_scheduler = None
     focus_slider = None
     is_focus_slider_enabled = None
 
     fullscreen_msg = None
 
+    # Output files of the current test session, see open_output_files()
+    session_timestamp = None
+    writer = None
+    tracking_log = None
+    f_answers = None
+    # PointerCapture of the session, None if POINTER_CAPTURE is False
+    pointer_capture = None
+
     class Side(Enum):
         LEFT = 0
         RIGHT = 1
@@ -59,3 +190,4 @@ class Helper:
     class IQA(Enum):
         SINGLE_STIMULUS = 1
         DOUBLE_STIMULUS = 2
+        MULTI_STIMULUS = 3
@@ -0,0 +1,77 @@
+#   pack_lf.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Packs light-field image folders into containers (see LFContainer.py).
+
+Usage:
+    python pack_lf.py I01R0 I01R1 ...              Packs img/I01R0, img/I01R1, ...
+    python pack_lf.py --benchmark I01R0 I01R1 ...  Also compares the load time of both formats
+"""
+
+import argparse
+import os
+import time
+
+from PIL import Image
+
+from LFContainer import LFContainer
+from helper import IMG_PATH_PREFIX, IMG_FORMAT
+
+
+def benchmark(img_name):
+    """Compares the time needed to get every image of a light-field image ready for display,
+    decoding the image files vs. reading them from the container.
+
+    :param img_name: The name of the image (i.e. of the folder containing all its image files).
+    :return: A tuple (number of images, time with the image files, time with the container) in seconds.
+    """
+    folder = IMG_PATH_PREFIX + img_name
+    keys = [os.path.splitext(f)[0] for f in sorted(os.listdir(folder)) if f.endswith("." + IMG_FORMAT)]
+
+    start = time.perf_counter()
+    for key in keys:
+        Image.open("{}/{}.{}".format(folder, key, IMG_FORMAT)).load()
+    png_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    container = LFContainer.get(img_name)
+    for key in keys:
+        container.get_image(key).load()
+    container_time = time.perf_counter() - start
+
+    return len(keys), png_time, container_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Packs light-field image folders into containers.")
+    parser.add_argument("img_names", nargs="+", help="names of the images to pack (e.g. I01R1)")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="compare the load time of the image files and of the container")
+    args = parser.parse_args()
+
+    for name in args.img_names:
+        path = LFContainer.pack(name)
+        print("{}: packed into {} ({:.1f} MB)".format(name, path, os.path.getsize(path) / 1e6))
+
+        if args.benchmark:
+            nb_images, png_time, container_time = benchmark(name)
+            print("{}: {} images loaded in {:.3f} s from {} files, {:.3f} s from the container ({:.1f}x)".format(
+                name, nb_images, png_time, IMG_FORMAT.upper(), container_time,
+                png_time / max(container_time, 1e-9)))
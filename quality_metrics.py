@@ -0,0 +1,385 @@
+#   quality_metrics.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Computes the objective quality (PSNR and SSIM) of every view of the stimuli against the view of their reference.
+
+Each view of a test image (e.g. I01R1/003_004.png, or I01R1/007_007_005.png for a refocused image) is compared to
+the view with the same name in the reference image (I01R0), read from the packed container if there is one, as in
+LFImage. The metrics of each stimulus are stored in tensors with the layout of the dwell-time tensors of
+tracking_analytics.py, so that they can be compared view by view: tensor[i, j, 0] for the perspective image
+(top_left[0] + i, top_left[1] + j), tensor[i, j, d + 1] for the image of this viewpoint refocused at depth d, and NaN
+for the images that do not exist.
+
+The views are compared in batches by worker processes, each batch being stacked in arrays so that the metrics of
+all its views are computed at once. The metrics are kept in <out>/quality_cache.npz, indexed by the hashes of the
+two files compared, so that the next runs only compute the metrics of the views that changed. If <out> contains
+the dwell_times.npz of tracking_analytics.py, the correlation between the time spent on the views and their quality
+is also computed.
+
+Usage:
+    python quality_metrics.py [--out analytics/] [session.json or image names...]
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+import numpy as np
+
+from LFContainer import LFContainer, open_image
+from SessionManifest import SessionManifest, LF_PARAMETERS, OTHERS_KEY
+from SubapertureImage import SubapertureImage
+from ViewTable import get_view_name
+from helper import IMG_PATH_PREFIX
+from tracking_analytics import Grid, DEFAULT_GRID
+
+METRICS = ["psnr", "ssim"]
+CACHE_FILE = "quality_cache.npz"
+
+# Number of views compared by a worker process at once
+BATCH_SIZE = 8
+# Number of threads hashing the image files
+NB_HASH_THREADS = 16
+
+# SSIM parameters (Wang et al., 2004), computed on the luminance
+SSIM_WINDOW_SIZE = 11
+SSIM_SIGMA = 1.5
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+MAX_VALUE = 255.0
+
+
+def get_view_pairs(img_name, grid):
+    """Returns the views of a test image with the view of the reference image they are compared to.
+
+    :param img_name: The name of the test image (e.g. "I01R1").
+    :param grid: The dimensions of the light-field image.
+    :return: The list of tuples (index (i, j, k) in the metric tensors, test view name, reference view name) of the
+             views that exist in both images.
+    """
+    reference_img_name = img_name.split("R")[0] + "R0"
+    center = (grid.top_left[0] + grid.nb_img_x // 2, grid.top_left[1] + grid.nb_img_y // 2)
+
+    # Same views as those loaded by LFImage: the perspective images, and the refocused images of the center
+    imgs = [((i, j, 0), SubapertureImage(grid.top_left[0] + i, grid.top_left[1] + j, None))
+            for i in range(grid.nb_img_x) for j in range(grid.nb_img_y)]
+    imgs += [((center[0] - grid.top_left[0], center[1] - grid.top_left[1], depth + 1),
+              SubapertureImage(center[0], center[1], depth)) for depth in range(grid.nb_img_depth)]
+
+    pairs = []
+    for index, img in imgs:
+        test_name, ref_name = get_view_name(img_name, img), get_view_name(reference_img_name, img)
+        if view_exists(test_name) and view_exists(ref_name):
+            pairs.append((index, test_name, ref_name))
+
+    return pairs
+
+
+def view_exists(view_name):
+    """Returns True iff a view can be opened with open_image()."""
+
+    folder, file_name = view_name.split("/", 1)
+    container = LFContainer.get(folder)
+    if container is not None and container.has(os.path.splitext(file_name)[0]):
+        return True
+
+    return os.path.exists(IMG_PATH_PREFIX + view_name)
+
+
+def hash_view(view_name):
+    """Returns the SHA-1 of a view: of its pixel plane if it was packed, and of its image file otherwise."""
+
+    folder, file_name = view_name.split("/", 1)
+    container = LFContainer.get(folder)
+    key = os.path.splitext(file_name)[0]
+
+    if container is not None and container.has(key):
+        entry = container.entries[key]
+        start = container.data_start + entry["offset"]
+        return hashlib.sha1(container.buffer[start:start + entry["length"]]).hexdigest()
+
+    with open(IMG_PATH_PREFIX + view_name, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_views(view_names):
+    """Returns the views as an array of shape (nb_views, height, width, 3)."""
+
+    return np.stack([np.asarray(open_image(name).convert("RGB"), dtype=np.float32) for name in view_names])
+
+
+def psnr(test, reference):
+    """Returns the PSNR in dB of each view of a batch (infinite for identical views).
+
+    :param test: The array of shape (nb_views, height, width, 3) of the test views.
+    :param reference: The array of the same shape of the reference views.
+    """
+    mse = np.square(test - reference).mean(axis=(1, 2, 3), dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        return 10 * np.log10(MAX_VALUE ** 2 / mse)
+
+
+def gaussian_filter(imgs, window):
+    """Filters a batch of images of shape (nb_views, height, width) with a separable window, keeping only the
+    pixels where the window fits in the image."""
+
+    size = len(window)
+    height, width = imgs.shape[1] - size + 1, imgs.shape[2] - size + 1
+
+    rows = window[0] * imgs[:, :height]
+    for k in range(1, size):
+        rows += window[k] * imgs[:, k:k + height]
+
+    result = window[0] * rows[:, :, :width]
+    for k in range(1, size):
+        result += window[k] * rows[:, :, k:k + width]
+
+    return result
+
+
+def ssim(test, reference):
+    """Returns the mean SSIM of the luminance of each view of a batch.
+
+    :param test: The array of shape (nb_views, height, width, 3) of the test views.
+    :param reference: The array of the same shape of the reference views.
+    """
+    x = np.dot(test, np.array([0.299, 0.587, 0.114], dtype=np.float32))
+    y = np.dot(reference, np.array([0.299, 0.587, 0.114], dtype=np.float32))
+
+    window = np.exp(-0.5 * np.square(np.arange(SSIM_WINDOW_SIZE) - SSIM_WINDOW_SIZE // 2) / SSIM_SIGMA ** 2)
+    window = (window / window.sum()).astype(np.float32)
+    c1 = (SSIM_K1 * MAX_VALUE) ** 2
+    c2 = (SSIM_K2 * MAX_VALUE) ** 2
+
+    mu_x = gaussian_filter(x, window)
+    mu_y = gaussian_filter(y, window)
+    var_x = gaussian_filter(x * x, window) - mu_x * mu_x
+    var_y = gaussian_filter(y * y, window) - mu_y * mu_y
+    cov = gaussian_filter(x * y, window) - mu_x * mu_y
+
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x * mu_x + mu_y * mu_y + c1) * (var_x + var_y + c2))
+    return ssim_map.mean(axis=(1, 2), dtype=np.float64)
+
+
+def compute_metrics(pairs):
+    """Computes the metrics of a batch of views.
+
+    :param pairs: The list of tuples (test view name, reference view name).
+    :return: The array of shape (len(pairs), len(METRICS)).
+    """
+    result = np.empty((len(pairs), len(METRICS)))
+
+    # The views of a light-field image normally all have the same size, otherwise they are compared by size
+    test_views = [np.asarray(open_image(name).convert("RGB"), dtype=np.float32) for name, _ in pairs]
+    by_shape = {}
+    for i, view in enumerate(test_views):
+        by_shape.setdefault(view.shape, []).append(i)
+
+    for indices in by_shape.values():
+        test = np.stack([test_views[i] for i in indices])
+        reference = load_views([pairs[i][1] for i in indices])
+        if reference.shape != test.shape:
+            raise ValueError("{} and {} have different sizes".format(pairs[indices[0]][0], pairs[indices[0]][1]))
+        result[indices, 0] = psnr(test, reference)
+        result[indices, 1] = ssim(test, reference)
+
+    return result
+
+
+def _compute_metrics_worker(pairs):
+    try:
+        return pairs, compute_metrics(pairs), None
+    except Exception as e:
+        return pairs, None, "{}: {}".format(type(e).__name__, e)
+
+
+class QualityCache:
+    """Metrics already computed, indexed by the hashes of the test view and of the reference view."""
+
+    def __init__(self, keys=(), values=None):
+        self.metrics = dict(zip(keys, values.tolist())) if values is not None else {}
+
+    @classmethod
+    def load(cls, path):
+        """Loads a cache saved with save(), or returns an empty cache if the file does not exist."""
+
+        if not os.path.exists(path):
+            return cls()
+
+        with np.load(path) as data:
+            return cls(data["keys"].tolist(), data["metrics"])
+
+    def save(self, path):
+        np.savez_compressed(path, keys=np.array(list(self.metrics), dtype=str),
+                            metrics=np.array(list(self.metrics.values()), dtype=np.float64).reshape(-1, len(METRICS)))
+
+
+def compute_tensors(stimuli, cache, processes=None):
+    """Computes the metric tensors of the stimuli, only comparing the views whose metrics are not in the cache.
+
+    :param stimuli: The list of tuples (test image name, Grid).
+    :param cache: The QualityCache, updated with the new metrics.
+    :param processes: The number of worker processes. If it is None, the number of CPUs is used.
+    :return: A tuple (tensors, nb_computed): a dict mapping each stimulus name to a dict {metric: tensor}, and the
+             number of views compared.
+    """
+    pairs = {name: get_view_pairs(name, grid) for name, grid in stimuli}
+    view_names = sorted({view_name for name_pairs in pairs.values() for _, test_name, ref_name in name_pairs
+                         for view_name in (test_name, ref_name)})
+    with ThreadPoolExecutor(NB_HASH_THREADS) as executor:
+        hashes = dict(zip(view_names, executor.map(hash_view, view_names)))
+
+    # Views to compare, each pair of files only once even if it appears in several stimuli
+    to_compute = sorted({(test_name, ref_name) for name_pairs in pairs.values()
+                         for _, test_name, ref_name in name_pairs
+                         if hashes[test_name] + hashes[ref_name] not in cache.metrics})
+    batches = [to_compute[i:i + BATCH_SIZE] for i in range(0, len(to_compute), BATCH_SIZE)]
+
+    if batches:
+        with Pool(processes) as pool:
+            for batch, metrics, error in pool.imap_unordered(_compute_metrics_worker, batches):
+                if error is not None:
+                    print("Skipping {} views from {} ({})".format(len(batch), batch[0][0], error))
+                    continue
+                for (test_name, ref_name), values in zip(batch, metrics.tolist()):
+                    cache.metrics[hashes[test_name] + hashes[ref_name]] = values
+
+    tensors = {}
+    for name, grid in stimuli:
+        shape = (grid.nb_img_x, grid.nb_img_y, grid.nb_img_depth + 1)
+        tensors[name] = {metric: np.full(shape, np.nan) for metric in METRICS}
+        for index, test_name, ref_name in pairs[name]:
+            values = cache.metrics.get(hashes[test_name] + hashes[ref_name])
+            if values is not None:
+                for metric, value in zip(METRICS, values):
+                    tensors[name][metric][index] = value
+
+    return tensors, len(to_compute)
+
+
+def find_stimuli(paths, grid=DEFAULT_GRID):
+    """Returns the test images to compare to their reference, as a list of tuples (image name, Grid).
+
+    :param paths: Manifests of sessions, whose stimuli (and their other test images) are taken with their
+                  dimensions, or names of test images, which have the dimensions of grid.
+    :param grid: The dimensions of the images given by name.
+    """
+    stimuli = {}
+    for path in paths:
+        if path.endswith(".json"):
+            for stimulus in SessionManifest(path).stimuli:
+                parameters = dict(grid._asdict(), **{k: v for k, v in stimulus.items() if k in LF_PARAMETERS})
+                parameters.pop("unit", None)
+                parameters["top_left"] = tuple(parameters["top_left"])
+                for name in [stimulus["name"]] + list(stimulus.get(OTHERS_KEY, ())):
+                    stimuli[name] = Grid(**parameters)
+        else:
+            stimuli[path] = grid
+
+    return sorted(stimuli.items())
+
+
+def export_views(tensors, stimuli, path):
+    """Writes a CSV table of the metrics of each view, with the coordinates used in the tracking files.
+
+    :param tensors: The tensors returned by compute_tensors().
+    :param stimuli: The list of tuples (image name, Grid).
+    :param path: The path of the CSV file.
+    """
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["stimulus", "u", "v", "depth"] + METRICS)
+
+        for name, grid in stimuli:
+            metrics = tensors[name]
+            for i, j, k in zip(*np.nonzero(~np.isnan(metrics["psnr"]))):
+                writer.writerow([name, i + grid.top_left[0], j + grid.top_left[1], k - 1 if k > 0 else ""] +
+                                [_format(metrics[metric][i, j, k]) for metric in METRICS])
+
+
+def export_dwell_correlation(tensors, dwell_path, path):
+    """Writes, for each stimulus, the Pearson correlation between the time spent on its views (see
+    tracking_analytics.py) and their metrics.
+
+    :param tensors: The tensors returned by compute_tensors().
+    :param dwell_path: The path of the dwell_times.npz file.
+    :param path: The path of the CSV file.
+    """
+    with np.load(dwell_path) as dwell_times, open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["stimulus", "views"] + ["dwell_{}_correlation".format(metric) for metric in METRICS])
+
+        for name in sorted(set(tensors) & set(dwell_times.files)):
+            dwell = dwell_times[name]
+            if dwell.shape != tensors[name]["psnr"].shape:
+                print("Skipping the correlation of {}: the dwell times have another grid".format(name))
+                continue
+
+            row = [name]
+            for metric in METRICS:
+                values = tensors[name][metric]
+                # Identical views have an infinite PSNR
+                valid = np.isfinite(values)
+                if metric == METRICS[0]:
+                    row.append(int(valid.sum()))
+                x, y = dwell[valid], values[valid]
+                row.append(_format(np.corrcoef(x, y)[0, 1]) if len(x) > 1 and x.std() > 0 and y.std() > 0 else "")
+            writer.writerow(row)
+
+
+def _format(value):
+    return "" if np.isnan(value) else "{:.4f}".format(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Computes the PSNR and SSIM of the views of the stimuli.")
+    parser.add_argument("paths", nargs="*", default=["session.json"],
+                        help="manifests of sessions, or names of test images")
+    parser.add_argument("--out", default="analytics/", help="folder where the results are written")
+    parser.add_argument("--nb-img-x", type=int, default=DEFAULT_GRID.nb_img_x)
+    parser.add_argument("--nb-img-y", type=int, default=DEFAULT_GRID.nb_img_y)
+    parser.add_argument("--nb-img-depth", type=int, default=DEFAULT_GRID.nb_img_depth)
+    parser.add_argument("--top-left", type=int, nargs=2, default=DEFAULT_GRID.top_left)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    grid = Grid(args.nb_img_x, args.nb_img_y, args.nb_img_depth, tuple(args.top_left))
+    stimuli = find_stimuli(args.paths, grid)
+
+    os.makedirs(args.out, exist_ok=True)
+    cache_path = os.path.join(args.out, CACHE_FILE)
+    cache = QualityCache.load(cache_path)
+    tensors, nb_computed = compute_tensors(stimuli, cache, args.processes)
+    cache.save(cache_path)
+
+    for metric in METRICS:
+        np.savez_compressed(os.path.join(args.out, "{}.npz".format(metric)),
+                            **{name: metrics[metric] for name, metrics in tensors.items()})
+    export_views(tensors, stimuli, os.path.join(args.out, "quality.csv"))
+
+    dwell_path = os.path.join(args.out, "dwell_times.npz")
+    if os.path.exists(dwell_path):
+        export_dwell_correlation(tensors, dwell_path, os.path.join(args.out, "quality_dwell.csv"))
+
+    print("{} stimuli, {} views ({} compared, the others from the cache), results written in {}".format(
+        len(stimuli), sum(int((~np.isnan(m["psnr"])).sum()) for m in tensors.values()), nb_computed, args.out))
@@ -0,0 +1,112 @@
+#   test_image_loader.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Headless tests of the loading of the views when an image file is corrupt or the loader is cancelled.
+
+Usage:
+    python -m unittest discover tests   (from the folder of app.py)
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import wait
+
+import headless
+from ImageLoader import ImageLoader
+from LFImage import LFImage
+from ViewCache import view_cache
+from benchmark import generate_light_field, REF_IMG_NAME, TEST_IMG_NAME
+from helper import IMG_PATH_PREFIX, IMG_FORMAT, Helper
+
+NB_IMG_X, NB_IMG_Y, NB_IMG_DEPTH, TOP_LEFT = 3, 3, 3, (3, 3)
+
+
+class ImageLoaderTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.workdir = tempfile.mkdtemp()
+        os.chdir(cls.workdir)
+        generate_light_field(NB_IMG_X, NB_IMG_Y, NB_IMG_DEPTH, TOP_LEFT, (40, 30), packed=False)
+        cls.root = headless.install()
+
+    @classmethod
+    def tearDownClass(cls):
+        ImageLoader.shutdown(wait=True)
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.workdir)
+
+    def create_image(self):
+        lf = LFImage(TEST_IMG_NAME, NB_IMG_X, NB_IMG_Y, NB_IMG_DEPTH, TOP_LEFT)
+        lf.set_panels([headless.HeadlessPanel()])
+        lf.set_test_image_side(Helper.Side.LEFT)
+        lf.set_view_size(None)
+        view_cache.set_current(*lf.test_img_names, REF_IMG_NAME)
+        return lf
+
+    def test_corrupt_view(self):
+        lf = self.create_image()
+        base = lf.base_img
+        path = "{}{}/{:03}_{:03}.{}".format(IMG_PATH_PREFIX, TEST_IMG_NAME, base.u, base.v, IMG_FORMAT)
+        backup = path + ".bak"
+        shutil.copyfile(path, backup)
+        try:
+            with open(path, "wb") as f:
+                f.write(b"\x89PNG\r\n\x1a\n corrupt")
+
+            lf.load_images(Helper.IQA.SINGLE_STIMULUS)
+            self.root.run(until=lambda: lf.is_loaded, timeout=30)
+            # The base view is needed to interact, its failure must not block the subject
+            self.assertTrue(lf.is_loaded)
+            self.root.run(until=lambda: lf.is_fully_loaded, timeout=30)
+            self.assertTrue(lf.is_fully_loaded)
+            self.assertTrue(lf.is_view_unavailable(base))
+
+            # The closest view is displayed instead, without decoding the corrupt file again
+            lf.update_images()
+            self.assertIsNotNone(lf.cur_img)
+            self.assertNotEqual(lf.cur_img, base)
+            self.assertIsNotNone(lf.panels[0].image)
+        finally:
+            lf.clear_memory()
+            os.replace(backup, path)
+
+    def test_cancel_releases_decoded_images(self):
+        loader = ImageLoader(self.root, lambda key, view: self.fail("image loaded after cancel()"))
+        for u in range(TOP_LEFT[0], TOP_LEFT[0] + NB_IMG_X):
+            for v in range(TOP_LEFT[1], TOP_LEFT[1] + NB_IMG_Y):
+                loader.add_file((u, v), "{}{}/{:03}_{:03}.{}".format(IMG_PATH_PREFIX, TEST_IMG_NAME, u, v, IMG_FORMAT))
+        loader.start()
+        futures = set(loader.futures)
+        loader.cancel()
+
+        # The tasks already running end after cancel(), their results must not be kept
+        wait(futures, timeout=30)
+        time.sleep(0.1)
+        self.assertTrue(loader.decoded.empty())
+        self.root.run(timeout=0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+#   tracking_analytics.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Computes how long the subjects looked at each sub-aperture image, from the tracking files of many sessions.
+
+For each stimulus, the dwell times are summed in a tensor of shape (nb_img_x, nb_img_y, nb_img_depth + 1):
+tensor[i, j, 0] is the time spent on the perspective image (top_left[0] + i, top_left[1] + j), and
+tensor[i, j, d + 1] the time spent on the image of this viewpoint refocused at depth d.
+
+Usage:
+    python tracking_analytics.py [--out analytics/] [output/ or tracking files...]
+"""
+
+import argparse
+import csv
+import glob
+import os
+from collections import namedtuple
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+import TrackingLog
+
+# Dimensions of the light-field images, see LFImage
+Grid = namedtuple("Grid", ["nb_img_x", "nb_img_y", "nb_img_depth", "top_left"])
+DEFAULT_GRID = Grid(9, 9, 11, (3, 3))
+
+
+def parse_tracking_file(path):
+    """Reads the events of a tracking file, either a binary log (.bin) or a text file (.txt).
+
+    :param path: The path of the tracking file.
+    :return: A tuple (stimuli, columns): the list of the stimulus names, and a dict of arrays
+             "stimulus" (index in stimuli), "u", "v", "depth" (-1 for perspective images) and "dwell" (in seconds).
+    """
+    if path.endswith(".bin"):
+        events, metadata = TrackingLog.read(path)
+        return metadata["stimuli"], {"stimulus": events["stimulus"].astype(np.intp),
+                                     "u": events["u"].astype(np.intp),
+                                     "v": events["v"].astype(np.intp),
+                                     "depth": events["depth"].astype(np.intp),
+                                     "dwell": (events["end"] - events["start"]) / 1e9}
+
+    stimuli = []
+    stimulus_index = {}
+    columns = {"stimulus": [], "u": [], "v": [], "depth": [], "dwell": []}
+
+    with open(path) as f:
+        for line in f:
+            # e.g. "I01R1/003_004.png  start: 10:22:58.754722  end: 10:22:58.785534  on-screen: 0:00:00.030812"
+            parts = line.split()
+            if len(parts) != 7:
+                continue
+
+            stimulus, file_name = parts[0].split("/")
+            coordinates = file_name.split(".")[0].split("_")
+            hours, minutes, seconds = parts[6].split(":")
+
+            if stimulus not in stimulus_index:
+                stimulus_index[stimulus] = len(stimuli)
+                stimuli.append(stimulus)
+
+            columns["stimulus"].append(stimulus_index[stimulus])
+            columns["u"].append(int(coordinates[0]))
+            columns["v"].append(int(coordinates[1]))
+            columns["depth"].append(int(coordinates[2]) if len(coordinates) == 3 else TrackingLog.NO_DEPTH)
+            columns["dwell"].append(int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+
+    return stimuli, {name: np.array(values, dtype=np.float64 if name == "dwell" else np.intp)
+                     for name, values in columns.items()}
+
+
+def dwell_tensors(path, grid=DEFAULT_GRID):
+    """Computes the dwell-time tensors of one tracking file.
+
+    :param path: The path of the tracking file.
+    :param grid: The dimensions of the light-field images.
+    :return: A dict mapping each stimulus name to its dwell-time tensor.
+    """
+    stimuli, columns = parse_tracking_file(path)
+
+    x = columns["u"] - grid.top_left[0]
+    y = columns["v"] - grid.top_left[1]
+    z = columns["depth"] + 1
+    inside = (x >= 0) & (x < grid.nb_img_x) & (y >= 0) & (y < grid.nb_img_y) & (z >= 0) & (z <= grid.nb_img_depth)
+
+    tensors = np.zeros((len(stimuli), grid.nb_img_x, grid.nb_img_y, grid.nb_img_depth + 1))
+    np.add.at(tensors, (columns["stimulus"][inside], x[inside], y[inside], z[inside]), columns["dwell"][inside])
+
+    # A stimulus may appear several times in a session, its tensors are summed
+    result = {}
+    for i, name in enumerate(stimuli):
+        result[name] = result[name] + tensors[i] if name in result else tensors[i]
+    return result
+
+
+def _dwell_tensors_worker(args):
+    path, grid = args
+    try:
+        return path, dwell_tensors(path, grid), None
+    except Exception as e:
+        return path, None, "{}: {}".format(type(e).__name__, e)
+
+
+def aggregate(paths, grid=DEFAULT_GRID, processes=None):
+    """Parses tracking files in parallel and sums their dwell-time tensors per stimulus.
+
+    Only the running sums are kept in memory, so the memory used does not grow with the number of files.
+
+    :param paths: The paths of the tracking files.
+    :param grid: The dimensions of the light-field images.
+    :param processes: The number of worker processes. If it is None, the number of CPUs is used.
+    :return: A dict mapping each stimulus name to a tuple (sum of the dwell-time tensors, number of sessions).
+    """
+    totals = {}
+
+    with Pool(processes) as pool:
+        for path, tensors, error in pool.imap_unordered(_dwell_tensors_worker, [(p, grid) for p in paths],
+                                                        chunksize=8):
+            if error is not None:
+                print("Skipping {} ({})".format(path, error))
+                continue
+
+            for name, tensor in tensors.items():
+                if name in totals:
+                    total, nb_sessions = totals[name]
+                    totals[name] = (total + tensor, nb_sessions + 1)
+                else:
+                    totals[name] = (tensor, 1)
+
+    return totals
+
+
+def find_tracking_files(paths):
+    """Returns the tracking files given, looking for them in the folders given.
+
+    If a session has both a binary log and its text conversion, only the binary log is kept.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += glob.glob(os.path.join(path, "*-tracking.bin"))
+            files += [f for f in glob.glob(os.path.join(path, "*-tracking.txt"))
+                      if not os.path.exists(f[:-len(".txt")] + ".bin")]
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def export_heatmaps(totals, folder, scale=32):
+    """Writes, for each stimulus, a grey-level image of the time spent on each viewpoint (all depths included).
+
+    :param totals: The result of aggregate().
+    :param folder: The folder in which the images are written.
+    :param scale: The size in pixels of a viewpoint in the images.
+    """
+    os.makedirs(folder, exist_ok=True)
+
+    for name, (total, _) in totals.items():
+        heatmap = total.sum(axis=2).T  # rows are v, columns are u
+        if heatmap.max() > 0:
+            heatmap = heatmap / heatmap.max()
+        img = Image.fromarray((heatmap * 255).astype(np.uint8), "L")
+        img = img.resize((img.size[0] * scale, img.size[1] * scale), Image.NEAREST)
+        img.save(os.path.join(folder, "{}-heatmap.png".format(name)))
+
+
+def export_summary(totals, path, grid=DEFAULT_GRID):
+    """Writes a CSV table summarizing the dwell times of each stimulus.
+
+    :param totals: The result of aggregate().
+    :param path: The path of the CSV file.
+    :param grid: The dimensions of the light-field images.
+    """
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["stimulus", "sessions", "mean_time", "mean_perspective_time", "mean_refocus_time",
+                         "viewpoints_visited", "most_viewed_u", "most_viewed_v", "most_viewed_depth"])
+
+        for name in sorted(totals):
+            total, nb_sessions = totals[name]
+            mean = total / nb_sessions
+            per_viewpoint = total.sum(axis=2)
+            u, v = np.unravel_index(per_viewpoint.argmax(), per_viewpoint.shape)
+            depth = total[:, :, 1:].sum(axis=(0, 1))
+
+            writer.writerow([name, nb_sessions,
+                             "{:.3f}".format(mean.sum()),
+                             "{:.3f}".format(mean[:, :, 0].sum()),
+                             "{:.3f}".format(mean[:, :, 1:].sum()),
+                             int((per_viewpoint > 0).sum()),
+                             u + grid.top_left[0], v + grid.top_left[1],
+                             int(depth.argmax()) if depth.sum() > 0 else ""])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Computes dwell-time maps from tracking files.")
+    parser.add_argument("paths", nargs="*", default=["output/"], help="tracking files or folders containing them")
+    parser.add_argument("--out", default="analytics/", help="folder where the results are written")
+    parser.add_argument("--nb-img-x", type=int, default=DEFAULT_GRID.nb_img_x)
+    parser.add_argument("--nb-img-y", type=int, default=DEFAULT_GRID.nb_img_y)
+    parser.add_argument("--nb-img-depth", type=int, default=DEFAULT_GRID.nb_img_depth)
+    parser.add_argument("--top-left", type=int, nargs=2, default=DEFAULT_GRID.top_left)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    grid = Grid(args.nb_img_x, args.nb_img_y, args.nb_img_depth, tuple(args.top_left))
+    files = find_tracking_files(args.paths)
+    totals = aggregate(files, grid, args.processes)
+
+    os.makedirs(args.out, exist_ok=True)
+    np.savez_compressed(os.path.join(args.out, "dwell_times.npz"),
+                        **{name: total for name, (total, _) in totals.items()})
+    export_heatmaps(totals, args.out)
+    export_summary(totals, os.path.join(args.out, "summary.csv"), grid)
+
+    print("{} tracking files, {} stimuli, results written in {}".format(len(files), len(totals), args.out))
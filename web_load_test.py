@@ -0,0 +1,191 @@
+#   web_load_test.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Load test of the web front end (see web_server.py): simulated subjects run whole test sessions at the same time.
+
+Each simulated subject opens a WebSocket, then for each stimulus drags the mouse from viewpoint to viewpoint at a
+given rate, refocuses from time to time, and answers. Like a browser, it downloads each view it is sent once, over
+a keep-alive HTTP connection. The latency between each event and the view received in response, the download
+time of the views and the throughput of the server are reported.
+
+Usage:
+    python web_load_test.py [--host HOST] [--port PORT] [--subjects N] [--moves N] [--rate HZ]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import WebSocket
+from Instrumentation import LatencyHistogram
+
+# Fraction of the events that refocus instead of moving to another viewpoint
+REFOCUS_PROBABILITY = 0.1
+
+
+class LoadTestResults:
+    """Measurements shared by all the simulated subjects."""
+
+    def __init__(self):
+        self.event_latencies = LatencyHistogram()
+        self.download_times = LatencyHistogram()
+        self.nb_bytes = 0
+        self.nb_sessions = 0
+        self.nb_errors = 0
+
+    def report(self, duration):
+        return "\n".join([
+            "Sessions completed:   {} ({} errors) in {:.1f} s".format(self.nb_sessions, self.nb_errors, duration),
+            "Event -> view:        {}".format(self.event_latencies.summary()),
+            "View download:        {}".format(self.download_times.summary()),
+            "Throughput:           {:.0f} events/s, {:.0f} views/s, {:.1f} MB/s".format(
+                self.event_latencies.count / duration, self.download_times.count / duration,
+                self.nb_bytes / duration / 1024 ** 2)])
+
+
+class HttpConnection:
+    """Keep-alive HTTP connection downloading views."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def get(self, target):
+        """Downloads a resource and returns its body."""
+
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        self.writer.write("GET {} HTTP/1.1\r\nHost: {}:{}\r\n\r\n".format(target, self.host, self.port)
+                          .encode("ascii"))
+        await self.writer.drain()
+
+        result = await WebSocket.read_headers(self.reader)
+        if result is None:
+            raise ConnectionError("connection closed by the server")
+        status_line, headers = result
+        body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if status_line.split(" ")[1] != "200":
+            raise ValueError("{}: {}".format(target, status_line))
+
+        return body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def run_subject(host, port, subject, nb_moves, rate, results):
+    """Runs the test session of a simulated subject."""
+
+    websocket = await WebSocket.connect(host, port, "/ws?subject={}".format(subject))
+    http = HttpConnection(host, port)
+    downloaded = set()
+    rng = random.Random(subject)
+
+    async def receive():
+        """Returns the next message that is not an error, downloading the views it gives."""
+
+        while True:
+            message = await websocket.recv()
+            if message is None:
+                raise ConnectionError("connection closed by the server")
+            data = json.loads(message)
+            if data["type"] == "error":
+                results.nb_errors += 1
+                continue
+
+            if data["type"] == "view":
+                for url in (data["test"], data["reference"]):
+                    if url is not None and url not in downloaded:
+                        downloaded.add(url)
+                        start = time.perf_counter_ns()
+                        results.nb_bytes += len(await http.get(url))
+                        results.download_times.add(time.perf_counter_ns() - start)
+            return data
+
+    try:
+        stimulus = await receive()
+        while stimulus["type"] == "stimulus":
+            view = await receive()
+            top_left, unit = stimulus["top_left"], stimulus["unit"]
+
+            for _ in range(nb_moves):
+                await asyncio.sleep(rng.expovariate(rate))
+                start = time.perf_counter_ns()
+
+                if rng.random() < REFOCUS_PROBABILITY:
+                    depths = [d for d in range(stimulus["nb_img_depth"]) if d != view["focus_depth"]]
+                    await websocket.send(json.dumps({"type": "refocus", "depth": rng.choice(depths)}))
+                else:
+                    # Drag to a neighbour viewpoint, from a click at the origin
+                    u, v = view["u"], view["v"]
+                    neighbours = [(u + du, v + dv) for du in (-1, 0, 1) for dv in (-1, 0, 1)
+                                  if (du, dv) != (0, 0) or view["focus_depth"] is not None]
+                    neighbours = [(nu, nv) for nu, nv in neighbours
+                                  if top_left[0] <= nu < top_left[0] + stimulus["nb_img_x"] and
+                                  top_left[1] <= nv < top_left[1] + stimulus["nb_img_y"]]
+                    nu, nv = rng.choice(neighbours)
+                    await websocket.send(json.dumps({"type": "click", "x": 0, "y": 0}))
+                    await websocket.send(json.dumps({"type": "move", "x": (u - nu) * unit, "y": (v - nv) * unit}))
+
+                view = await receive()
+                results.event_latencies.add(time.perf_counter_ns() - start)
+
+            await websocket.send(json.dumps({"type": "answer", "answer": rng.choice(stimulus["answers"])}))
+            stimulus = await receive()
+
+        if stimulus["type"] == "end":
+            results.nb_sessions += 1
+            # Complete the closing handshake started by the server
+            await websocket.recv()
+    finally:
+        http.close()
+        websocket.writer.close()
+
+
+async def run(host, port, nb_subjects, nb_moves, rate):
+    results = LoadTestResults()
+    start = time.perf_counter()
+
+    outcomes = await asyncio.gather(*[run_subject(host, port, subject, nb_moves, rate, results)
+                                      for subject in range(nb_subjects)], return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            results.nb_errors += 1
+            print("Subject failed: {!r}".format(outcome))
+
+    print(results.report(time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs simulated subjects against a web_server.py server.")
+    parser.add_argument("--host", default="127.0.0.1", help="address of the server")
+    parser.add_argument("--port", type=int, default=8080, help="port of the server")
+    parser.add_argument("--subjects", type=int, default=30, help="number of simultaneous subjects")
+    parser.add_argument("--moves", type=int, default=50, help="number of events per stimulus and subject")
+    parser.add_argument("--rate", type=float, default=20, help="mean number of events per second and subject")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.host, args.port, args.subjects, args.moves, args.rate))
@@ -0,0 +1,556 @@
+#   web_server.py
+#   lf-tracking
+#
+#  Copyright (C) 2017 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE, Switzerland
+#  Multimedia Signal Processing Group
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Web front end running the test session of a manifest in browsers, for many subjects at the same time.
+
+Each subject opens http://<host>:<port>/?subject=<number> (the number sets the order of the stimuli, as with
+app.py). The page sends the mouse and slider events over a WebSocket, and the server answers with the URLs of the
+views to display. The views are encoded once in WEB_VIEW_FORMAT, kept in memory for all the subjects, and served
+with an ETag and an immutable Cache-Control, so that a browser downloads each view at most once.
+
+The tracking log and the answers file of each subject are written in OUTPUT_PATH_PREFIX as for a session run with
+app.py, named after the time the subject connected and the number of the connection (e.g. 2017.05.04-10.30.12-web3),
+by a DurableWriter shared by all the subjects. The tracking times are those at which the server sends the views.
+Unlike the desktop application, the preview is not shown and refocusing on a point does not animate the transition.
+
+Usage:
+    python web_server.py [session.json] [--host HOST] [--port PORT] [--view-size WIDTHxHEIGHT]
+"""
+
+import argparse
+import asyncio
+import datetime
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import WebSocket
+from DurableWriter import DurableWriter
+from ImageLoader import resample
+from LFContainer import open_image, find_packed_image
+from SessionManifest import SessionManifest
+from helper import OUTPUT_PATH_PREFIX, IMG_PATH_PREFIX, IMG_FORMAT, SYNTHETIC_REFOCUS, DEPTH_MEDIAN_RADIUS, \
+    WEB_VIEW_FORMAT, WEB_BLOB_CACHE_BUDGET, open_session_files, Helper
+
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "web", "index.html")
+
+# /view/<size>/<image name>/<file name>, size being "full" or e.g. "1024x768"
+VIEW_URL_PATTERN = re.compile(r"^/view/(full|\d+x\d+)/([\w.-]+)/(\d{3}_\d{3}(?:_\d+(?:\.\d)?)?)\.\w+$")
+
+CONTENT_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "jpg": "image/jpeg", "webp": "image/webp"}
+# Options of the encoders, chosen for speed: the views are sent over a local network
+ENCODER_OPTIONS = {"png": {"compress_level": 1}, "jpeg": {"quality": 95}, "webp": {"lossless": True, "method": 0}}
+
+
+class BlobCache:
+    """Encoded views, shared by all the subjects and evicted in least recently used order beyond a byte budget.
+
+    The views requested by the browsers are encoded by a pool of threads, and the views that will probably be
+    requested soon are encoded in advance by a single thread, so that they do not delay the requests.
+    A view requested while it is being encoded is only encoded once.
+    """
+
+    def __init__(self, images, view_size, budget=WEB_BLOB_CACHE_BUDGET):
+        """Initializes an empty cache.
+
+        :param images: Dictionary {name of a test or reference image: LFImage of a stimulus using it}, giving the
+                       images that can be requested.
+        :param view_size: The maximum size (width, height) of the views, or None to keep their original resolution.
+        :param budget: The maximum number of bytes of the encoded views kept in memory.
+        """
+        self.images = images
+        self.view_size = view_size
+        self.budget = budget
+
+        # img_path -> (blob, ETag)
+        self.blobs = OrderedDict()
+        self.nbytes = 0
+        # img_path -> asyncio.Future of the view being encoded
+        self.pending = {}
+
+        self.executor = ThreadPoolExecutor(os.cpu_count() or 1)
+        self.prefetch_executor = ThreadPoolExecutor(1)
+        # The refocusers keep state between calls
+        self.refocus_lock = threading.Lock()
+
+        self.nb_hits = 0
+        self.nb_misses = 0
+
+    def get_size_name(self):
+        """Returns the part of the URLs of the views giving their size, so that views of different sizes have
+        different URLs."""
+
+        return "full" if self.view_size is None else "{}x{}".format(*self.view_size)
+
+    def get_url(self, img_path):
+        """Returns the URL of a view.
+
+        :param img_path: The path of the image of the view, relative to IMG_PATH_PREFIX (e.g. "I01R1/003_004.png").
+        """
+        return "/view/{}/{}.{}".format(self.get_size_name(), os.path.splitext(img_path)[0], WEB_VIEW_FORMAT)
+
+    def parse_url(self, url):
+        """Returns the path of the image of a view (see get_url), or None if the URL is not the one of a view
+        of the session."""
+
+        match = VIEW_URL_PATTERN.match(url)
+        if match is None or match.group(1) != self.get_size_name() or match.group(2) not in self.images:
+            return None
+
+        return "{}/{}.{}".format(match.group(2), match.group(3), IMG_FORMAT)
+
+    async def get(self, img_path, prefetch=False):
+        """Returns the encoded view (blob, ETag) of an image, encoding it if needed.
+
+        :param img_path: The path of the image of the view, relative to IMG_PATH_PREFIX.
+        :param prefetch: True if the view is encoded in advance, which is done after the requested views.
+        """
+        entry = self.blobs.get(img_path)
+        if entry is not None:
+            self.blobs.move_to_end(img_path)
+            self.nb_hits += not prefetch
+            return entry
+
+        future = self.pending.get(img_path)
+        if future is None:
+            self.nb_misses += not prefetch
+            executor = self.prefetch_executor if prefetch else self.executor
+            future = asyncio.get_running_loop().run_in_executor(executor, self.encode, img_path)
+            self.pending[img_path] = future
+            future.add_done_callback(lambda f: self.on_encoded(img_path, f))
+
+        # The encoding goes on if the subject who requested it disconnects
+        return await asyncio.shield(future)
+
+    def on_encoded(self, img_path, future):
+        del self.pending[img_path]
+        if not future.cancelled() and future.exception() is None:
+            self.put(img_path, future.result())
+
+    def prefetch(self, img_paths):
+        """Encodes views in advance, in the given order, unless they are requested in the meantime."""
+
+        async def run():
+            for img_path in img_paths:
+                if img_path not in self.blobs and img_path not in self.pending:
+                    try:
+                        await self.get(img_path, prefetch=True)
+                    except Exception:
+                        traceback.print_exc()
+
+        return asyncio.ensure_future(run())
+
+    def put(self, img_path, entry):
+        self.blobs[img_path] = entry
+        self.nbytes += len(entry[0])
+
+        while self.nbytes > self.budget and len(self.blobs) > 1:
+            _, (blob, _) = self.blobs.popitem(last=False)
+            self.nbytes -= len(blob)
+
+    def encode(self, img_path):
+        """Reads an image and encodes its view. This method runs in a thread of the executors.
+
+        :return: A tuple (blob, ETag).
+        """
+        folder, file_name = img_path.split("/")
+        coordinates = os.path.splitext(file_name)[0].split("_")
+
+        if SYNTHETIC_REFOCUS and len(coordinates) == 3:
+            with self.refocus_lock:
+                img = self.images[folder].get_refocuser(folder).refocus(float(coordinates[2]))
+        elif self.view_size is None and IMG_FORMAT.lower() == WEB_VIEW_FORMAT.lower() and \
+                find_packed_image(img_path) is None:
+            # The image file can be sent as it is
+            with open(IMG_PATH_PREFIX + img_path, "rb") as f:
+                blob = f.read()
+            return blob, _etag(blob)
+        else:
+            img = open_image(img_path)
+
+        img = resample(img, self.view_size)
+        # The colour views read from containers are RGBX, which the PNG encoder does not accept
+        if img.mode == "RGBX" or (WEB_VIEW_FORMAT.lower() in ("jpeg", "jpg") and img.mode not in ("L", "RGB")):
+            img = img.convert("RGB")
+
+        output = io.BytesIO()
+        img.save(output, WEB_VIEW_FORMAT, **ENCODER_OPTIONS.get(WEB_VIEW_FORMAT.lower(), {}))
+        blob = output.getvalue()
+        return blob, _etag(blob)
+
+    def stats(self):
+        """Returns a one-line description of the use of the cache."""
+
+        return "Blob cache: {} views, {:.1f} MB, {} hits, {} misses".format(
+            len(self.blobs), self.nbytes / 1024 ** 2, self.nb_hits, self.nb_misses)
+
+
+class WebSession:
+    """Test session of a subject connected with a WebSocket.
+
+    The messages received from the browser are JSON objects with a "type":
+        {"type": "click", "x": x, "y": y}            the mouse button was pressed at (x, y) (in screen pixels)
+        {"type": "move", "x": x, "y": y}             the mouse was dragged to (x, y)
+        {"type": "refocus", "depth": depth}          the focus slider was moved
+        {"type": "refocus_point", "x": x, "y": y}    a point was double-clicked, x and y being fractions of the
+                                                     width and height of the view
+        {"type": "answer", "answer": answer}         the subject answered
+    The server sends:
+        {"type": "stimulus", ...}                    a new stimulus starts, with the question, the answers and the
+                                                     URLs of all its views in the order they should be preloaded
+        {"type": "view", "test": url, "reference": url or null, "u": u, "v": v, "focus_depth": depth or null}
+        {"type": "end"}                              the session is over
+        {"type": "error", "message": message}        a message was ignored
+    """
+
+    def __init__(self, server, websocket, subject, session_name):
+        """Initializes the session of a subject.
+
+        :param server: The WebServer.
+        :param websocket: The WebSocket connected to the browser of the subject.
+        :param subject: The number of the subject, which sets the order of the stimuli (see SessionManifest).
+        :param session_name: The name of the session, which prefixes the names of its output files.
+        """
+        self.server = server
+        self.websocket = websocket
+        self.subject = subject
+        self.session_name = session_name
+        self.manifest = server.manifest
+        self.is_double_stimulus = self.manifest.assessment_method is Helper.IQA.DOUBLE_STIMULUS
+
+        self.images = self.manifest.create_images(subject)
+        for img in self.images:
+            img.set_view_size(server.view_size)
+            # The depth maps do not depend on the subject
+            img.depth_map = server.images[img.img_name].depth_map
+
+        self.img_index = 0
+        self.cur_img = self.images[0]
+        self.answers = [None] * len(self.images)
+        self.tracking_log, self.f_answers = open_session_files(session_name, server.writer)
+        self.is_closed = False
+
+    async def run(self):
+        """Runs the session until it ends or the browser disconnects."""
+
+        try:
+            await self.start_stimulus()
+
+            while True:
+                message = await self.websocket.recv()
+                if message is None:
+                    break
+
+                try:
+                    event = json.loads(message)
+                    handler = getattr(self, "on_" + event["type"], None) if isinstance(event, dict) else None
+                    if handler is None:
+                        raise ValueError("unknown message {}".format(message[:100]))
+                    if await handler(event):
+                        break
+                except (ValueError, KeyError, TypeError) as e:
+                    await self.websocket.send(json.dumps({"type": "error", "message": str(e)}))
+        finally:
+            self.close()
+
+    async def start_stimulus(self):
+        """Shows the current stimulus from its base image."""
+
+        img = self.cur_img
+        self.tracking_log.start_stimulus(img.img_name)
+
+        # The views in the order they are loaded by the desktop application
+        order, _ = img.get_loading_order(show_preview=False)
+        img_paths = []
+        for view in order:
+            test_img_name, ref_img_name = img.get_img_names(view)
+            img_paths.append(test_img_name)
+            if self.is_double_stimulus:
+                img_paths.append(ref_img_name)
+        self.server.blobs.prefetch(img_paths)
+
+        test_side = self.manifest.test_image_side.name.lower() if self.is_double_stimulus else None
+        await self.websocket.send(json.dumps({
+            "type": "stimulus",
+            "index": self.img_index,
+            "count": len(self.images),
+            "question": self.manifest.question,
+            "answers": self.manifest.answers,
+            "answers_description": self.manifest.answers_description,
+            "test_side": test_side,
+            "nb_img_x": img.nb_img_x,
+            "nb_img_y": img.nb_img_y,
+            "nb_img_depth": img.nb_img_depth,
+            "top_left": img.top_left,
+            "unit": img.unit,
+            "synthetic_refocus": SYNTHETIC_REFOCUS,
+            "views": [self.server.blobs.get_url(img_path) for img_path in img_paths]}))
+
+        await self.show(img.base_img)
+
+    async def show(self, sub_img):
+        """Sends the view of a sub-aperture image of the current stimulus, if it is not already displayed.
+
+        :param sub_img: The SubapertureImage.
+        """
+        img = self.cur_img
+        if sub_img == img.cur_img:
+            return
+
+        img.close_img(self.tracking_log)
+        img.cur_img = img.next_img = sub_img
+
+        test_img_name, ref_img_name = img.get_img_names(sub_img)
+        await self.websocket.send(json.dumps({
+            "type": "view",
+            "test": self.server.blobs.get_url(test_img_name),
+            "reference": self.server.blobs.get_url(ref_img_name) if self.is_double_stimulus else None,
+            "u": sub_img.u,
+            "v": sub_img.v,
+            "focus_depth": sub_img.focus_depth}))
+
+    async def on_click(self, event):
+        self.cur_img.click((float(event["x"]), float(event["y"])))
+
+    async def on_move(self, event):
+        await self.show(self.cur_img.get_dragged_image((float(event["x"]), float(event["y"]))))
+
+    async def on_refocus(self, event):
+        depth = float(event["depth"])
+        if not 0 <= depth <= self.cur_img.nb_img_depth - 1:
+            raise ValueError("invalid depth {}".format(depth))
+        await self.show(self.cur_img.get_refocused_image(depth))
+
+    async def on_refocus_point(self, event):
+        x, y = float(event["x"]), float(event["y"])
+        depth_map = self.cur_img.depth_map
+        if depth_map.pyramid is None:
+            # Read once for all the subjects, without blocking the other sessions
+            await asyncio.get_running_loop().run_in_executor(self.server.blobs.executor, depth_map.get_pyramid)
+
+        width, height = depth_map.get_size()
+        depth = depth_map.depth_at(x * width, y * height, DEPTH_MEDIAN_RADIUS)
+        await self.show(self.cur_img.get_refocused_image(depth))
+
+    async def on_answer(self, event):
+        """Stores the answer and starts the next stimulus.
+
+        :return: True iff the session is over.
+        """
+        answer = event["answer"]
+        if answer not in self.manifest.answers:
+            raise ValueError("invalid answer {!r}".format(answer))
+
+        self.answers[self.img_index] = answer
+        self.f_answers.write("{:30}: {}\n".format(self.cur_img.img_name, answer))
+        self.f_answers.flush()
+
+        self.cur_img.close_img(self.tracking_log)
+        self.cur_img.cur_time = 0
+
+        if self.img_index >= len(self.images) - 1:
+            await self.websocket.send(json.dumps({"type": "end"}))
+            await self.websocket.close()
+            return True
+
+        self.img_index += 1
+        self.cur_img = self.images[self.img_index]
+        await self.start_stimulus()
+        return False
+
+    def close(self):
+        """Records the last image displayed and closes the output files of the session."""
+
+        if self.is_closed:
+            return
+        self.is_closed = True
+
+        if self.cur_img.cur_time != 0:
+            self.cur_img.close_img(self.tracking_log)
+        self.tracking_log.close()
+        self.f_answers.close()
+
+        nb_answers = sum(answer is not None for answer in self.answers)
+        print("Session {} (subject {}) ended: {}/{} answers".format(
+            self.session_name, self.subject, nb_answers, len(self.answers)))
+
+
+class WebServer:
+    """Serves the web page, the views and the WebSockets of the subjects."""
+
+    def __init__(self, manifest, view_size=None):
+        """Initializes a server.
+
+        :param manifest: The SessionManifest of the test session.
+        :param view_size: The maximum size (width, height) of the views, or None to keep their original resolution.
+        """
+        self.manifest = manifest
+        self.view_size = view_size
+
+        # One light-field image per test and reference image, whose depth maps and refocusers are shared
+        self.images = {}
+        for img in manifest.create_images():
+            img.set_view_size(view_size)
+            self.images.setdefault(img.img_name, img)
+            self.images.setdefault(img.reference_img_name, img)
+
+        self.blobs = BlobCache(self.images, view_size)
+
+        if not os.path.exists(OUTPUT_PATH_PREFIX):
+            os.makedirs(OUTPUT_PATH_PREFIX)
+        self.timestamp = datetime.datetime.now().strftime('%Y.%m.%d-%H.%M.%S')
+        self.writer = DurableWriter(OUTPUT_PATH_PREFIX + self.timestamp + '-web-journal.txt')
+
+        with open(INDEX_PATH, "rb") as f:
+            self.index_html = f.read()
+
+        self.nb_sessions = 0
+        self.sessions = set()
+
+    async def handle_connection(self, reader, writer):
+        """Handles the HTTP requests of a connection, which may be upgraded to a WebSocket."""
+
+        try:
+            while True:
+                request = await WebSocket.read_request(reader)
+                if request is None:
+                    break
+
+                if request.method != "GET":
+                    WebSocket.write_response(writer, "405 Method Not Allowed", [("Allow", "GET")])
+                elif request.path == "/ws" and request.is_websocket():
+                    await self.run_session(request, await WebSocket.accept(request, reader, writer))
+                    break
+                elif request.path == "/":
+                    WebSocket.write_response(writer, "200 OK", [("Content-Type", "text/html; charset=utf-8"),
+                                                                ("Cache-Control", "no-cache")], self.index_html)
+                elif request.path.startswith("/view/"):
+                    await self.serve_view(request, writer)
+                else:
+                    WebSocket.write_response(writer, "404 Not Found")
+
+                await writer.drain()
+                if not request.keep_alive():
+                    break
+        except (WebSocket.ProtocolError, ConnectionError) as e:
+            print("Connection closed: {}".format(e))
+        except Exception:
+            traceback.print_exc()
+        finally:
+            writer.close()
+
+    async def serve_view(self, request, writer):
+        img_path = self.blobs.parse_url(request.path)
+        if img_path is None:
+            WebSocket.write_response(writer, "404 Not Found")
+            return
+
+        try:
+            blob, etag = await self.blobs.get(img_path)
+        except (OSError, KeyError, ValueError) as e:
+            print("Cannot encode {}: {}".format(img_path, e))
+            WebSocket.write_response(writer, "404 Not Found")
+            return
+
+        # The URLs of the views depend on their size, so their content never changes
+        headers = [("ETag", etag), ("Cache-Control", "public, max-age=31536000, immutable")]
+        if request.headers.get("if-none-match") == etag:
+            WebSocket.write_response(writer, "304 Not Modified", headers)
+        else:
+            headers.append(("Content-Type", CONTENT_TYPES.get(WEB_VIEW_FORMAT.lower(), "application/octet-stream")))
+            WebSocket.write_response(writer, "200 OK", headers, blob)
+
+    async def run_session(self, request, websocket):
+        """Runs the test session of the subject who opened a WebSocket."""
+
+        try:
+            subject = int(request.query["subject"]) if "subject" in request.query else None
+        except ValueError:
+            await websocket.send(json.dumps({"type": "error", "message": "invalid subject number"}))
+            await websocket.close()
+            return
+
+        self.nb_sessions += 1
+        session_name = "{}-web{}".format(self.timestamp, self.nb_sessions)
+        session = WebSession(self, websocket, subject, session_name)
+        print("Session {} (subject {}) started, {} running".format(session_name, subject, len(self.sessions) + 1))
+
+        self.sessions.add(session)
+        try:
+            await session.run()
+        finally:
+            self.sessions.discard(session)
+
+    def close(self):
+        """Closes the output files of the sessions still running."""
+
+        for session in list(self.sessions):
+            session.close()
+        self.writer.close()
+        print(self.blobs.stats())
+
+
+def _etag(blob):
+    return '"{}"'.format(hashlib.sha1(blob).hexdigest()[:20])
+
+
+async def serve(server, host, port):
+    """Accepts connections until the task is cancelled."""
+
+    tcp_server = await asyncio.start_server(server.handle_connection, host, port)
+    print("Serving the session on http://{}:{}/?subject=<number>".format(host, port))
+
+    async with tcp_server:
+        await tcp_server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a test session in web browsers.")
+    parser.add_argument("manifest", nargs="?", default="session.json", help="the manifest of the session")
+    parser.add_argument("--host", default="0.0.0.0", help="address on which the server listens")
+    parser.add_argument("--port", type=int, default=8080, help="port on which the server listens")
+    parser.add_argument("--view-size", help="maximum size of the views, e.g. 1024x768 (default: original size)")
+    parser.add_argument("--full-check", action="store_true", help="check every image file again before starting")
+    args = parser.parse_args()
+
+    manifest = SessionManifest(args.manifest)
+    if manifest.assessment_method is Helper.IQA.MULTI_STIMULUS:
+        sys.exit("{}: the multi stimulus method is not supported by the web front end".format(args.manifest))
+    problems = manifest.check_files(args.full_check)
+    if problems:
+        for problem in problems:
+            print(problem)
+        sys.exit("{} problem(s) found in the files of {}".format(len(problems), args.manifest))
+
+    view_size = tuple(int(n) for n in args.view_size.split("x")) if args.view_size else None
+    web_server = WebServer(manifest, view_size)
+    try:
+        asyncio.run(serve(web_server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        web_server.close()